@@ -0,0 +1,126 @@
+# answer_cache.py
+"""
+In-process answer cache in front of process_query_and_log.
+
+- exact match on normalised query text
+- optional near-duplicate match on the query embedding (cosine >= threshold)
+- entries are scoped (collection + index version), so a rebuilt index never
+  serves stale answers
+- TTL expiry, LRU eviction, hit/miss counters
+"""
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))            # seconds
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "512"))
+# 0 disables the similarity match; ~0.95 catches rephrasings of the same question
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0"))
+
+
+def normalize_query(query: str) -> str:
+    q = " ".join(query.lower().split())
+    return re.sub(r"[\s?.!]+$", "", q)
+
+
+class AnswerCache:
+    def __init__(self, ttl=None, max_entries=None, similarity_threshold=None, embed_fn=None):
+        self.ttl = ANSWER_CACHE_TTL if ttl is None else ttl
+        self.max_entries = ANSWER_CACHE_MAX_ENTRIES if max_entries is None else max_entries
+        self.similarity_threshold = ANSWER_CACHE_SIMILARITY if similarity_threshold is None else similarity_threshold
+        self.embed_fn = embed_fn
+
+        self._entries = OrderedDict()   # (scope, normalized) -> entry dict, LRU order
+        self._lock = threading.Lock()
+        self.stats_counts = {"exact_hits": 0, "similar_hits": 0, "misses": 0, "expired": 0, "evicted": 0}
+
+    @property
+    def semantic(self):
+        return self.embed_fn is not None and self.similarity_threshold > 0
+
+    def _embed(self, text):
+        v = np.asarray(self.embed_fn([text])[0], dtype=np.float32)
+        return v / max(float(np.linalg.norm(v)), 1e-12)
+
+    def _expired(self, entry, now):
+        return self.ttl > 0 and now - entry["created"] > self.ttl
+
+    def _drop_expired_locked(self, now):
+        for key in [k for k, e in self._entries.items() if self._expired(e, now)]:
+            del self._entries[key]
+            self.stats_counts["expired"] += 1
+
+    # =========================
+    # LOOKUP / STORE
+    # =========================
+    def get(self, query, scope):
+        """
+        Returns a copy of the cached entry ({"answer", "log_path", "match",
+        "similarity", ...}) or None.
+        """
+        key = (scope, normalize_query(query))
+        now = time.time()
+        with self._lock:
+            self._drop_expired_locked(now)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                entry["hits"] += 1
+                self.stats_counts["exact_hits"] += 1
+                return dict(entry, match="exact", similarity=1.0)
+            candidates = [(k, e) for k, e in self._entries.items()
+                          if k[0] == scope and e.get("vector") is not None]
+
+        if self.semantic and candidates:
+            v = self._embed(normalize_query(query))
+            sims = np.array([float(v @ e["vector"]) for _, e in candidates])
+            best = int(sims.argmax())
+            if sims[best] >= self.similarity_threshold:
+                k, entry = candidates[best]
+                with self._lock:
+                    if k in self._entries:
+                        self._entries.move_to_end(k)
+                        entry["hits"] += 1
+                        self.stats_counts["similar_hits"] += 1
+                        return dict(entry, match="similar", similarity=float(sims[best]))
+
+        with self._lock:
+            self.stats_counts["misses"] += 1
+        return None
+
+    def put(self, query, scope, answer, log_path=None):
+        normalized = normalize_query(query)
+        vector = self._embed(normalized) if self.semantic else None
+        with self._lock:
+            self._entries[(scope, normalized)] = {
+                "query": query,
+                "answer": answer,
+                "log_path": log_path,
+                "vector": vector,
+                "created": time.time(),
+                "hits": 0,
+            }
+            self._entries.move_to_end((scope, normalized))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats_counts["evicted"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    # =========================
+    # STATS
+    # =========================
+    def stats(self):
+        with self._lock:
+            s = dict(self.stats_counts)
+            s["entries"] = len(self._entries)
+        hits = s["exact_hits"] + s["similar_hits"]
+        lookups = hits + s["misses"]
+        s["hit_rate"] = hits / lookups if lookups else 0.0
+        return s
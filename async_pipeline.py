@@ -0,0 +1,229 @@
+# async_pipeline.py
+"""
+asyncio versions of the query paths in query_pipeline.py, for serving many
+concurrent sessions from one process (query_api.py):
+
+  - LLM calls go through AsyncLLMClient (httpx), so a slow OpenRouter
+    response holds a coroutine, not a thread
+  - Chroma / BM25 / table lookups, context packing and log writes stay
+    synchronous and run in the loop's default executor (asyncio.to_thread,
+    which also carries the active trace into the thread)
+  - sub-answers run concurrently with asyncio.gather
+  - cancelling the task (e.g. the client went away) cancels in-flight LLM
+    requests; a lookup already running in a thread finishes and is discarded.
+    The partial log is still written (in a thread), marked CANCELLED.
+  - query_slot() is a per-process limit on queries in flight
+    (QUERY_MAX_CONCURRENCY); callers wait up to QUERY_QUEUE_TIMEOUT for a slot
+
+Prompts, routing, retrieval and logs are shared with query_pipeline.py, so
+both produce the same answers and log files.
+"""
+import os
+import time
+import asyncio
+import weakref
+from contextlib import asynccontextmanager
+
+from llm_client import get_async_llm_client, LLMError
+from query_pipeline import (
+    MODEL_NAME, OPENROUTER_API_KEY, LLM_ONLY_ROUTER, make_log_paths, build_full_text_log, write_query_log,
+    run_table_query, retrieve_simple, retrieve_subqueries, retrieve_single_step, pack_subquery_context,
+    table_answer_prompt, simple_answer_prompt, subquery_prompt, synthesis_prompt, single_step_prompt,
+    save_last_prompt,
+)
+from tracing import TRACING, span, start_trace
+
+QUERY_MAX_CONCURRENCY = int(os.getenv("QUERY_MAX_CONCURRENCY", "64"))
+QUERY_QUEUE_TIMEOUT = float(os.getenv("QUERY_QUEUE_TIMEOUT", "30"))
+
+
+class QueryBusy(Exception):
+    """Raised when no query slot frees up within QUERY_QUEUE_TIMEOUT."""
+
+
+# ===========================
+# CONCURRENCY LIMIT
+# ===========================
+_slots = weakref.WeakKeyDictionary()   # event loop -> Semaphore
+
+
+@asynccontextmanager
+async def query_slot(timeout=None):
+    """Holds one of QUERY_MAX_CONCURRENCY per-process query slots for the block."""
+    loop = asyncio.get_running_loop()
+    sem = _slots.get(loop)
+    if sem is None:
+        sem = _slots[loop] = asyncio.Semaphore(QUERY_MAX_CONCURRENCY)
+    timeout = QUERY_QUEUE_TIMEOUT if timeout is None else timeout
+    try:
+        await asyncio.wait_for(sem.acquire(), timeout)
+    except asyncio.TimeoutError:
+        raise QueryBusy(f"all {QUERY_MAX_CONCURRENCY} query slots busy for {timeout:g}s")
+    try:
+        yield
+    finally:
+        sem.release()
+
+
+@asynccontextmanager
+async def query_trace(qid=None):
+    """start_trace for coroutines: METRICS_FILE is refreshed in a thread, not on the loop."""
+    try:
+        with start_trace(qid, write_textfile=False) as trace:
+            yield trace
+    finally:
+        if TRACING:
+            # shielded so a cancelled query still records its metrics
+            await asyncio.shield(asyncio.to_thread(trace.metrics.write_textfile))
+
+
+# ===========================
+# LLM CALLS
+# ===========================
+async def call_llm(prompt: str, timeout: int = 40, call_type: str = "llm") -> str:
+    if not OPENROUTER_API_KEY:
+        return "ERROR: OPENROUTER_API_KEY not set in environment."
+    with span(f"llm.{call_type}", prompt_chars=len(prompt)) as s:
+        try:
+            result = await get_async_llm_client().chat(prompt, model=MODEL_NAME, timeout=timeout)
+        except LLMError as e:
+            s.update(failed=True, attempts=e.attempts)
+            return f"ERROR_CALLING_LLM: {str(e)} (after {e.attempts} attempts)"
+        s.update(completion_chars=len(result.text), prompt_tokens=result.prompt_tokens,
+                 completion_tokens=result.completion_tokens, attempts=result.attempts)
+        return result.text
+
+async def stream_llm(prompt: str, render, timeout: int = 40, call_type: str = "answer") -> str:
+    """
+    Streams the completion through `await render(tokens)`, where tokens is an
+    async iterator of deltas, and returns the full text.
+    """
+    parts = []
+
+    async def tokens():
+        if not OPENROUTER_API_KEY:
+            parts.append("ERROR: OPENROUTER_API_KEY not set in environment.")
+            yield parts[-1]
+            return
+        try:
+            async for delta in get_async_llm_client().stream_chat(prompt, model=MODEL_NAME, timeout=timeout):
+                if not parts:
+                    s["ttft_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+                parts.append(delta)
+                yield delta
+        except LLMError as e:
+            s.update(failed=True, attempts=e.attempts)
+            parts.append(("\n\n" if parts else "") + f"ERROR_CALLING_LLM: {str(e)} (after {e.attempts} attempts)")
+            yield parts[-1]
+
+    with span(f"llm.{call_type}", prompt_chars=len(prompt), streamed=True) as s:
+        t0 = time.perf_counter()
+        await render(tokens())
+        s["completion_chars"] = len("".join(parts))
+    return "".join(parts)
+
+async def call_final_llm(prompt: str, stream_to=None, call_type: str = "answer") -> str:
+    if stream_to is None:
+        return await call_llm(prompt, call_type=call_type)
+    return await stream_llm(prompt, stream_to, call_type=call_type)
+
+async def answer_subquery(sq: str, hits: list) -> tuple:
+    context, context_stats = await asyncio.to_thread(pack_subquery_context, hits)
+    sq_prompt = subquery_prompt(sq, context)
+    sq_response = await call_llm(sq_prompt, call_type="subquery_answer")
+    return sq_prompt, sq_response, context_stats
+
+# ===========================
+# ORCHESTRATORS
+# ===========================
+async def process_query_and_log(query: str, collection, stream_to=None, router=None, matcher=None, lexical=None,
+                                tables=None) -> tuple:
+    """
+    query_pipeline.process_query_and_log as a coroutine; stream_to, if given,
+    is a coroutine function taking an async iterator of answer tokens.
+    Returns (final_answer, log_path).
+    """
+    qid, txt_path = make_log_paths(query)
+    async with query_trace(qid) as trace:
+        llm_calls, decision, source = [], None, None
+
+        def write_log():
+            write_query_log(txt_path, build_full_text_log(qid, query, decision, llm_calls, source), trace)
+
+        try:
+            with span("router") as s:
+                route = await (router or LLM_ONLY_ROUTER).aroute(
+                    query, lambda p: call_llm(p, call_type="router_planner"),
+                )
+                s.update(decision=route.decision, source=route.source, subqueries=len(route.subqueries))
+            if route.prompt is not None:
+                llm_calls.append({"type": "router_planner", "prompt": route.prompt, "response": route.response})
+            decision, source, subqueries = route.decision, route.source, route.subqueries
+            trace.attrs.update(decision=decision, router_source=source)
+
+            # TABLE path, falling back to SIMPLE when no table fits
+            table_info = None
+            if decision == "table":
+                result = await asyncio.to_thread(run_table_query, tables, route.table_query)
+                if result is not None:
+                    table_prompt = table_answer_prompt(query, result.to_markdown())
+                    table_response = await call_final_llm(table_prompt, stream_to, call_type="table_answer")
+                    llm_calls.append({
+                        "type": "table_answer", "prompt": table_prompt, "response": table_response,
+                        "table": {"query": route.table_query, "result": result.describe()},
+                    })
+                    await asyncio.to_thread(write_log)
+                    return table_response, txt_path
+                table_info = {"query": route.table_query, "result": "no matching table; answered from retrieval"}
+
+            # SIMPLE path
+            if decision in ("simple", "table"):
+                where, context, context_stats = await asyncio.to_thread(
+                    retrieve_simple, query, collection, matcher, lexical,
+                )
+                answer_prompt = simple_answer_prompt(query, context)
+                answer_response = await call_final_llm(answer_prompt, stream_to, call_type="simple_answer")
+                llm_calls.append({
+                    "type": "simple_answer", "prompt": answer_prompt, "response": answer_response,
+                    "context": context_stats, "where": where, "table": table_info,
+                })
+                await asyncio.to_thread(write_log)
+                return answer_response, txt_path
+
+            # COMPLEX path: batched retrieval, sub-answers concurrently (in subquery order)
+            wheres, hits_per_sub = await asyncio.to_thread(
+                retrieve_subqueries, subqueries, collection, matcher, lexical,
+            )
+            results = await asyncio.gather(*(answer_subquery(sq, hits) for sq, hits in zip(subqueries, hits_per_sub)))
+
+            sub_answers = []
+            for i, (sq, where, (sq_prompt, sq_response, context_stats)) in enumerate(zip(subqueries, wheres, results), start=1):
+                llm_calls.append({
+                    "type": f"subquery_answer_{i}", "prompt": sq_prompt, "response": sq_response,
+                    "context": context_stats, "where": where,
+                })
+                sub_answers.append({"subquery": sq, "answer": sq_response})
+
+            synth_prompt = synthesis_prompt(query, sub_answers)
+            synth_response = await call_final_llm(synth_prompt, stream_to, call_type="final_synthesis")
+            llm_calls.append({"type": "final_synthesis", "prompt": synth_prompt, "response": synth_response})
+            await asyncio.to_thread(write_log)
+            return synth_response, txt_path
+        except asyncio.CancelledError:
+            # keep a record of what ran before the client went away
+            trace.attrs["cancelled"] = True
+            llm_calls.append({"type": "cancelled", "prompt": "", "response": "CANCELLED (client disconnected)"})
+            await asyncio.shield(asyncio.to_thread(write_log))
+            raise
+
+async def process_single_step(query: str, collection, stream_to=None, matcher=None, lexical=None,
+                              top_k=None) -> tuple:
+    """query_pipeline.process_single_step as a coroutine. Returns (answer, documents, metadatas)."""
+    async with query_trace():
+        docs, metas, context, context_stats = await asyncio.to_thread(
+            retrieve_single_step, query, collection, matcher, lexical, top_k,
+        )
+        prompt = single_step_prompt(query, context)
+        await asyncio.to_thread(save_last_prompt, prompt, context_stats)
+        answer = await call_final_llm(prompt, stream_to, call_type="answer")
+    return answer, docs, metas
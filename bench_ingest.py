@@ -0,0 +1,268 @@
+# bench_ingest.py
+"""
+Ingestion / indexing benchmark over synthetic factsheet workbooks
+(synth_workbook.py), at increasing sizes (default 1k / 10k / 100k data rows).
+
+Stages, each timed on its own in the main thread (so --profile sees them):
+
+  generate  write the synthetic .xlsx                       rows/sec
+  chunk     chunker.process_excel_file                      rows/sec
+  render    offline_build.iter_records (markdown + metadata) docs/sec
+  embed     the build's embedding function, EMBED_BATCH_SIZE batches, no cache
+                                                            docs/sec
+  insert    collection.add with precomputed embeddings      docs/sec
+  build     offline_build.main end to end (overlapped pipeline, fresh
+            embedding cache, side indexes)                  docs/sec
+
+plus the peak RSS seen during each stage (sampled from /proc where available,
+else the process-wide ru_maxrss).
+
+Everything is written under a scratch directory (removed unless --keep);
+results go to bench_results/ingest_<utc>.json. With --profile, each stage is
+run under cProfile and dumped to <results dir>/profiles/<rows>_<stage>.prof
+(inspect with `python -m pstats` or snakeviz). cProfile only sees the main
+thread, so the build profile covers loading / rendering, not its embed and
+write threads; the embed and insert stages profile those separately.
+
+    python bench_ingest.py --sizes 1000,10000 --stages chunk,embed,insert --profile
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import cProfile
+import platform
+import tempfile
+import argparse
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent
+RESULTS_DIR = BASE_DIR / "bench_results"
+
+SIZES = (1_000, 10_000, 100_000)
+STAGES = ("generate", "chunk", "render", "embed", "insert", "build")
+RSS_SAMPLE_SECONDS = 0.05
+
+
+# =========================
+# MEMORY
+# =========================
+def _rss_mb():
+    """Current RSS from /proc (Linux), else None."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _max_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+class RssSampler:
+    """Peak RSS while the block runs (background sampling; falls back to ru_maxrss)."""
+
+    def __init__(self, interval=RSS_SAMPLE_SECONDS):
+        self.interval = interval
+        self.peak = None
+        self._stop = threading.Event()
+
+    def _run(self):
+        while not self._stop.is_set():
+            rss = _rss_mb()
+            if rss is not None:
+                self.peak = max(self.peak or 0.0, rss)
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = _rss_mb()
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        if self.peak is None:
+            self.peak = _max_rss_mb()
+        return False
+
+
+# =========================
+# STAGES
+# =========================
+def timed(stage, rows, fn, items_of, profile_dir=None):
+    """Runs fn() as one stage; returns (result, stats)."""
+    profiler = cProfile.Profile() if profile_dir else None
+    with RssSampler() as rss:
+        t0 = time.perf_counter()
+        if profiler:
+            profiler.enable()
+        try:
+            result = fn()
+        finally:
+            if profiler:
+                profiler.disable()
+        seconds = time.perf_counter() - t0
+    items = items_of(result)
+    stats = {
+        "seconds": round(seconds, 3),
+        "items": items,
+        "per_sec": round(items / seconds, 1) if seconds else None,
+        "peak_rss_mb": round(rss.peak, 1) if rss.peak is not None else None,
+    }
+    if profiler:
+        path = Path(profile_dir) / f"{rows}_{stage}.prof"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        profiler.dump_stats(path)
+        stats["profile"] = str(path)
+    print(f"  {stage:<9} {items:>8} in {seconds:8.2f}s  {stats['per_sec'] or 0:>10.1f}/s  "
+          f"peak RSS {stats['peak_rss_mb']} MB")
+    return result, stats
+
+
+def _batched(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def bench_size(rows, stages, work_dir, profile_dir=None, funds=8):
+    import chunker
+    import offline_build
+    from synth_workbook import generate_workbook
+
+    size_dir = Path(work_dir) / f"rows_{rows}"
+    xlsx = size_dir / "data" / f"synthetic_{rows}.xlsx"
+    chunks_dir = size_dir / "chunks"
+    result = {"rows": rows, "stages": {}}
+
+    # later stages need the earlier stages' output even when not reported
+    need = set(stages)
+    if need & {"render", "embed", "insert", "build"}:
+        need |= {"generate", "chunk"}
+    if need & {"embed", "insert"}:
+        need.add("render")
+    if "insert" in need:
+        need.add("embed")
+
+    def run(name, fn, items_of):
+        if name in stages:
+            out, result["stages"][name] = timed(name, rows, fn, items_of, profile_dir)
+            return out
+        return fn() if name in need else None
+
+    # distinct seeds per size, so sizes don't share embedding-cache entries
+    run("generate", lambda: generate_workbook(xlsx, rows, n_funds=funds, seed=rows), lambda n: n)
+    if xlsx.exists():
+        result["xlsx_mb"] = round(xlsx.stat().st_size / (1024 * 1024), 2)
+
+    chunks = run("chunk", lambda: chunker.process_excel_file(str(xlsx), out_dir=str(chunks_dir)), lambda n: n)
+    if chunks is not None:
+        result["chunks"] = chunks
+
+    records = run("render", lambda: list(offline_build.iter_records(chunks_dir)), len)
+
+    vectors = run(
+        "embed",
+        lambda: [v for batch in _batched([d for d, _, _ in records], offline_build.EMBED_BATCH_SIZE)
+                 for v in offline_build.embedding_fn(batch)],
+        len,
+    )
+
+    if "insert" in need:
+        import chromadb
+        client = chromadb.PersistentClient(path=str(size_dir / "chroma_insert"))
+        collection = client.create_collection(name="bench_insert", embedding_function=offline_build.embedding_fn)
+
+        def insert():
+            for start in range(0, len(records), offline_build.EMBED_BATCH_SIZE):
+                batch = records[start:start + offline_build.EMBED_BATCH_SIZE]
+                collection.add(
+                    documents=[d for d, _, _ in batch],
+                    embeddings=vectors[start:start + len(batch)],
+                    metadatas=[m for _, m, _ in batch],
+                    ids=[i for _, _, i in batch],
+                )
+            return collection.count()
+
+        run("insert", insert, lambda n: n)
+
+    run(
+        "build",
+        lambda: offline_build.main(incremental=False, chunks_dir=chunks_dir, chroma_dir=size_dir / "chroma_build"),
+        lambda _: result.get("chunks") or 0,
+    )
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingestion / indexing benchmark over synthetic workbooks")
+    parser.add_argument("--sizes", default=",".join(map(str, SIZES)), help="comma list of data-row counts")
+    parser.add_argument("--stages", default=",".join(STAGES), help="comma list of: " + ", ".join(STAGES))
+    parser.add_argument("--funds", type=int, default=8, help="sheets (one fund each) per workbook")
+    parser.add_argument("--profile", action="store_true", help="dump a cProfile .prof per stage")
+    parser.add_argument("--work-dir", help="scratch directory (default: a new temp dir)")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch directory")
+    parser.add_argument("--out", help="results JSON path (default: bench_results/ingest_<utc>.json)")
+    args = parser.parse_args()
+
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    if any(s not in STAGES for s in stages):
+        parser.error(f"--stages must be drawn from {', '.join(STAGES)}")
+    sizes = [int(n) for n in args.sizes.split(",") if n.strip()]
+
+    work_dir = Path(args.work_dir or tempfile.mkdtemp(prefix="rag_bench_ingest_"))
+    # offline_build / chunker read their dirs at import; point them (and the
+    # embedding cache) at scratch space so the real index is never touched
+    os.environ["CHUNKS_DIR"] = str(work_dir / "chunks")
+    os.environ["CHROMA_DIR"] = str(work_dir / "chroma")
+    os.environ["DATA_DIR"] = str(work_dir / "data")
+    os.environ["EMBED_CACHE_DIR"] = str(work_dir / "embedding_cache")
+
+    stamp = datetime.now(timezone.utc)
+    out = Path(args.out) if args.out else RESULTS_DIR / f"ingest_{stamp:%Y%m%dT%H%M%SZ}.json"
+    profile_dir = out.parent / "profiles" if args.profile else None
+
+    t0 = time.perf_counter()
+    import offline_build   # loads the embedding model
+    from embedding_backends import embedding_cache_key
+    load_s = time.perf_counter() - t0
+    print(f"Embedding model {embedding_cache_key()} loaded in {load_s:.1f}s; scratch dir {work_dir}")
+
+    result = {
+        "started": stamp.isoformat(),
+        "host": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "config": {
+            "stages": stages, "funds": args.funds, "embedding": embedding_cache_key(),
+            "embed_batch_size": offline_build.EMBED_BATCH_SIZE, "embed_workers": offline_build.EMBED_WORKERS,
+            **{k: os.getenv(k) for k in ("EMBED_BACKEND", "EMBED_THREADS", "CHUNKER_STREAMING") if os.getenv(k)},
+        },
+        "model_load_seconds": round(load_s, 2),
+        "sizes": [],
+    }
+    try:
+        for rows in sizes:
+            print(f"\n{rows} rows")
+            result["sizes"].append(bench_size(rows, stages, work_dir, profile_dir, funds=args.funds))
+    finally:
+        if not args.keep and not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(result, indent=2), encoding="utf-8")
+    print(f"\nSaved {out}")
+    if profile_dir:
+        print(f"Profiles in {profile_dir}")
+
+
+if __name__ == "__main__":
+    main()
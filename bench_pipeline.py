@@ -0,0 +1,270 @@
+# bench_pipeline.py
+"""
+Offline benchmark of the query paths against a built index (default: the
+bundled chromadb_vectors/global), with openrouter_stub.py standing in for
+OpenRouter so runs are deterministic and need no network or API key.
+
+  pipeline   query_pipeline.process_query_and_log (router -> retrieval ->
+             answer(s) -> log), as new_streamlit_wth_node.py runs it
+  retrieval  query_pipeline.process_single_step (where filter -> search ->
+             pack -> one LLM answer), as streamlit_app.py runs it
+
+For each concurrency level N, N simulated users send the fixed query set
+--rounds times. Reported per path and N:
+
+  - end-to-end latency p50 / p95 / max and throughput (queries / second)
+  - per-stage latency p50 / p95 / max from the tracing spans (tracing.py)
+  - peak RSS of the process
+
+Results are saved as JSON (bench_results/pipeline_<utc>.json); pass
+--baseline <older.json> to print p50 / p95 / throughput deltas against it.
+
+    python bench_pipeline.py --users 1,4,8 --rounds 2 --llm-latency 0.5
+"""
+import os
+import sys
+import json
+import time
+import platform
+import tempfile
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent
+
+CHROMA_DIR = Path(os.getenv("CHROMA_DIR", BASE_DIR / "chromadb_vectors" / "global"))
+COLLECTION_NAME = "global_chunks"
+RESULTS_DIR = BASE_DIR / "bench_results"
+
+# fixed query set: single-fund lookups (SIMPLE), comparisons (COMPLEX via the
+# stub's "compare ... and ..." rule) and table-style questions
+BENCH_QUERIES = [
+    "What is the NAV per unit of Motilal Oswal Midcap Fund?",
+    "What are the top holdings of Motilal Oswal Flexi Cap Fund?",
+    "What is the expense ratio of Motilal Oswal Large and Midcap Fund?",
+    "Which sectors does Motilal Oswal Balanced Advantage Fund allocate to?",
+    "What is the portfolio turnover ratio of Motilal Oswal ELSS Tax Saver Fund?",
+    "Show the NAV history of Motilal Oswal Nifty 50 Index Fund",
+    "compare nav per unit for Motilal Oswal Balanced Advantage Fund and Motilal Oswal Midcap Fund",
+    "compare the top holdings of Motilal Oswal Flexi Cap Fund and Motilal Oswal Focused Fund",
+    "compare the expense ratio of Motilal Oswal Midcap Fund and Motilal Oswal Small Cap Fund",
+    "What is the average maturity of Motilal Oswal Ultra Short Term Fund?",
+]
+
+PATHS = ("pipeline", "retrieval")
+
+
+# =========================
+# MEASUREMENT
+# =========================
+def peak_rss_mb():
+    """Peak resident set size of this process so far (None where unsupported)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def latency_summary(seconds: list) -> dict:
+    from tracing import quantile
+    values = sorted(seconds)
+    return {
+        "count": len(values),
+        "p50_ms": round(quantile(values, 0.5) * 1000, 1),
+        "p95_ms": round(quantile(values, 0.95) * 1000, 1),
+        "max_ms": round(values[-1] * 1000, 1) if values else 0.0,
+        "mean_ms": round(sum(values) / len(values) * 1000, 1) if values else 0.0,
+    }
+
+
+def stage_summary(metrics) -> dict:
+    return {
+        stage: {
+            "count": s["count"],
+            "errors": s["errors"],
+            "p50_ms": round(s["p50"] * 1000, 1),
+            "p95_ms": round(s["p95"] * 1000, 1),
+            "max_ms": round(s["max"] * 1000, 1),
+        }
+        for stage, s in sorted(metrics.snapshot().items())
+    }
+
+
+# =========================
+# QUERY PATHS
+# =========================
+def make_runners(index, router):
+    from query_pipeline import process_query_and_log, process_single_step
+
+    def run_pipeline(query):
+        answer, _ = process_query_and_log(
+            query, index["collection"], router=router, matcher=index["matcher"],
+            lexical=index["lexical"], tables=index["tables"],
+        )
+        return answer
+
+    def run_retrieval(query):
+        answer, _, _ = process_single_step(
+            query, index["collection"], matcher=index["matcher"], lexical=index["lexical"],
+        )
+        return answer
+
+    return {"pipeline": run_pipeline, "retrieval": run_retrieval}
+
+
+def run_level(run, queries, users, rounds):
+    """N users each send every query `rounds` times (staggered start). Returns (latencies, errors, wall)."""
+    def user(u):
+        lat, errors = [], 0
+        for r in range(rounds):
+            for i in range(len(queries)):
+                q = queries[(i + u) % len(queries)]
+                t0 = time.perf_counter()
+                try:
+                    answer = run(q)
+                    if not answer or answer.startswith(("ERROR", "Error")) or "ERROR_CALLING_LLM" in answer:
+                        errors += 1
+                except Exception as e:
+                    print(f"  query failed: {type(e).__name__}: {e}")
+                    errors += 1
+                lat.append(time.perf_counter() - t0)
+        return lat, errors
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users) as pool:
+        results = list(pool.map(user, range(users)))
+    wall = time.perf_counter() - t0
+    return [x for lat, _ in results for x in lat], sum(e for _, e in results), wall
+
+
+# =========================
+# REPORT
+# =========================
+def compare(result, baseline):
+    base = {(r["path"], r["users"]): r for r in baseline.get("runs", [])}
+    print(f"\nvs. baseline {baseline.get('started')}:")
+    for r in result["runs"]:
+        b = base.get((r["path"], r["users"]))
+        if not b:
+            continue
+
+        def delta(new, old):
+            return f"{new:.1f} ({(new - old) / old * 100:+.0f}%)" if old else f"{new:.1f}"
+
+        print(f"  {r['path']:<9} x{r['users']:<3} "
+              f"p50 {delta(r['latency']['p50_ms'], b['latency']['p50_ms'])} ms  "
+              f"p95 {delta(r['latency']['p95_ms'], b['latency']['p95_ms'])} ms  "
+              f"qps {delta(r['throughput_qps'], b['throughput_qps'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the RAG query paths with a stub LLM")
+    parser.add_argument("--chroma-dir", default=str(CHROMA_DIR))
+    parser.add_argument("--collection", default=COLLECTION_NAME)
+    parser.add_argument("--paths", default=",".join(PATHS), help="comma list of: " + ", ".join(PATHS))
+    parser.add_argument("--users", default="1,4", help="comma list of concurrency levels")
+    parser.add_argument("--rounds", type=int, default=1, help="passes over the query set per user")
+    parser.add_argument("--queries", help="file with one query per line (default: built-in set)")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="stub seconds per completion")
+    parser.add_argument("--llm-jitter", type=float, default=0.0)
+    parser.add_argument("--router-cache", action="store_true", help="keep router caching on between rounds")
+    parser.add_argument("--out", help="results JSON path (default: bench_results/pipeline_<utc>.json)")
+    parser.add_argument("--baseline", help="earlier results JSON to compare against")
+    args = parser.parse_args()
+
+    paths = [p.strip() for p in args.paths.split(",") if p.strip()]
+    if any(p not in PATHS for p in paths):
+        parser.error(f"--paths must be drawn from {', '.join(PATHS)}")
+    levels = [int(n) for n in args.users.split(",") if n.strip()]
+    queries = BENCH_QUERIES
+    if args.queries:
+        queries = [l.strip() for l in Path(args.queries).read_text(encoding="utf-8").splitlines() if l.strip()]
+
+    # the stub must be up and the env set before llm_client / query_pipeline
+    # read their config at import; logs go to a scratch dir so benchmark
+    # queries don't end up as router training examples
+    from openrouter_stub import start_stub_server
+    stub, base_url = start_stub_server(latency=args.llm_latency, jitter=args.llm_jitter)
+    os.environ["OPENROUTER_BASE_URL"] = base_url
+    os.environ["OPENROUTER_API_KEY"] = "stub"
+    os.environ["LOGS_DIR"] = tempfile.mkdtemp(prefix="rag_bench_logs_")
+    os.environ["METRICS_FILE"] = ""
+    os.environ.setdefault("METRICS_WINDOW", str(10 ** 6))
+    os.environ.setdefault("LLM_MAX_CONCURRENCY", str(max(8, 4 * max(levels))))
+
+    from query_pipeline import open_index
+    from router import Router
+    from table_engine import TABLE_ENGINE
+    from embedding_backends import get_embedding_function, embedding_cache_key
+    from tracing import STAGE_METRICS
+
+    rss_start = peak_rss_mb()
+    t0 = time.perf_counter()
+    embed_fn = get_embedding_function()
+    index = open_index(args.chroma_dir, args.collection, embed_fn)
+    router = Router(use_cache=args.router_cache, embed_fn=embed_fn, allow_table=TABLE_ENGINE)
+    load_s = time.perf_counter() - t0
+    print(f"Loaded {args.collection} ({index['collection'].count()} chunks) in {load_s:.1f}s; "
+          f"stub LLM latency {args.llm_latency}s at {base_url}")
+
+    runners = make_runners(index, router)
+    # one untimed pass loads the model / mmaps so the first level isn't penalised
+    for path in paths:
+        runners[path](queries[0])
+
+    result = {
+        "started": datetime.now(timezone.utc).isoformat(),
+        "host": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "config": {
+            "chroma_dir": args.chroma_dir, "collection": args.collection, "queries": len(queries),
+            "rounds": args.rounds, "llm_latency": args.llm_latency, "llm_jitter": args.llm_jitter,
+            "router_mode": router.mode, "router_cache": args.router_cache,
+            "embedding": embedding_cache_key(),
+            **{k: os.getenv(k) for k in ("RETRIEVAL_MODE", "TOP_K", "TOP_K_SIMPLE", "TOP_K_PER_SUB",
+                                         "CONTEXT_TOKEN_BUDGET", "SUBQUERY_WORKERS", "EMBED_BACKEND") if os.getenv(k)},
+        },
+        "load_seconds": round(load_s, 2),
+        "rss_mb_at_start": rss_start,
+        "runs": [],
+    }
+
+    for path in paths:
+        for users in levels:
+            STAGE_METRICS.reset()
+            latencies, errors, wall = run_level(runners[path], queries, users, args.rounds)
+            run = {
+                "path": path,
+                "users": users,
+                "queries": len(latencies),
+                "errors": errors,
+                "wall_seconds": round(wall, 3),
+                "throughput_qps": round(len(latencies) / wall, 2) if wall else 0.0,
+                "latency": latency_summary(latencies),
+                "stages": stage_summary(STAGE_METRICS),
+                "peak_rss_mb": peak_rss_mb(),
+            }
+            result["runs"].append(run)
+            lat = run["latency"]
+            print(f"{path:<9} x{users:<3} {run['queries']} queries  {run['throughput_qps']:.2f} q/s  "
+                  f"p50 {lat['p50_ms']:.0f} ms  p95 {lat['p95_ms']:.0f} ms  errors {errors}  "
+                  f"peak RSS {run['peak_rss_mb']} MB")
+            for stage, s in run["stages"].items():
+                print(f"    {stage:<22} x{s['count']:<5} p50 {s['p50_ms']:>8.1f} ms  p95 {s['p95_ms']:>8.1f} ms")
+
+    stub.shutdown()
+    out = Path(args.out) if args.out else RESULTS_DIR / f"pipeline_{datetime.now(timezone.utc):%Y%m%dT%H%M%SZ}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(result, indent=2), encoding="utf-8")
+    print(f"\nSaved {out}")
+
+    if args.baseline:
+        compare(result, json.loads(Path(args.baseline).read_text(encoding="utf-8")))
+
+
+if __name__ == "__main__":
+    main()
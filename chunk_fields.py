@@ -0,0 +1,111 @@
+# chunk_fields.py
+"""
+Structured fields pulled out of a row chunk, used as Chroma metadata and for
+query-time filtering (see entity_filter.py):
+
+  fund_name    scheme name from a "Scheme/Fund Name" column, else the first
+               "... Fund" mention in the subheaders / sheet header
+  fund_key     normalised fund_name used for matching and `where` filters
+  as_of_date   ISO date from a date column, else from "as on <date>" headers
+  metrics      names of the numeric columns of the row
+
+Every field is optional; missing ones are left out.
+"""
+import re
+from datetime import datetime
+
+FUND_COLUMN = re.compile(r"\b(scheme|fund)\b.*\bname\b|^\s*(scheme|fund)\s*$", re.IGNORECASE)
+DATE_COLUMN = re.compile(r"\b(date|as on|as of)\b", re.IGNORECASE)
+# table column chunker adds for the label row above data rows ("Regular Plan", ...)
+SECTION_COLUMN = "Plan / Section"
+FUND_MENTION = re.compile(
+    r"([A-Za-z][A-Za-z0-9&'.\- ]*?\b(?:Fund of Funds?|Fund|FOF|ETF))\b",
+    re.IGNORECASE,
+)
+
+MONTHS = {m: i for i, m in enumerate(
+    ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"], start=1)}
+# full or abbreviated month names only ("market" is not March)
+MONTH_ALT = (r"jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|aug(?:ust)?"
+             r"|sep(?:t(?:ember)?)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?")
+DATE_PATTERNS = [
+    # 2024-03-31 / 2024-03-31T00:00:00 (normalize_value output)
+    (re.compile(r"\b(\d{4})-(\d{1,2})-(\d{1,2})"), ("y", "m", "d")),
+    # 31/03/2024, 31-03-2024, 31.03.2024 (day first, Indian convention)
+    (re.compile(r"\b(\d{1,2})[/.-](\d{1,2})[/.-](\d{4})\b"), ("d", "m", "y")),
+    # 31-Mar-2024, 31 March 2024
+    (re.compile(rf"\b(\d{{1,2}})(?:st|nd|rd|th)?[\s\-]+({MONTH_ALT})[\s\-,]+(\d{{4}})\b", re.IGNORECASE), ("d", "M", "y")),
+    # March 31, 2024
+    (re.compile(rf"\b({MONTH_ALT})\s+(\d{{1,2}})(?:st|nd|rd|th)?,?\s+(\d{{4}})\b", re.IGNORECASE), ("M", "d", "y")),
+]
+
+
+def fund_key(name: str) -> str:
+    return " ".join(re.findall(r"[a-z0-9]+", name.lower()))
+
+
+def parse_date(value):
+    """ISO date (YYYY-MM-DD) for the first date found in value, else None."""
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if not isinstance(value, str):
+        return None
+    for pattern, order in DATE_PATTERNS:
+        for m in pattern.finditer(value):
+            parts = dict(zip(order, m.groups()))
+            month = MONTHS[parts["M"][:3].lower()] if "M" in parts else int(parts["m"])
+            try:
+                return datetime(int(parts["y"]), month, int(parts["d"])).date().isoformat()
+            except ValueError:
+                continue
+    return None
+
+
+def find_fund_name(texts):
+    for text in texts:
+        if not isinstance(text, str):
+            continue
+        for segment in text.split(" | "):
+            m = FUND_MENTION.search(segment)
+            if m:
+                return " ".join(m.group(1).split())
+    return None
+
+
+def extract_fields(chunk: dict) -> dict:
+    data = chunk.get("data", {}) or {}
+    headers = list(chunk.get("subheaders", []) or []) + list(chunk.get("global_header", []) or [])
+    fields = {}
+
+    fund = next(
+        (v.strip() for k, v in data.items() if FUND_COLUMN.search(k) and isinstance(v, str) and v.strip()),
+        None,
+    ) or find_fund_name(headers)
+    if fund:
+        fields["fund_name"] = fund
+        fields["fund_key"] = fund_key(fund)
+
+    as_of = next(
+        (d for d in (parse_date(v) for k, v in data.items() if DATE_COLUMN.search(k)) if d),
+        None,
+    ) or next((d for d in map(parse_date, headers) if d), None)
+    if as_of:
+        fields["as_of_date"] = as_of
+
+    metrics = [k for k, v in data.items() if isinstance(v, (int, float)) and not isinstance(v, bool)]
+    if metrics:
+        fields["metrics"] = metrics
+    return fields
+
+
+def fields_to_metadata(fields: dict) -> dict:
+    """Chroma metadata values must be scalars: dates also go in as a sortable int."""
+    meta = {}
+    for k in ("fund_name", "fund_key", "as_of_date"):
+        if fields.get(k):
+            meta[k] = fields[k]
+    if fields.get("as_of_date"):
+        meta["as_of"] = int(fields["as_of_date"].replace("-", ""))
+    if fields.get("metrics"):
+        meta["metrics"] = " | ".join(fields["metrics"])
+    return meta
@@ -0,0 +1,282 @@
+# chunk_store.py
+"""
+One JSON Lines file per workbook: {CHUNKS_DIR}/{source_file}.jsonl
+
+Each line is one row chunk, in sheet/row order. Replaces the legacy layout of
+one pretty-printed file per row ({CHUNKS_DIR}/{source_file}/{sheet}_row_{n}.json),
+which readers still accept.
+
+Each workbook also gets a columnar table store, {source_file}.tables.jsonl:
+one line per detected table (columns + rows), read by table_engine.
+
+Run directly to convert an existing legacy tree:
+    python chunk_store.py [chunks_dir] [--remove-legacy]
+"""
+import os
+import json
+import argparse
+from pathlib import Path
+
+# === portable paths & config ===
+BASE_DIR = Path(__file__).resolve().parent
+
+CHUNKS_DIR  = Path(os.getenv("CHUNKS_DIR", BASE_DIR / "chunks" / "previous_chunks"))
+
+STORE_SUFFIX = ".jsonl"
+TABLE_SUFFIX = ".tables.jsonl"
+
+# Per-workbook content hash + chunk IDs, used by chunker.main to skip
+# unchanged workbooks (lives in the chunks dir, never read as a chunk)
+MANIFEST_NAME = "_manifest.json"
+MANIFEST_VERSION = 4   # 2: chunks carry extracted "fields", 3: table stores, 4: table sections
+
+
+def chunk_id(chunk):
+    return f"{chunk.get('source_file')}__{chunk.get('sheet_name')}__row_{chunk.get('excel_row_number')}"
+
+
+# === chunk -> markdown (compact), the document text of the global index ===
+def chunk_to_markdown(chunk: dict) -> str:
+    lines = []
+    
+    # 1. Safely retrieve the global header or use a placeholder
+    global_headers = chunk.get('global_header', [])
+    # Check if list is not empty before accessing [0]
+    section_name = global_headers[0] if global_headers else "General"
+    
+    source = chunk.get("source_file", "Unknown Source")
+    lines.append(f"Context: {source} | Section: {section_name}")
+
+    # 2. Extract and join subheaders safely
+    subheaders = chunk.get("subheaders", [])
+    title = " | ".join(subheaders) if subheaders else "Data Row"
+    lines.append(f"### {title}")
+
+    # 3. Filter data: Skip noise like 0, NA, or empty strings
+    data_dict = chunk.get("data", {})
+    for k, v in data_dict.items():
+        # Using a set of 'noise' values for faster lookup in 2026
+        if v not in {0, "0", "NA", "N.A.", "", None}:
+            lines.append(f"- **{k}**: {v}")
+
+    return "\n".join(lines)
+
+
+# === chunk -> markdown (brief), the document text of streamlit_app.py's upload indexes ===
+def chunk_to_brief_markdown(chunk: dict) -> str:
+    lines = []
+    title_parts = []
+    if chunk.get("global_header"): title_parts.append(chunk["global_header"][-1])
+    if chunk.get("subheaders"):
+        sh = chunk["subheaders"]
+        title_parts.append(sh[0] if isinstance(sh, list) else sh)
+    if title_parts:
+        t = " | ".join(title_parts)
+        lines.append(f"### {t if len(t) <= 120 else t[:117] + '...'}")
+    for k, v in list(chunk.get("data", {}).items())[:12]:
+        lines.append(f"- **{k}**: {v}")
+    return "\n".join(lines)
+
+
+# =========================
+# WRITE
+# =========================
+def store_path(chunks_dir, source_file):
+    return Path(chunks_dir) / f"{source_file}{STORE_SUFFIX}"
+
+
+def table_store_path(chunks_dir, source_file):
+    return Path(chunks_dir) / f"{source_file}{TABLE_SUFFIX}"
+
+
+def remove_store(chunks_dir, source_file):
+    """Deletes a workbook's .jsonl store (and any legacy per-row folder)."""
+    removed = 0
+    for path in (store_path(chunks_dir, source_file), table_store_path(chunks_dir, source_file)):
+        if path.exists():
+            path.unlink()
+            removed += 1
+
+    legacy = Path(chunks_dir) / source_file
+    if legacy.is_dir():
+        for fp in legacy.glob("*.json"):
+            fp.unlink()
+            removed += 1
+        try:
+            legacy.rmdir()
+        except OSError:
+            pass
+    return removed
+
+
+class StoreWriter:
+    """
+    Streams records into a .jsonl file. The file is written to a temp name and
+    swapped in on a clean exit, so readers never see a half-written store.
+    Nothing is left behind when there are no records (or on error).
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        self.tmp = self.path.with_name(self.path.name + ".tmp")
+        self.written = 0
+        self._f = None
+
+    def __enter__(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._f = open(self.tmp, "w", encoding="utf-8")
+        return self
+
+    def write(self, record):
+        self._f.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+        self._f.write("\n")
+        self.written += 1
+
+    def __exit__(self, exc_type, exc, tb):
+        self._f.close()
+        if exc_type is None and self.written:
+            os.replace(self.tmp, self.path)
+            return False
+        self.tmp.unlink()
+        if exc_type is None and self.path.exists():
+            self.path.unlink()
+        return False
+
+
+def write_chunks(path, chunks):
+    """Writes chunks to a single .jsonl file (via StoreWriter); returns how many were written."""
+    with StoreWriter(path) as out:
+        for chunk in chunks:
+            out.write(chunk)
+    return out.written
+
+
+# =========================
+# READ
+# =========================
+def read_store(path):
+    """Yields chunks from one .jsonl store, skipping (and reporting) bad lines."""
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except Exception as e:
+                print(f"Error loading {path}:{line_no}: {e}")
+
+
+def _legacy_is_converted(fp):
+    # legacy: <chunks_dir>/<source_file>/<sheet>_row_<n>.json
+    return (fp.parent.parent / f"{fp.parent.name}{STORE_SUFFIX}").exists()
+
+
+def iter_chunks(chunks_dir):
+    """
+    Yields (path, chunk) for every chunk under chunks_dir.
+    Reads .jsonl stores first, then any legacy per-row .json files whose
+    workbook has not been converted yet (so nothing is loaded twice).
+    """
+    root = Path(chunks_dir)
+    for fp in sorted(root.rglob(f"*{STORE_SUFFIX}")):
+        if fp.name.endswith(TABLE_SUFFIX):
+            continue
+        for chunk in read_store(fp):
+            yield fp, chunk
+
+    for fp in root.rglob("*.json"):
+        if fp.name == MANIFEST_NAME or _legacy_is_converted(fp):
+            continue
+        try:
+            with open(fp, "r", encoding="utf-8") as f:
+                yield fp, json.load(f)
+        except Exception as e:
+            print(f"Error loading {fp}: {e}")
+
+
+def iter_table_records(chunks_dir):
+    """Yields every table record from the {source_file}.tables.jsonl stores under chunks_dir."""
+    for fp in sorted(Path(chunks_dir).rglob(f"*{TABLE_SUFFIX}")):
+        yield from read_store(fp)
+
+
+# =========================
+# MANIFEST
+# =========================
+def load_manifest(chunks_dir):
+    path = Path(chunks_dir) / MANIFEST_NAME
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("version") == MANIFEST_VERSION:
+            return manifest
+        print(f"Ignoring manifest with unknown version: {path}")
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"Error loading {path}: {e}")
+    return {"version": MANIFEST_VERSION, "files": {}}
+
+
+def save_manifest(chunks_dir, manifest):
+    path = Path(chunks_dir) / MANIFEST_NAME
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+# =========================
+# LEGACY CONVERSION
+# =========================
+def _legacy_sort_key(chunk):
+    return (str(chunk.get("sheet_name")), chunk.get("excel_row_number") or 0)
+
+
+def convert_legacy_tree(chunks_dir, remove_legacy=False):
+    """
+    Converts every legacy per-row folder under chunks_dir into a sibling
+    .jsonl store. Returns {store_path: chunks_written}.
+    """
+    root = Path(chunks_dir)
+    folders = sorted({fp.parent for fp in root.rglob("*.json") if fp.name != MANIFEST_NAME})
+    converted = {}
+
+    for folder in folders:
+        files = sorted(folder.glob("*.json"))
+        chunks = []
+        for fp in files:
+            try:
+                with open(fp, "r", encoding="utf-8") as f:
+                    chunks.append(json.load(f))
+            except Exception as e:
+                print(f"Error loading {fp}: {e}")
+        chunks.sort(key=_legacy_sort_key)
+
+        out = folder.parent / f"{folder.name}{STORE_SUFFIX}"
+        converted[out] = write_chunks(out, chunks)
+        print(f"{folder} -> {out.name} ({converted[out]} chunks)")
+
+        if remove_legacy and converted[out]:
+            for fp in files:
+                fp.unlink()
+            try:
+                folder.rmdir()
+            except OSError:
+                pass
+
+    return converted
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert legacy per-row chunk files to .jsonl stores")
+    parser.add_argument("chunks_dir", nargs="?", default=str(CHUNKS_DIR))
+    parser.add_argument("--remove-legacy", action="store_true", help="delete per-row files after conversion")
+    args = parser.parse_args()
+
+    converted = convert_legacy_tree(args.chunks_dir, remove_legacy=args.remove_legacy)
+    print(f"✅ DONE — {len(converted)} workbooks, {sum(converted.values())} chunks")
+
+
+if __name__ == "__main__":
+    main()
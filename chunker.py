@@ -1,10 +1,17 @@
 import os
-import json
+import time
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime, date
 from decimal import Decimal
+from itertools import islice
 import numpy as np
 from openpyxl import load_workbook
 
+import chunk_store
+from chunk_fields import extract_fields, SECTION_COLUMN
+
 # === portable paths & config ===
 import os
 from pathlib import Path
@@ -15,7 +22,7 @@ DATA_DIR    = Path(os.getenv("DATA_DIR", BASE_DIR / "Data"))
 CHUNKS_DIR  = Path(os.getenv("CHUNKS_DIR", BASE_DIR / "chunks" / "previous_chunks"))
 
 
-for d in (DATA_DIR, CHUNKS_DIR, CHROMA_DIR, UPLOADS_DIR, LOGS_DIR):
+for d in (DATA_DIR, CHUNKS_DIR):
     d.mkdir(parents=True, exist_ok=True)
 
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
@@ -25,6 +32,13 @@ OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 INPUT_EXCEL_DIR = DATA_DIR 
 OUTPUT_CHUNKS_DIR = CHUNKS_DIR 
 
+# Streaming mode opens workbooks read-only and walks rows lazily, so memory is
+# bounded by the largest single table instead of the whole workbook.
+STREAMING_INGEST = os.getenv("CHUNKER_STREAMING", "1") == "1"
+
+# Worker processes for multi-workbook runs (openpyxl parsing is CPU-bound)
+CHUNKER_WORKERS = int(os.getenv("CHUNKER_WORKERS", "1"))
+
 # =========================
 # NORMALIZATION
 # =========================
@@ -116,108 +130,343 @@ def merge_column_headers(header_rows):
     return merged
 
 
+# =========================
+# ROW STREAMING
+# =========================
+def open_workbook(excel_path, streaming=True):
+    if streaming:
+        return load_workbook(excel_path, read_only=True, data_only=True)
+    return load_workbook(excel_path, data_only=True)
+
+
+def iter_sheet_rows(sheet):
+    """
+    Yields (excel_row_number, row) for every row in the sheet.
+    Read-only sheets may carry stale dimensions, so they are reset and
+    the rows are read exactly as stored.
+    """
+    if hasattr(sheet, "reset_dimensions"):
+        sheet.reset_dimensions()
+    for excel_row, r in enumerate(sheet.iter_rows(values_only=True), start=1):
+        yield excel_row, list(r)
+
+
+def iter_tables(rows):
+    """
+    Hard table split on empty rows, one table at a time.
+    Only the table being built is held in memory.
+    """
+    current = []
+    for excel_row, r in rows:
+        if is_empty_row(r):
+            if current:
+                yield current
+                current = []
+            continue
+        current.append((excel_row, r))
+
+    if current:
+        yield current
+
+
+def split_table(table):
+    """
+    (columns, subheaders, data_rows, sections) for a table, or None when it
+    has no column header row. data_rows are the (excel_row, row) pairs below
+    it; sections[i] is the label of the text row above data row i ("Regular
+    Plan", a fund name row), or None.
+    """
+    # find column headers ANYWHERE in table
+    col_header_rows = [r for _, r in table if is_column_header_row(r)]
+    if not col_header_rows:
+        return None
+
+    columns = merge_column_headers(col_header_rows)
+
+    # find first column header index
+    first_header_idx = min(
+        i for i, (_, r) in enumerate(table) if is_column_header_row(r)
+    )
+
+    # -------- SUBHEADERS = 1–2 ROWS ABOVE FIRST COLUMN HEADER
+    subheaders = []
+    start = max(0, first_header_idx - 2)
+    for _, r in table[start:first_header_idx]:
+        if count_numeric(r) <= 1:
+            txt = row_to_text(r)
+            if txt:
+                subheaders.append(txt)
+
+    # -------- DATA ROWS = BELOW COLUMN HEADERS, labelled by the last text row above them
+    data_rows, sections, section = [], [], None
+    for excel_row, r in table[first_header_idx + 1:]:
+        if is_data_row(r):
+            data_rows.append((excel_row, r))
+            sections.append(section)
+        elif not is_column_header_row(r):
+            section = next((str(c).strip() for c in r if isinstance(c, str) and c.strip()), section)
+    return columns, subheaders, data_rows, sections
+
+
+def table_to_record(columns, subheaders, data_rows, file_name, sheet_name, global_header, sections=None):
+    """
+    Columnar form of one table for table_engine: named columns only (repeated
+    names get a " (2)" suffix), one list of normalised values per data row.
+    Section labels, if any, come first as a SECTION_COLUMN column, so rows
+    such as "1 Year" of the Regular and Direct plans stay apart.
+    """
+    labelled = bool(sections) and any(sections)
+    keep, names = [], [SECTION_COLUMN] if labelled else []
+    for i, c in enumerate(columns):
+        if not c:
+            continue
+        name, n = c, 2
+        while name in names:
+            name, n = f"{c} ({n})", n + 1
+        keep.append(i)
+        names.append(name)
+
+    rows = [[normalize_value(r[i]) if i < len(r) else None for i in keep] for _, r in data_rows]
+    if labelled:
+        rows = [[section] + row for section, row in zip(sections, rows)]
+    record = {
+        "table_id": f"{file_name}__{sheet_name}__row_{data_rows[0][0]}",
+        "source_file": file_name,
+        "sheet_name": sheet_name,
+        "global_header": global_header,
+        "subheaders": subheaders,
+        "columns": names,
+        "excel_rows": [excel_row for excel_row, _ in data_rows],
+        "rows": rows,
+    }
+    record["fields"] = extract_fields({"global_header": global_header, "subheaders": subheaders, "data": {}})
+    return record
+
+
+def table_to_chunks(table, file_name, sheet_name, global_header, on_table=None):
+    parts = split_table(table)
+    if parts is None:
+        return
+    columns, subheaders, data_rows, sections = parts
+    if on_table is not None and data_rows:
+        on_table(table_to_record(columns, subheaders, data_rows, file_name, sheet_name, global_header, sections))
+
+    for excel_row, r in data_rows:
+        chunk = {
+            "source_file": file_name,
+            "sheet_name": sheet_name,
+            "excel_row_number": excel_row,
+            "global_header": global_header,
+            "subheaders": subheaders,
+            "data": {}
+        }
+
+        for i, v in enumerate(r):
+            if i < len(columns) and columns[i] and v is not None:
+                chunk["data"][columns[i]] = normalize_value(v)
+
+        if chunk["data"]:
+            # fund / as-of date / metric columns, stored as Chroma metadata
+            chunk["fields"] = extract_fields(chunk)
+            yield chunk
+
+
 # =========================
 # CORE
 # =========================
-def process_excel_file(excel_path):
-    file_name = os.path.splitext(os.path.basename(excel_path))[0]
-    out_dir = os.path.join(OUTPUT_CHUNKS_DIR, file_name)
-    os.makedirs(out_dir, exist_ok=True)
+def iter_workbook_chunks(excel_path, streaming=None, on_table=None):
+    """
+    Yields the row chunks of every sheet. on_table, if given, is called with
+    the columnar record of each table as it is completed.
+    """
+    if streaming is None:
+        streaming = STREAMING_INGEST
 
-    wb = load_workbook(excel_path, data_only=True)
-    chunks_written = 0
+    file_name = os.path.splitext(os.path.basename(excel_path))[0]
+    wb = open_workbook(excel_path, streaming=streaming)
 
-    for sheet_name in wb.sheetnames:
-        sheet = wb[sheet_name]
-        rows = [list(r) for r in sheet.iter_rows(values_only=True)]
+    try:
+        for sheet_name in wb.sheetnames:
+            rows = iter_sheet_rows(wb[sheet_name])
 
-        # -------- GLOBAL HEADER (FIRST 2 ROWS ONLY)
-        global_header = []
-        for i in (0, 1):
-            if i < len(rows):
-                txt = row_to_text(rows[i])
+            # -------- GLOBAL HEADER (FIRST 2 ROWS ONLY)
+            global_header = []
+            for _, r in islice(rows, 2):
+                txt = row_to_text(r)
                 if txt:
                     global_header.append(txt)
 
-        # -------- HARD TABLE SPLIT ON EMPTY ROW
-        tables = []
-        current = []
-
-        for excel_row, r in enumerate(rows[2:], start=3):
-            if is_empty_row(r):
-                if current:
-                    tables.append(current)
-                    current = []
-                continue
-            current.append((excel_row, r))
-
-        if current:
-            tables.append(current)
-
-        # -------- PROCESS EACH TABLE
-        for table in tables:
-            # find column headers ANYWHERE in table
-            col_header_rows = [r for _, r in table if is_column_header_row(r)]
-            if not col_header_rows:
-                continue
-
-            columns = merge_column_headers(col_header_rows)
-
-            # find first column header index
-            first_header_idx = min(
-                i for i, (_, r) in enumerate(table) if is_column_header_row(r)
-            )
-
-            # -------- SUBHEADERS = 1–2 ROWS ABOVE FIRST COLUMN HEADER
-            subheaders = []
-            start = max(0, first_header_idx - 2)
-            for _, r in table[start:first_header_idx]:
-                if count_numeric(r) <= 1:
-                    txt = row_to_text(r)
-                    if txt:
-                        subheaders.append(txt)
-
-            # -------- DATA ROWS = BELOW COLUMN HEADERS
-            for excel_row, r in table[first_header_idx + 1:]:
-                if not is_data_row(r):
-                    continue
-
-                chunk = {
-                    "source_file": file_name,
-                    "sheet_name": sheet_name,
-                    "excel_row_number": excel_row,
-                    "global_header": global_header,
-                    "subheaders": subheaders,
-                    "data": {}
-                }
-
-                for i, v in enumerate(r):
-                    if i < len(columns) and columns[i] and v is not None:
-                        chunk["data"][columns[i]] = normalize_value(v)
-
-                if chunk["data"]:
-                    with open(
-                        os.path.join(out_dir, f"{sheet_name}_row_{excel_row}.json"),
-                        "w",
-                        encoding="utf-8"
-                    ) as f:
-                        json.dump(chunk, f, indent=2)
-                    chunks_written += 1
-
-    if chunks_written == 0:
-        os.rmdir(out_dir)
+            # -------- PROCESS EACH TABLE AS SOON AS IT IS COMPLETE
+            for table in iter_tables(rows):
+                yield from table_to_chunks(table, file_name, sheet_name, global_header, on_table)
+    finally:
+        if streaming:
+            wb.close()
+
+
+def process_excel_file(excel_path, streaming=None, out_dir=None):
+    """
+    Writes every row chunk of the workbook to {out_dir}/{file_name}.jsonl
+    and its tables to {out_dir}/{file_name}.tables.jsonl (default
+    OUTPUT_CHUNKS_DIR). Returns the number of chunks written.
+    """
+    file_name = os.path.splitext(os.path.basename(excel_path))[0]
+    out_dir = out_dir or OUTPUT_CHUNKS_DIR
+    out_path = chunk_store.store_path(out_dir, file_name)
+    with chunk_store.StoreWriter(chunk_store.table_store_path(out_dir, file_name)) as tables:
+        chunks = iter_workbook_chunks(excel_path, streaming=streaming, on_table=tables.write)
+        return chunk_store.write_chunks(out_path, chunks)
 
 
 # =========================
 # RUNNER
 # =========================
-def main():
-    os.makedirs(OUTPUT_CHUNKS_DIR, exist_ok=True)
-    for f in os.listdir(INPUT_EXCEL_DIR):
-        if f.lower().endswith(".xlsx"):
-            process_excel_file(os.path.join(INPUT_EXCEL_DIR, f))
+def list_workbooks(input_dir):
+    return sorted(
+        os.path.join(input_dir, f)
+        for f in os.listdir(input_dir)
+        if f.lower().endswith(".xlsx")
+    )
+
+
+def _chunk_file_job(excel_path, out_dir, streaming=None):
+    """
+    Pool worker: never raises, so one bad workbook can't stop the run.
+    Returns (excel_path, chunks_written, error, seconds).
+    """
+    t0 = time.perf_counter()
+    try:
+        n = process_excel_file(excel_path, streaming=streaming, out_dir=out_dir)
+        return excel_path, n, None, time.perf_counter() - t0
+    except Exception as e:
+        return excel_path, 0, f"{type(e).__name__}: {e}", time.perf_counter() - t0
+
+
+def chunk_workbooks(paths, out_dir=None, workers=1, streaming=None):
+    """
+    Chunks each workbook, fanning out to a process pool when workers > 1.
+    Per-file output is the same either way. Returns results sorted by path.
+    """
+    out_dir = str(out_dir or OUTPUT_CHUNKS_DIR)
+    results = []
+
+    if workers <= 1 or len(paths) <= 1:
+        for p in paths:
+            results.append(_chunk_file_job(p, out_dir, streaming))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_chunk_file_job, p, out_dir, streaming) for p in paths]
+            for fut in as_completed(futures):
+                results.append(fut.result())
+
+    return sorted(results, key=lambda r: r[0])
+
+
+def print_summary(results, elapsed):
+    failed = [r for r in results if r[2]]
+    for path, n, err, secs in results:
+        name = os.path.basename(path)
+        if err:
+            print(f"❌ {name}: FAILED after {secs:.1f}s — {err}")
+        else:
+            print(f"   {name}: {n} chunks in {secs:.1f}s")
+    total = sum(r[1] for r in results)
+    print(
+        f"{len(results)} files, {total} chunks, {len(failed)} failed, "
+        f"{elapsed:.1f}s elapsed"
+    )
+
+
+# =========================
+# INCREMENTAL (CONTENT-HASH MANIFEST)
+# =========================
+def file_sha256(path, block_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def plan_incremental(paths, manifest, out_dir, full=False):
+    """
+    Splits workbooks into (to_chunk, unchanged, removed) against the manifest.
+    full=True re-chunks everything but still reports removed workbooks.
+    to_chunk is [(path, sha256)]; removed is manifest keys with no source file.
+    """
+    entries = manifest["files"]
+    to_chunk, unchanged = [], []
+
+    for p in paths:
+        name = os.path.basename(p)
+        digest = file_sha256(p)
+        entry = entries.get(name)
+        store = chunk_store.store_path(out_dir, os.path.splitext(name)[0])
+        if (
+            not full
+            and entry
+            and entry.get("sha256") == digest
+            and (store.exists() or not entry.get("chunk_ids"))
+        ):
+            unchanged.append(p)
+        else:
+            to_chunk.append((p, digest))
+
+    present = {os.path.basename(p) for p in paths}
+    removed = sorted(name for name in entries if name not in present)
+    return to_chunk, unchanged, removed
+
+
+def main(workers=None, full=False):
+    if workers is None:
+        workers = CHUNKER_WORKERS
+    out_dir = OUTPUT_CHUNKS_DIR
+    os.makedirs(out_dir, exist_ok=True)
+
+    t0 = time.perf_counter()
+    paths = list_workbooks(INPUT_EXCEL_DIR)
+    manifest = chunk_store.load_manifest(out_dir)
+    to_chunk, unchanged, removed = plan_incremental(paths, manifest, out_dir, full=full)
+
+    # -------- DROP CHUNKS OF WORKBOOKS THAT NO LONGER EXIST
+    for name in removed:
+        chunk_store.remove_store(out_dir, os.path.splitext(name)[0])
+        del manifest["files"][name]
+        print(f"🗑  {name}: source removed, chunks deleted")
+
+    # -------- RE-CHUNK NEW / CHANGED WORKBOOKS
+    digests = dict(to_chunk)
+    results = chunk_workbooks([p for p, _ in to_chunk], out_dir=out_dir, workers=workers)
+    for path, n, err, _ in results:
+        name = os.path.basename(path)
+        if err:
+            # forget the file so the next run retries it
+            manifest["files"].pop(name, None)
+            continue
+        store = chunk_store.store_path(out_dir, os.path.splitext(name)[0])
+        ids = [chunk_store.chunk_id(c) for c in chunk_store.read_store(store)] if n else []
+        manifest["files"][name] = {
+            "sha256": digests[path],
+            "chunk_ids": ids,
+            "chunked_at": datetime.now().isoformat(timespec="seconds"),
+        }
+
+    chunk_store.save_manifest(out_dir, manifest)
+
+    print_summary(results, time.perf_counter() - t0)
+    print(f"{len(unchanged)} unchanged (skipped), {len(removed)} removed")
     print("✅ DONE — no bleed, empty rows hard-stop, fund rows excluded")
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Chunk every .xlsx in DATA_DIR")
+    parser.add_argument(
+        "--workers", type=int, default=CHUNKER_WORKERS,
+        help="parallel worker processes (1 = sequential, default from CHUNKER_WORKERS)",
+    )
+    parser.add_argument(
+        "--full", action="store_true",
+        help="ignore the manifest and re-chunk every workbook",
+    )
+    args = parser.parse_args()
+    main(workers=args.workers, full=args.full)
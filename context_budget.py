@@ -0,0 +1,142 @@
+# context_budget.py
+"""
+Context assembly: turns retrieved (document, distance) hits into the CONTEXT
+block of a prompt, capped by an estimated token budget instead of a fixed
+TOP_K.
+
+  1. dedupe   exact and near-identical chunks (same rows repeated across
+              monthly files only differ in the source file of their
+              "Context:" line); rows whose data lines or fund (Section)
+              differ are always kept
+  2. rank     by distance, best first
+  3. pack     greedily until the token budget is used
+  4. compact  rows of the same table share their header lines, emitted once
+
+Token counts are estimated (CHARS_PER_TOKEN), which is close enough for a budget.
+"""
+import os
+import math
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+CONTEXT_TOKEN_BUDGET_PER_SUB = int(os.getenv("CONTEXT_TOKEN_BUDGET_PER_SUB", "2000"))
+CONTEXT_NEAR_DUP_JACCARD = float(os.getenv("CONTEXT_NEAR_DUP_JACCARD", "0.9"))
+CHARS_PER_TOKEN = float(os.getenv("CHARS_PER_TOKEN", "4"))
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN) if text else 0
+
+
+def split_header(doc: str) -> tuple:
+    """
+    ("Context: ..."/"### ..." header lines, data lines). Data lines are the
+    "- **col**: value" bullets chunk_to_markdown emits for each row.
+    """
+    header, body = [], []
+    for line in doc.splitlines():
+        (body if line.startswith("- ") or body else header).append(line)
+    return tuple(header), tuple(body)
+
+
+def _without_source(line: str):
+    # "Context: <source file> | Section: <fund>" -> "Section: <fund>"
+    if not line.startswith("Context:"):
+        return line
+    _, sep, section = line.partition(" | Section: ")
+    return f"Section: {section}" if sep else None
+
+
+def _content_key(doc: str) -> tuple:
+    # ignore the source file so the same row from another monthly file counts
+    # as a duplicate; the section (fund) stays, so equal rows of two funds don't
+    header, body = split_header(doc)
+    return tuple(l for l in map(_without_source, header) if l is not None), body
+
+
+def _shingles(lines) -> set:
+    return set(" ".join(lines).lower().split())
+
+
+def dedupe_hits(hits, near_dup_jaccard=None):
+    """
+    Keeps the best-ranked copy of exact / near-identical documents. Near-identical
+    means the same data lines under headers (Context: aside) whose word-set
+    Jaccard similarity is >= near_dup_jaccard; a row whose values differ (e.g. the
+    NAV of another month) is never dropped.
+    """
+    threshold = CONTEXT_NEAR_DUP_JACCARD if near_dup_jaccard is None else near_dup_jaccard
+    kept, keys, headers = [], set(), {}   # data lines -> [header shingles]
+    for doc, dist in hits:
+        key = _content_key(doc)
+        if key in keys:
+            continue
+        header, body = key
+        sh = _shingles(header)
+        same_rows = headers.setdefault(body, [])
+        if threshold < 1 and any(
+            len(sh & other) / max(1, len(sh | other)) >= threshold for other in same_rows
+        ):
+            continue
+        keys.add(key)
+        same_rows.append(sh)
+        kept.append((doc, dist))
+    return kept
+
+
+def assemble_context(hits, token_budget=None, separator="\n\n", compact=True, near_dup_jaccard=None):
+    """
+    hits: [(document, distance)] (distance may be None → keeps retrieval order).
+    Returns (context_text, stats) where stats records what was packed and
+    what was dropped.
+    """
+    budget = CONTEXT_TOKEN_BUDGET if token_budget is None else token_budget
+    ranked = sorted(
+        enumerate(hits),
+        key=lambda x: (x[1][1] is None, x[1][1] if x[1][1] is not None else 0, x[0]),
+    )
+    ranked = [h for _, h in ranked]
+    unique = dedupe_hits(ranked, near_dup_jaccard)
+
+    # -------- pack under budget; a shared table header is only paid once
+    groups = {}           # header -> [body, ...] in rank order
+    used = 0
+    dropped_tokens = 0
+    packed = 0
+    for doc, _ in unique:
+        header, body = split_header(doc) if compact else ((), tuple(doc.splitlines()))
+        body_text = "\n".join(body)
+        cost = estimate_tokens(body_text) + estimate_tokens(separator)
+        if header not in groups:
+            cost += estimate_tokens("\n".join(header))
+        if used + cost > budget:
+            dropped_tokens += estimate_tokens(doc)
+            continue
+        groups.setdefault(header, []).append(body_text)
+        used += cost
+        packed += 1
+
+    blocks = []
+    for header, bodies in groups.items():
+        head = "\n".join(header)
+        blocks.append((head + "\n" if head else "") + separator.join(bodies))
+    context = separator.join(blocks)
+
+    duplicate_tokens = sum(estimate_tokens(d) for d, _ in ranked) - sum(estimate_tokens(d) for d, _ in unique)
+    stats = {
+        "retrieved": len(hits),
+        "duplicates": len(hits) - len(unique),
+        "packed": packed,
+        "dropped": len(unique) - packed,
+        "tokens": estimate_tokens(context),
+        "dropped_tokens": dropped_tokens + duplicate_tokens,
+        "budget": budget,
+    }
+    return context, stats
+
+
+def format_context_stats(stats: dict) -> str:
+    return (
+        f"{stats['packed']}/{stats['retrieved']} chunks packed, ~{stats['tokens']} tokens "
+        f"(budget {stats['budget']}); dropped {stats['duplicates']} duplicate + "
+        f"{stats['dropped']} over-budget chunks, ~{stats['dropped_tokens']} tokens"
+    )
@@ -0,0 +1,210 @@
+# embedding_backends.py
+"""
+CPU embedding backends for all-MiniLM-L12-v2, selected by EMBED_BACKEND:
+
+  sentence_transformers  reference model via Chroma's SentenceTransformerEmbeddingFunction
+  torch_int8             same model with Linear layers dynamically quantized to int8
+  onnx                   ONNX Runtime session over an exported model in EMBED_MODEL_DIR
+                         (point EMBED_ONNX_FILE at a quantized .onnx for int8)
+
+Every backend is a Chroma-style callable: fn(input: list[str]) -> list[vector].
+
+Parity check against the reference model on a sample of chunks:
+    python embedding_backends.py --backend onnx --sample 500
+"""
+import os
+import json
+import time
+import random
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+# === portable paths & config ===
+BASE_DIR = Path(__file__).resolve().parent
+
+CHUNKS_DIR  = Path(os.getenv("CHUNKS_DIR", BASE_DIR / "chunks" / "previous_chunks"))
+
+EMBED_MODEL_NAME = os.getenv("EMBED_MODEL_NAME", "all-MiniLM-L12-v2")
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "sentence_transformers")
+EMBED_MODEL_DIR = os.getenv("EMBED_MODEL_DIR")          # local model directory (optional for torch backends)
+EMBED_ONNX_FILE = os.getenv("EMBED_ONNX_FILE", "model.onnx")
+EMBED_MAX_LENGTH = int(os.getenv("EMBED_MAX_LENGTH", "128"))  # all-MiniLM-L12-v2 max_seq_length
+EMBED_THREADS = int(os.getenv("EMBED_THREADS", "0"))    # 0 = runtime default
+
+BACKENDS = ("sentence_transformers", "torch_int8", "onnx")
+
+
+def _normalize(x):
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    return x / np.clip(norms, 1e-12, None)
+
+
+# =========================
+# BACKENDS
+# =========================
+class QuantizedSentenceTransformerFunction:
+    """SentenceTransformer with nn.Linear weights quantized to int8 (torch dynamic quantization)."""
+
+    def __init__(self, model_name_or_dir):
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        if EMBED_THREADS:
+            torch.set_num_threads(EMBED_THREADS)
+        model = SentenceTransformer(model_name_or_dir, device="cpu")
+        self.model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    def __call__(self, input):
+        return list(self.model.encode(list(input), convert_to_numpy=True))
+
+
+class OnnxEmbeddingFunction:
+    """
+    ONNX Runtime encoder: tokenizer.json + an exported transformer .onnx,
+    mean pooling over the attention mask, then L2 normalisation (same
+    Pooling + Normalize modules as the sentence-transformers model).
+    """
+
+    def __init__(self, model_dir, onnx_file=EMBED_ONNX_FILE, max_length=EMBED_MAX_LENGTH, batch_size=64):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        model_dir = Path(model_dir)
+        model_path = model_dir / onnx_file
+        if not model_path.exists() and (model_dir / "onnx" / onnx_file).exists():
+            model_path = model_dir / "onnx" / onnx_file
+        if not model_path.exists():
+            raise FileNotFoundError(f"ONNX model not found: {model_path}")
+
+        self.tokenizer = Tokenizer.from_file(str(model_dir / "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+        self.batch_size = batch_size
+
+        opts = ort.SessionOptions()
+        if EMBED_THREADS:
+            opts.intra_op_num_threads = EMBED_THREADS
+        self.session = ort.InferenceSession(str(model_path), opts, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def _encode_batch(self, texts):
+        enc = self.tokenizer.encode_batch(texts)
+        ids = np.array([e.ids for e in enc], dtype=np.int64)
+        mask = np.array([e.attention_mask for e in enc], dtype=np.int64)
+        feeds = {"input_ids": ids, "attention_mask": mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.zeros_like(ids)
+
+        hidden = self.session.run(None, feeds)[0]  # (batch, seq, dim)
+        m = mask[..., None].astype(np.float32)
+        pooled = (hidden * m).sum(axis=1) / np.clip(m.sum(axis=1), 1e-9, None)
+        return _normalize(pooled.astype(np.float32))
+
+    def __call__(self, input):
+        texts = list(input)
+        out = []
+        for start in range(0, len(texts), self.batch_size):
+            out.extend(self._encode_batch(texts[start:start + self.batch_size]))
+        return out
+
+
+def get_embedding_function(backend=None, model_name=EMBED_MODEL_NAME, model_dir=EMBED_MODEL_DIR):
+    backend = backend or EMBED_BACKEND
+    if backend == "sentence_transformers":
+        from chromadb.utils import embedding_functions
+        return embedding_functions.SentenceTransformerEmbeddingFunction(model_name=model_dir or model_name)
+    if backend == "torch_int8":
+        return QuantizedSentenceTransformerFunction(model_dir or model_name)
+    if backend == "onnx":
+        if not model_dir:
+            raise ValueError("EMBED_BACKEND=onnx needs EMBED_MODEL_DIR (exported model + tokenizer.json)")
+        return OnnxEmbeddingFunction(model_dir)
+    raise ValueError(f"Unknown EMBED_BACKEND {backend!r}; expected one of {BACKENDS}")
+
+
+def embedding_cache_key(backend=None, model_name=EMBED_MODEL_NAME):
+    """Cache namespace: vectors from different backends must never mix."""
+    backend = backend or EMBED_BACKEND
+    if backend == "sentence_transformers":
+        return model_name
+    if backend == "onnx":
+        return f"{model_name}@onnx-{Path(EMBED_ONNX_FILE).stem}"
+    return f"{model_name}@{backend}"
+
+
+# =========================
+# PARITY CHECK
+# =========================
+def sample_documents(chunks_dir, n, seed=0):
+    from chunk_store import iter_chunks
+    from offline_build import chunk_to_markdown
+
+    docs = [chunk_to_markdown(c) for _, c in iter_chunks(chunks_dir)]
+    docs = [d for d in docs if d]
+    random.Random(seed).shuffle(docs)
+    return docs[:n]
+
+
+def _timed_embed(fn, docs):
+    t0 = time.perf_counter()
+    vecs = np.asarray(fn(docs), dtype=np.float32)
+    return vecs, time.perf_counter() - t0
+
+
+def parity_report(candidate, docs, reference=None, top_k=10):
+    """
+    Embeds docs with both backends and reports cosine drift
+    (1 - cos(reference, candidate)), speed, and how often each doc's
+    top-k neighbours within the sample agree.
+    """
+    reference = reference or get_embedding_function("sentence_transformers")
+    ref, ref_secs = _timed_embed(reference, docs)
+    cand, cand_secs = _timed_embed(candidate, docs)
+
+    ref, cand = _normalize(ref), _normalize(cand)
+    drift = 1.0 - (ref * cand).sum(axis=1)
+
+    k = min(top_k, len(docs) - 1)
+    overlap = None
+    if k > 0:
+        def neighbours(x):
+            sims = x @ x.T
+            np.fill_diagonal(sims, -np.inf)
+            return np.argsort(-sims, axis=1)[:, :k]
+        nr, nc = neighbours(ref), neighbours(cand)
+        overlap = float(np.mean([len(set(a) & set(b)) / k for a, b in zip(nr, nc)]))
+
+    return {
+        "docs": len(docs),
+        "drift_mean": float(drift.mean()),
+        "drift_p95": float(np.percentile(drift, 95)),
+        "drift_max": float(drift.max()),
+        f"top{k}_overlap": overlap,
+        "reference_docs_per_sec": len(docs) / ref_secs if ref_secs else None,
+        "candidate_docs_per_sec": len(docs) / cand_secs if cand_secs else None,
+        "speedup": ref_secs / cand_secs if cand_secs else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare an embedding backend against the reference model")
+    parser.add_argument("--backend", default=EMBED_BACKEND, choices=BACKENDS)
+    parser.add_argument("--chunks-dir", default=str(CHUNKS_DIR))
+    parser.add_argument("--sample", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    docs = sample_documents(args.chunks_dir, args.sample, seed=args.seed)
+    if not docs:
+        print("No chunks found. Exiting.")
+        return
+
+    report = parity_report(get_embedding_function(args.backend), docs)
+    report["backend"] = args.backend
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
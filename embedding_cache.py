@@ -0,0 +1,230 @@
+# embedding_cache.py
+"""
+Persistent embedding cache keyed by model name + sha1 of the document text.
+
+One .npz file per model under EMBED_CACHE_DIR holding three parallel arrays:
+  keys     (N, 20)   uint8 sha1 digests of the document text
+  vectors  (N, dim)  float32 embeddings
+  ticks    (N,)      last-used counter, for LRU eviction on save
+
+Identical markdown (common across monthly factsheets) is embedded once.
+
+Several processes (offline_build, upload jobs, API workers) may share a cache
+file: save() takes an exclusive lock on "<file>.lock", merges in whatever the
+others saved since, and replaces the file from a uniquely named temp file.
+"""
+import os
+import hashlib
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:   # Windows: saves are not serialized across processes
+    fcntl = None
+
+# === portable paths & config ===
+BASE_DIR = Path(__file__).resolve().parent
+
+EMBED_CACHE_DIR = Path(os.getenv("EMBED_CACHE_DIR", BASE_DIR / "embedding_cache"))
+# ~1.5 KB per 384-dim entry -> 200k entries is ~300 MB on disk
+EMBED_CACHE_MAX_ENTRIES = int(os.getenv("EMBED_CACHE_MAX_ENTRIES", "200000"))
+
+
+def text_key(text: str) -> bytes:
+    return hashlib.sha1(text.encode("utf-8")).digest()
+
+
+def _model_slug(model_name: str) -> str:
+    return "".join(c if c.isalnum() or c in "-_." else "_" for c in model_name)
+
+
+@contextmanager
+def _file_lock(path):
+    """Exclusive advisory lock on path for the block (no-op without fcntl)."""
+    if fcntl is None:
+        yield
+        return
+    with open(path, "a+b") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _read(path):
+    """(keys, vectors, ticks) stored at path, or None."""
+    if not path.exists():
+        return None
+    try:
+        with np.load(path) as z:
+            return z["keys"], np.asarray(z["vectors"], dtype=np.float32), np.asarray(z["ticks"], dtype=np.int64)
+    except Exception as e:
+        print(f"Ignoring unreadable embedding cache {path}: {e}")
+        return None
+
+
+class EmbeddingCache:
+    def __init__(self, model_name, cache_dir=None, max_entries=None):
+        self.model_name = model_name
+        self.path = Path(cache_dir or EMBED_CACHE_DIR) / f"{_model_slug(model_name)}.npz"
+        self.max_entries = EMBED_CACHE_MAX_ENTRIES if max_entries is None else max_entries
+
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+        self._index = {}      # key -> row in self._vectors
+        self._vectors = None  # (capacity, dim) float32, rows [0, _size) in use
+        self._ticks = np.zeros(0, dtype=np.int64)
+        self._size = 0
+        self._clock = 0
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._load()
+
+    # =========================
+    # PERSISTENCE
+    # =========================
+    def _load(self):
+        stored = _read(self.path)
+        if stored is None:
+            return
+        keys, self._vectors, self._ticks = stored
+        self._index = {k.tobytes(): i for i, k in enumerate(keys)}
+        self._size = len(keys)
+        self._clock = int(self._ticks.max()) if len(self._ticks) else 0
+
+    def _merge_stored(self):
+        # entries other processes saved since this one loaded the file
+        stored = _read(self.path)
+        if stored is None:
+            return
+        keys, vectors, ticks = stored
+        new = [i for i, k in enumerate(keys) if k.tobytes() not in self._index]
+        if not new:
+            return
+        start = self._size
+        self._append([keys[i].tobytes() for i in new], vectors[new])
+        self._ticks[start:self._size] = ticks[new]
+        self._clock = max(self._clock, int(ticks.max()))
+
+    def save(self):
+        """Merges entries saved by other processes, evicts LRU entries over max_entries, writes atomically."""
+        with self._lock:
+            if not self._dirty or self._vectors is None:
+                return
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with _file_lock(self.path.with_name(self.path.name + ".lock")):
+                self._merge_stored()
+                self._save_locked()
+
+    def _save_locked(self):
+        keys = np.frombuffer(b"".join(self._index.keys()), dtype=np.uint8).reshape(-1, 20)
+        rows = np.fromiter(self._index.values(), dtype=np.int64, count=len(self._index))
+
+        if len(rows) > self.max_entries:
+            keep = np.argsort(self._ticks[rows])[-self.max_entries:]
+            self.evicted += len(rows) - len(keep)
+            keys, rows = keys[keep], rows[keep]
+
+        vectors, ticks = self._vectors[rows], self._ticks[rows]
+        self._vectors, self._ticks = vectors, ticks
+        self._index = {k.tobytes(): i for i, k in enumerate(keys)}
+        self._size = len(keys)
+
+        fd, tmp = tempfile.mkstemp(dir=self.path.parent, prefix=self.path.stem + ".", suffix=".tmp.npz")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, keys=keys, vectors=vectors, ticks=ticks)
+            os.replace(tmp, self.path)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+        self._dirty = False
+
+    # =========================
+    # LOOKUP
+    # =========================
+    def embed(self, texts, embed_fn):
+        """
+        Returns a (len(texts), dim) float32 array. Cached vectors are reused;
+        misses (deduplicated) go to embed_fn in a single call and are stored.
+        Safe to call from several threads: embed_fn runs outside the lock.
+        """
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        keys = [text_key(t) for t in texts]
+
+        missing = {}
+        with self._lock:
+            for k, t in zip(keys, texts):
+                if k in self._index:
+                    self.hits += 1
+                elif k not in missing:
+                    missing[k] = t
+                    self.misses += 1
+                else:
+                    self.hits += 1  # duplicate within the batch, embedded once
+
+        if missing:
+            new = np.asarray(embed_fn(list(missing.values())), dtype=np.float32)
+
+        with self._lock:
+            if missing:
+                # another thread may have stored some of these meanwhile
+                missing_keys = list(missing)
+                fresh = [i for i, k in enumerate(missing_keys) if k not in self._index]
+                self._append([missing_keys[i] for i in fresh], new[fresh])
+            self._clock += 1
+            rows = np.fromiter((self._index[k] for k in keys), dtype=np.int64, count=len(keys))
+            self._ticks[rows] = self._clock
+            return self._vectors[rows]
+
+    def _append(self, keys, vectors):
+        if not keys:
+            return
+        # grow by doubling so large builds don't re-copy the matrix per batch
+        need = self._size + len(keys)
+        if self._vectors is None:
+            self._vectors = np.empty((max(need, 1024), vectors.shape[1]), dtype=np.float32)
+            self._ticks = np.zeros(len(self._vectors), dtype=np.int64)
+        elif need > len(self._vectors):
+            cap = max(need, 2 * len(self._vectors))
+            grown = np.empty((cap, self._vectors.shape[1]), dtype=np.float32)
+            grown[:self._size] = self._vectors[:self._size]
+            ticks = np.zeros(cap, dtype=np.int64)
+            ticks[:self._size] = self._ticks[:self._size]
+            self._vectors, self._ticks = grown, ticks
+
+        self._vectors[self._size:need] = vectors
+        for i, k in enumerate(keys):
+            self._index[k] = self._size + i
+        self._size = need
+        self._dirty = True
+
+    # =========================
+    # STATS
+    # =========================
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "model": self.model_name,
+            "entries": len(self._index),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            "evicted": self.evicted,
+        }
+
+    def format_stats(self):
+        s = self.stats()
+        return (
+            f"Embedding cache [{s['model']}]: {s['hits']} hits, {s['misses']} misses "
+            f"({s['hit_rate']:.1%} hit rate), {s['entries']} entries, {s['evicted']} evicted"
+        )
@@ -0,0 +1,139 @@
+# entity_filter.py
+"""
+Query-time entity matcher: turns the funds and dates named in a query into a
+Chroma `where` filter, so the vector search only ranks rows of those funds.
+
+The fund catalog (fund_key -> fund_name) comes from FUND_INDEX_NAME next to the
+Chroma directory (written by offline_build) or, failing that, from a scan of
+the collection's metadata.
+
+A fund matches when every distinctive word of its name is in the query. Words
+shared by most funds ("motilal", "oswal") and generic ones ("fund", "plan")
+don't count, and a fund whose words are a subset of another matched fund's
+is dropped ("Midcap Fund" vs "Nifty Midcap 150 Index Fund").
+"""
+import os
+import re
+import json
+from pathlib import Path
+
+from chunk_fields import fund_key, parse_date, MONTHS, MONTH_ALT
+
+METADATA_FILTERS = os.getenv("METADATA_FILTERS", "1") == "1"
+FUND_INDEX_NAME = "fund_index.json"
+
+# words that don't identify a fund on their own
+FUND_STOPWORDS = {
+    "the", "and", "fund", "funds", "of", "plan", "scheme", "direct", "regular", "growth",
+    "idcw", "option", "etf", "fof",
+}
+# a word in more than this share of fund names is treated like a stopword
+COMMON_WORD_SHARE = 0.5
+
+MONTH_YEAR = re.compile(rf"\b({MONTH_ALT})[\s\-,']+(\d{{4}})\b", re.IGNORECASE)
+
+
+def _words(text: str) -> set:
+    return set(fund_key(text).split())
+
+
+# =========================
+# CATALOG
+# =========================
+def save_fund_index(chroma_dir, funds: dict):
+    path = Path(chroma_dir) / FUND_INDEX_NAME
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(dict(sorted(funds.items())), f, indent=2, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def load_fund_index(chroma_dir):
+    try:
+        with open(Path(chroma_dir) / FUND_INDEX_NAME, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"Error loading fund index in {chroma_dir}: {e}")
+        return None
+
+
+def scan_collection_funds(collection, page_size=5000):
+    funds = {}
+    offset = 0
+    while True:
+        page = collection.get(include=["metadatas"], limit=page_size, offset=offset)
+        if not page["ids"]:
+            break
+        for meta in page["metadatas"]:
+            if meta and meta.get("fund_key"):
+                funds[meta["fund_key"]] = meta.get("fund_name") or meta["fund_key"]
+        offset += len(page["ids"])
+    return funds
+
+
+# =========================
+# MATCHER
+# =========================
+class EntityMatcher:
+    def __init__(self, funds: dict):
+        self.funds = dict(funds)
+        words = {k: _words(k) - FUND_STOPWORDS for k in self.funds}
+
+        counts = {}
+        for ws in words.values():
+            for w in ws:
+                counts[w] = counts.get(w, 0) + 1
+        common = set()
+        if len(self.funds) > 2:
+            common = {w for w, n in counts.items() if n / len(self.funds) > COMMON_WORD_SHARE}
+
+        # fund_key -> distinctive words (funds left with none can't be matched)
+        self._distinctive = {k: ws - common for k, ws in words.items() if ws - common}
+
+    @classmethod
+    def for_collection(cls, chroma_dir, collection):
+        funds = load_fund_index(chroma_dir)
+        if funds is None:
+            funds = scan_collection_funds(collection)
+        return cls(funds)
+
+    def match_funds(self, query: str) -> list:
+        q = _words(query)
+        hits = [k for k, ws in self._distinctive.items() if ws <= q]
+        return sorted(
+            k for k in hits
+            if not any(self._distinctive[k] < self._distinctive[o] for o in hits)
+        )
+
+    @staticmethod
+    def match_date_range(query: str):
+        """(from, to) as yyyymmdd ints for a full date or a month + year, else None."""
+        day = parse_date(query)
+        if day:
+            n = int(day.replace("-", ""))
+            return n, n
+        m = MONTH_YEAR.search(query)
+        if m:
+            base = int(m.group(2)) * 10000 + MONTHS[m.group(1)[:3].lower()] * 100
+            return base + 1, base + 31
+        return None
+
+    def where_for(self, query: str):
+        """Chroma `where` for the entities in query, or None when nothing matched."""
+        conditions = []
+        funds = self.match_funds(query)
+        if len(funds) == 1:
+            conditions.append({"fund_key": funds[0]})
+        elif funds:
+            conditions.append({"fund_key": {"$in": funds}})
+
+        dates = self.match_date_range(query)
+        if dates:
+            conditions.append({"as_of": {"$gte": dates[0]}})
+            conditions.append({"as_of": {"$lte": dates[1]}})
+
+        if not conditions:
+            return None
+        return conditions[0] if len(conditions) == 1 else {"$and": conditions}
@@ -0,0 +1,152 @@
+# lexical_index.py
+"""
+BM25 inverted index over the chunk_to_markdown documents, for exact tokens the
+embedding model ranks poorly (fund names, scheme codes, "NAV per unit").
+
+Built by offline_build next to the Chroma index ({chroma_dir}/bm25/) as flat
+numpy arrays, so query processes memory-map it instead of loading it:
+
+  vocab.json     term -> term id
+  ids.json       row -> chunk id (same IDs as the Chroma collection)
+  offsets.npy    int64 (V+1,)  postings of term t are [offsets[t], offsets[t+1])
+  postings.npy   int32 (P,)    document rows
+  weights.npy    float32 (P,)  precomputed BM25 term weight (idf * tf part)
+
+A query's scores are just the summed weights of its terms' postings.
+"""
+import os
+import re
+import json
+import math
+import shutil
+from pathlib import Path
+
+import numpy as np
+
+LEXICAL_DIR_NAME = "bm25"
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+
+TOKEN = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?")
+
+
+def tokenize(text: str) -> list:
+    return TOKEN.findall(text.lower())
+
+
+def lexical_index_dir(chroma_dir) -> Path:
+    return Path(chroma_dir) / LEXICAL_DIR_NAME
+
+
+# =========================
+# BUILD
+# =========================
+class LexicalIndexBuilder:
+    def __init__(self, k1=None, b=None):
+        self.k1 = BM25_K1 if k1 is None else k1
+        self.b = BM25_B if b is None else b
+        self.ids = []
+        self.doc_len = []
+        self.vocab = {}
+        self._postings = []          # term id -> [(row, tf), ...]
+
+    def add(self, chunk_id, text):
+        row = len(self.ids)
+        tokens = tokenize(text)
+        counts = {}
+        for t in tokens:
+            counts[t] = counts.get(t, 0) + 1
+        for t, tf in counts.items():
+            tid = self.vocab.get(t)
+            if tid is None:
+                tid = self.vocab[t] = len(self._postings)
+                self._postings.append([])
+            self._postings[tid].append((row, tf))
+        self.ids.append(chunk_id)
+        self.doc_len.append(len(tokens))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def save(self, out_dir):
+        """Writes the index to out_dir (replaced atomically via a temp dir)."""
+        out_dir = Path(out_dir)
+        n = len(self.ids)
+        doc_len = np.asarray(self.doc_len, dtype=np.float32)
+        avgdl = float(doc_len.mean()) if n else 0.0
+
+        offsets = np.zeros(len(self._postings) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(p) for p in self._postings])
+        postings = np.empty(int(offsets[-1]), dtype=np.int32)
+        weights = np.empty(int(offsets[-1]), dtype=np.float32)
+        for tid, plist in enumerate(self._postings):
+            lo, hi = offsets[tid], offsets[tid + 1]
+            rows = np.fromiter((r for r, _ in plist), dtype=np.int32, count=len(plist))
+            tf = np.fromiter((f for _, f in plist), dtype=np.float32, count=len(plist))
+            idf = math.log(1 + (n - len(plist) + 0.5) / (len(plist) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * doc_len[rows] / max(avgdl, 1e-9))
+            postings[lo:hi] = rows
+            weights[lo:hi] = idf * tf * (self.k1 + 1) / (tf + norm)
+
+        tmp = out_dir.with_name(out_dir.name + ".tmp")
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+        np.save(tmp / "offsets.npy", offsets)
+        np.save(tmp / "postings.npy", postings)
+        np.save(tmp / "weights.npy", weights)
+        with open(tmp / "vocab.json", "w", encoding="utf-8") as f:
+            json.dump(self.vocab, f, ensure_ascii=False)
+        with open(tmp / "ids.json", "w", encoding="utf-8") as f:
+            json.dump(self.ids, f, ensure_ascii=False)
+
+        old = out_dir.with_name(out_dir.name + ".old")
+        shutil.rmtree(old, ignore_errors=True)
+        if out_dir.exists():
+            os.replace(out_dir, old)
+        os.replace(tmp, out_dir)
+        shutil.rmtree(old, ignore_errors=True)
+        return out_dir
+
+
+# =========================
+# QUERY
+# =========================
+class LexicalIndex:
+    def __init__(self, index_dir):
+        index_dir = Path(index_dir)
+        self.offsets = np.load(index_dir / "offsets.npy", mmap_mode="r")
+        self.postings = np.load(index_dir / "postings.npy", mmap_mode="r")
+        self.weights = np.load(index_dir / "weights.npy", mmap_mode="r")
+        with open(index_dir / "vocab.json", encoding="utf-8") as f:
+            self.vocab = json.load(f)
+        with open(index_dir / "ids.json", encoding="utf-8") as f:
+            self.ids = json.load(f)
+
+    @classmethod
+    def load(cls, chroma_dir):
+        """The index built for chroma_dir, or None if there isn't one."""
+        index_dir = lexical_index_dir(chroma_dir)
+        if not (index_dir / "ids.json").exists():
+            return None
+        try:
+            return cls(index_dir)
+        except Exception as e:
+            print(f"Error loading lexical index {index_dir}: {e}")
+            return None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def search(self, query: str, n_results: int) -> list:
+        """[(chunk_id, bm25_score)] best first."""
+        tids = {self.vocab[t] for t in tokenize(query) if t in self.vocab}
+        if not tids or n_results <= 0:
+            return []
+        rows = np.concatenate([self.postings[self.offsets[t]:self.offsets[t + 1]] for t in tids])
+        w = np.concatenate([self.weights[self.offsets[t]:self.offsets[t + 1]] for t in tids])
+        uniq, inv = np.unique(rows, return_inverse=True)
+        scores = np.bincount(inv, weights=w)
+        k = min(n_results, len(uniq))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(self.ids[int(uniq[i])], float(scores[i])) for i in top]
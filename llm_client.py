@@ -0,0 +1,458 @@
+# llm_client.py
+"""
+Shared OpenRouter chat-completions client for both apps.
+
+- one pooled requests.Session per process (keep-alive, no handshake per call)
+- bounded concurrency across threads (LLM_MAX_CONCURRENCY), streams included
+- retries on 429 / 5xx / connection errors with exponential backoff + full
+  jitter, honouring Retry-After
+- per-call latency and token usage, aggregated in LLMClient.metrics()
+- streamed completions (SSE) via stream_chat(), with time-to-first-token
+- AsyncLLMClient: the same over httpx for the asyncio pipeline
+  (async_pipeline.py); cancelling the awaiting task closes the request
+
+Point OPENROUTER_BASE_URL at openrouter_stub.py to run without the network.
+"""
+import os
+import json
+import time
+import random
+import asyncio
+import threading
+import weakref
+from collections import deque
+from dataclasses import dataclass, asdict
+
+import requests
+from requests.adapters import HTTPAdapter
+
+OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
+OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+MODEL_NAME = os.getenv("MODEL_NAME", "xiaomi/mimo-v2-flash:free")
+
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "40"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "8"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+TRANSIENT_ERRORS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)
+
+
+class LLMError(Exception):
+    """Raised when a chat completion fails after all retries."""
+
+    def __init__(self, message, status=None, attempts=0):
+        super().__init__(message)
+        self.status = status
+        self.attempts = attempts
+
+
+@dataclass
+class LLMResult:
+    text: str
+    model: str
+    latency: float          # seconds, including retries
+    attempts: int
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    ttft: float = None      # seconds to first streamed token (streaming only)
+
+
+class _ClientBase:
+    """Config, retry policy, SSE parsing and metrics shared by the sync and async clients."""
+
+    def __init__(
+        self,
+        api_key=None,
+        base_url=None,
+        model=None,
+        timeout=None,
+        max_retries=None,
+        backoff_base=None,
+        backoff_max=None,
+        max_concurrency=None,
+    ):
+        self.api_key = api_key if api_key is not None else OPENROUTER_API_KEY
+        self.base_url = (base_url or OPENROUTER_BASE_URL).rstrip("/")
+        self.model = model or MODEL_NAME
+        self.timeout = LLM_TIMEOUT if timeout is None else timeout
+        self.max_retries = LLM_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff_base = LLM_BACKOFF_BASE if backoff_base is None else backoff_base
+        self.backoff_max = LLM_BACKOFF_MAX if backoff_max is None else backoff_max
+        self.concurrency = max_concurrency or LLM_MAX_CONCURRENCY
+
+        self._lock = threading.Lock()
+        self._totals = {"calls": 0, "errors": 0, "retries": 0, "latency": 0.0,
+                        "prompt_tokens": 0, "completion_tokens": 0}
+        self._recent = deque(maxlen=256)
+
+    # =========================
+    # HTTP
+    # =========================
+    def _headers(self):
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        return headers
+
+    def _backoff(self, attempt, retry_after=None):
+        if retry_after is not None:
+            return min(self.backoff_max, retry_after)
+        # full jitter: uniform(0, min(cap, base * 2^attempt))
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    @staticmethod
+    def _retry_after(resp):
+        try:
+            return float(resp.headers.get("Retry-After"))
+        except (TypeError, ValueError):
+            return None
+
+    def _payload(self, prompt, model, stream=False):
+        payload = {"model": model, "messages": [{"role": "user", "content": prompt}]}
+        if stream:
+            payload.update(stream=True, stream_options={"include_usage": True})
+        return payload
+
+    @staticmethod
+    def _sse_event(line, attempts):
+        """
+        The JSON event on one SSE line; None for blank keep-alives, ": OPENROUTER
+        PROCESSING" comments and unparsable data, "[DONE]" at the end.
+        """
+        if not line or not line.startswith("data:"):
+            return None
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            return data
+        try:
+            event = json.loads(data)
+        except ValueError:
+            return None
+        if event.get("error"):
+            raise LLMError(f"Stream error: {event['error']}", attempts=attempts)
+        return event
+
+    @staticmethod
+    def _deltas(event):
+        for choice in event.get("choices") or []:
+            delta = (choice.get("delta") or {}).get("content")
+            if delta:
+                yield delta
+
+    def _result(self, j, model, t0, attempts) -> LLMResult:
+        usage = j.get("usage") or {}
+        return LLMResult(
+            text=j["choices"][0]["message"]["content"],
+            model=model,
+            latency=time.perf_counter() - t0,
+            attempts=attempts,
+            prompt_tokens=int(usage.get("prompt_tokens") or 0),
+            completion_tokens=int(usage.get("completion_tokens") or 0),
+        )
+
+    def _stream_result(self, parts, usage, model, t0, attempts, ttft) -> LLMResult:
+        return LLMResult(
+            text="".join(parts),
+            model=model,
+            latency=time.perf_counter() - t0,
+            attempts=attempts,
+            prompt_tokens=int(usage.get("prompt_tokens") or 0),
+            completion_tokens=int(usage.get("completion_tokens") or 0),
+            ttft=ttft,
+        )
+
+    # =========================
+    # METRICS
+    # =========================
+    def record(self, result):
+        with self._lock:
+            t = self._totals
+            t["calls"] += 1
+            t["latency"] += result.latency
+            t["prompt_tokens"] += result.prompt_tokens
+            t["completion_tokens"] += result.completion_tokens
+            self._recent.append({k: v for k, v in asdict(result).items() if k != "text"})
+
+    def _record_error(self, latency):
+        with self._lock:
+            self._totals["calls"] += 1
+            self._totals["errors"] += 1
+            self._totals["latency"] += latency
+
+    def _record_retry(self):
+        with self._lock:
+            self._totals["retries"] += 1
+
+    def metrics(self):
+        with self._lock:
+            t = dict(self._totals)
+            recent = list(self._recent)
+        t["avg_latency"] = t["latency"] / t["calls"] if t["calls"] else 0.0
+        t["recent"] = recent
+        return t
+
+
+class LLMClient(_ClientBase):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._slots = threading.BoundedSemaphore(self.concurrency)
+
+    def post_chat(self, payload, timeout=None, stream=False):
+        """
+        POSTs a chat-completions payload with retries and returns
+        (response, attempts). A streamed response keeps its concurrency slot
+        until release_slot() is called after the body is closed. Raises
+        LLMError when out of retries.
+        """
+        url = f"{self.base_url}/chat/completions"
+        timeout = self.timeout if timeout is None else timeout
+        attempt = 0
+        while True:
+            attempt += 1
+            retry_after = None
+            self._slots.acquire()
+            held = False
+            try:
+                resp = self.session.post(url, headers=self._headers(), json=payload,
+                                         timeout=timeout, stream=stream)
+                if resp.status_code < 400:
+                    held = stream
+                    return resp, attempt
+                status = resp.status_code
+                error = f"HTTP {status}: {resp.text[:500]}"
+                retry_after = self._retry_after(resp)
+                resp.close()
+                retryable = status in RETRY_STATUSES
+            except requests.RequestException as e:
+                # InvalidURL, TooManyRedirects, ... fail at once
+                status, error = None, f"{type(e).__name__}: {e}"
+                retryable = isinstance(e, TRANSIENT_ERRORS)
+            finally:
+                if not held:
+                    self._slots.release()
+
+            if not retryable or attempt > self.max_retries:
+                raise LLMError(error, status=status, attempts=attempt)
+            self._record_retry()
+            time.sleep(self._backoff(attempt - 1, retry_after))
+
+    def release_slot(self):
+        self._slots.release()
+
+    # =========================
+    # CHAT
+    # =========================
+    def chat(self, prompt, model=None, timeout=None):
+        model = model or self.model
+        t0 = time.perf_counter()
+        try:
+            resp, attempts = self.post_chat(self._payload(prompt, model), timeout=timeout)
+            try:
+                result = self._result(resp.json(), model, t0, attempts)
+            except Exception as e:
+                raise LLMError(f"Malformed completion: {e}", status=resp.status_code, attempts=attempts)
+        except LLMError:
+            self._record_error(time.perf_counter() - t0)
+            raise
+        self.record(result)
+        return result
+
+    def complete(self, prompt, model=None, timeout=None):
+        return self.chat(prompt, model=model, timeout=timeout).text
+
+    def stream_chat(self, prompt, model=None, timeout=None):
+        """
+        Yields content deltas as they arrive (server-sent events). Retries only
+        happen before the first byte; a failure mid-stream raises LLMError.
+        The full text, latency and time-to-first-token are recorded at the end.
+        """
+        model = model or self.model
+        t0 = time.perf_counter()
+        try:
+            resp, attempts = self.post_chat(self._payload(prompt, model, stream=True), timeout=timeout, stream=True)
+        except LLMError:
+            self._record_error(time.perf_counter() - t0)
+            raise
+
+        parts, usage, ttft = [], {}, None
+        resp.encoding = "utf-8"
+        try:
+            with resp:
+                for line in resp.iter_lines(decode_unicode=True):
+                    event = self._sse_event(line, attempts)
+                    if event is None:
+                        continue
+                    if event == "[DONE]":
+                        break
+                    usage = event.get("usage") or usage
+                    for delta in self._deltas(event):
+                        if ttft is None:
+                            ttft = time.perf_counter() - t0
+                        parts.append(delta)
+                        yield delta
+        except requests.RequestException as e:
+            self._record_error(time.perf_counter() - t0)
+            raise LLMError(f"Stream interrupted: {type(e).__name__}: {e}", attempts=attempts)
+        except LLMError:
+            self._record_error(time.perf_counter() - t0)
+            raise
+        finally:
+            # held since post_chat, so LLM_MAX_CONCURRENCY also bounds open streams
+            self.release_slot()
+
+        self.record(self._stream_result(parts, usage, model, t0, attempts, ttft))
+
+
+class AsyncLLMClient(_ClientBase):
+    """
+    LLMClient for asyncio code: one httpx.AsyncClient connection pool and an
+    asyncio.Semaphore of LLM_MAX_CONCURRENCY slots, both bound to the event
+    loop that created it (see get_async_llm_client).
+    """
+
+    def __init__(self, **kwargs):
+        import httpx
+
+        super().__init__(**kwargs)
+        self._httpx = httpx
+        self.http = httpx.AsyncClient(limits=httpx.Limits(max_connections=self.concurrency,
+                                                          max_keepalive_connections=self.concurrency))
+        self._slots = asyncio.Semaphore(self.concurrency)
+
+    async def post_chat(self, payload, timeout=None, stream=False):
+        """
+        POSTs a chat-completions payload with retries and returns
+        (response, attempts); a streamed response must be closed with
+        `await response.aclose()` and then release_slot(). Raises LLMError
+        when out of retries.
+        """
+        url = f"{self.base_url}/chat/completions"
+        timeout = self.timeout if timeout is None else timeout
+        attempt = 0
+        while True:
+            attempt += 1
+            retry_after = None
+            await self._slots.acquire()
+            held = False
+            try:
+                request = self.http.build_request("POST", url, headers=self._headers(), json=payload,
+                                                  timeout=timeout)
+                resp = await self.http.send(request, stream=stream)
+                if resp.status_code < 400:
+                    held = stream
+                    return resp, attempt
+                status = resp.status_code
+                await resp.aread()
+                error = f"HTTP {status}: {resp.text[:500]}"
+                retry_after = self._retry_after(resp)
+                await resp.aclose()
+                retryable = status in RETRY_STATUSES
+            except (self._httpx.HTTPError, self._httpx.InvalidURL) as e:
+                # TooManyRedirects, bad URLs, ... fail at once
+                status, error = None, f"{type(e).__name__}: {e}"
+                retryable = isinstance(e, self._httpx.TransportError)
+            finally:
+                if not held:
+                    self._slots.release()
+
+            if not retryable or attempt > self.max_retries:
+                raise LLMError(error, status=status, attempts=attempt)
+            self._record_retry()
+            await asyncio.sleep(self._backoff(attempt - 1, retry_after))
+
+    def release_slot(self):
+        self._slots.release()
+
+    async def chat(self, prompt, model=None, timeout=None):
+        model = model or self.model
+        t0 = time.perf_counter()
+        try:
+            resp, attempts = await self.post_chat(self._payload(prompt, model), timeout=timeout)
+            try:
+                result = self._result(resp.json(), model, t0, attempts)
+            except Exception as e:
+                raise LLMError(f"Malformed completion: {e}", status=resp.status_code, attempts=attempts)
+        except LLMError:
+            self._record_error(time.perf_counter() - t0)
+            raise
+        self.record(result)
+        return result
+
+    async def stream_chat(self, prompt, model=None, timeout=None):
+        """Async-generator version of LLMClient.stream_chat."""
+        model = model or self.model
+        t0 = time.perf_counter()
+        try:
+            resp, attempts = await self.post_chat(self._payload(prompt, model, stream=True), timeout=timeout,
+                                                  stream=True)
+        except LLMError:
+            self._record_error(time.perf_counter() - t0)
+            raise
+
+        parts, usage, ttft = [], {}, None
+        try:
+            async for line in resp.aiter_lines():
+                event = self._sse_event(line, attempts)
+                if event is None:
+                    continue
+                if event == "[DONE]":
+                    break
+                usage = event.get("usage") or usage
+                for delta in self._deltas(event):
+                    if ttft is None:
+                        ttft = time.perf_counter() - t0
+                    parts.append(delta)
+                    yield delta
+        except self._httpx.HTTPError as e:
+            self._record_error(time.perf_counter() - t0)
+            raise LLMError(f"Stream interrupted: {type(e).__name__}: {e}", attempts=attempts)
+        except LLMError:
+            self._record_error(time.perf_counter() - t0)
+            raise
+        finally:
+            await resp.aclose()
+            self.release_slot()
+
+        self.record(self._stream_result(parts, usage, model, t0, attempts, ttft))
+
+    async def aclose(self):
+        await self.http.aclose()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_llm_client():
+    """Process-wide client, so every session shares one connection pool."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = LLMClient()
+        return _client
+
+
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_llm_client():
+    """AsyncLLMClient of the running event loop (its pool and slots can't be shared across loops)."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = AsyncLLMClient()
+    return client
+
+
+async def close_async_llm_client():
+    """Closes the running loop's AsyncLLMClient, if one was created."""
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
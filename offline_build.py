@@ -1,10 +1,24 @@
 # offline_build.py
 import os
 import json
+import time
+import hashlib
+import argparse
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from pathlib import Path
 
 import chromadb
-from chromadb.utils import embedding_functions
+
+from chunk_store import iter_chunks, iter_table_records, chunk_to_markdown, chunk_id as make_chunk_id
+from embedding_backends import get_embedding_function, embedding_cache_key
+from embedding_cache import EmbeddingCache
+from chunk_fields import extract_fields, fields_to_metadata
+from entity_filter import save_fund_index
+from lexical_index import LexicalIndexBuilder, lexical_index_dir
+from table_engine import save_tables
 
 # === portable paths & config ===
 import os
@@ -16,7 +30,7 @@ CHUNKS_DIR  = Path(os.getenv("CHUNKS_DIR", BASE_DIR / "chunks" / "previous_chunk
 CHROMA_DIR  = Path(os.getenv("CHROMA_DIR", BASE_DIR / "chromadb_vectors" / "global"))
 
 
-for d in (DATA_DIR, CHUNKS_DIR, CHROMA_DIR, UPLOADS_DIR, LOGS_DIR):
+for d in (CHUNKS_DIR, CHROMA_DIR):
     d.mkdir(parents=True, exist_ok=True)
 
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
@@ -26,85 +40,239 @@ OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 CHUNKS_DIR = CHUNKS_DIR
 CHROMA_DIR = CHROMA_DIR
 COLLECTION_NAME = "global_chunks"
+# collection metadata field recording embedding_cache_key() of its vectors
+EMBEDDING_KEY_FIELD = "embedding_key"
 
 # Batch size recommendation for 2026 for performance and stability
 BATCH_SIZE = 100 
 PROGRESS_EVERY = 500
 
+# Build pipeline: load/render -> embed (thread pool) -> Chroma writer, overlapped.
+# Each embed thread gets an equal share of torch's CPU threads.
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "256"))
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "2"))
+PIPELINE_DEPTH = int(os.getenv("PIPELINE_DEPTH", "4"))  # batches in flight per embed worker
+
+# Incremental mode upserts only new/changed chunks and deletes vanished IDs
+# instead of dropping and re-embedding the whole collection
+INCREMENTAL_BUILD = os.getenv("INCREMENTAL_BUILD", "0") == "1"
+
 # === embedding function ===
 # This uses the all-MiniLM-L12-v2 model which produces 384-dimensional vectors
-embedding_fn = embedding_functions.SentenceTransformerEmbeddingFunction(
-    model_name="all-MiniLM-L12-v2"
-)
-
-# === chunk -> markdown (compact) ===
-def chunk_to_markdown(chunk: dict) -> str:
-    lines = []
-    
-    # 1. Safely retrieve the global header or use a placeholder
-    global_headers = chunk.get('global_header', [])
-    # Check if list is not empty before accessing [0]
-    section_name = global_headers[0] if global_headers else "General"
-    
-    source = chunk.get("source_file", "Unknown Source")
-    lines.append(f"Context: {source} | Section: {section_name}")
-
-    # 2. Extract and join subheaders safely
-    subheaders = chunk.get("subheaders", [])
-    title = " | ".join(subheaders) if subheaders else "Data Row"
-    lines.append(f"### {title}")
-
-    # 3. Filter data: Skip noise like 0, NA, or empty strings
-    data_dict = chunk.get("data", {})
-    for k, v in data_dict.items():
-        # Using a set of 'noise' values for faster lookup in 2026
-        if v not in {0, "0", "NA", "N.A.", "", None}:
-            lines.append(f"- **{k}**: {v}")
-
-    return "\n".join(lines)
+# (reference, int8 or ONNX backend per EMBED_BACKEND — see embedding_backends.py)
+embedding_fn = get_embedding_function()
 
+# === stable per-chunk content hash (document text + metadata) ===
+def content_hash(text: str, meta: dict) -> str:
+    payload = json.dumps({"doc": text, "meta": meta}, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
 
 
 # === load chunks ===
-def load_chunks(chunks_dir):
-    docs, metas, ids = [], [], []
-    for fp in Path(chunks_dir).rglob("*.json"):
-        try:
-            with open(fp, "r", encoding="utf-8") as f:
-                c = json.load(f)
-        except Exception as e:
-            print(f"Error loading {fp}: {e}")
-            continue
-            
+def iter_records(chunks_dir):
+    """Yields (doc, meta, id) per chunk, rendered lazily."""
+    # .jsonl stores (one per workbook) plus any legacy per-row .json files
+    for fp, c in iter_chunks(chunks_dir):
         text = chunk_to_markdown(c)
         if not text:
             continue
             
         # Ensure ID is unique across different folders or versions
-        chunk_id = f"{c.get('source_file')}__{c.get('sheet_name')}__row_{c.get('excel_row_number')}"
-        docs.append(text)
-        ids.append(chunk_id)
-        metas.append({
+        chunk_id = make_chunk_id(c)
+        meta = {
             "source_file": c.get("source_file"),
             "sheet_name": c.get("sheet_name"),
             "excel_row_number": c.get("excel_row_number"),
-            "path": str(fp)
-        })
+        }
+        # fund / as-of date / metrics for `where` filters; stores written
+        # before field extraction existed get them computed here
+        meta.update(fields_to_metadata(c.get("fields") or extract_fields(c)))
+        # hashed without the store path, so moving CHUNKS_DIR or converting
+        # legacy .json files to .jsonl doesn't re-embed unchanged chunks
+        meta["content_hash"] = content_hash(text, meta)
+        meta["path"] = str(fp)
+        yield text, meta, chunk_id
+
+
+def load_chunks(chunks_dir):
+    docs, metas, ids = [], [], []
+    for text, meta, chunk_id in iter_records(chunks_dir):
+        docs.append(text)
+        ids.append(chunk_id)
+        metas.append(meta)
     return docs, metas, ids
 
-# === main build with batching ===
-def main():
-    os.makedirs(CHROMA_DIR, exist_ok=True)
-    print("Loading chunks...")
-    docs, metas, ids = load_chunks(CHUNKS_DIR)
-    total = len(docs)
-    print(f"Loaded {total} chunks")
-    if total == 0:
-        print("No chunks found. Exiting.")
+
+# === incremental diff against what the collection already holds ===
+def fetch_existing_hashes(collection, page_size=5000):
+    existing = {}
+    offset = 0
+    while True:
+        page = collection.get(include=["metadatas"], limit=page_size, offset=offset)
+        page_ids = page["ids"]
+        if not page_ids:
+            break
+        for cid, meta in zip(page_ids, page["metadatas"]):
+            existing[cid] = (meta or {}).get("content_hash")
+        offset += len(page_ids)
+    return existing
+
+
+def diff_chunks(docs, metas, ids, existing):
+    """
+    Returns (changed_idx, stale_ids): positions of new/changed chunks to
+    upsert, and IDs in the collection that no longer exist on disk.
+    """
+    changed_idx = [
+        i for i, cid in enumerate(ids)
+        if existing.get(cid) != metas[i]["content_hash"]
+    ]
+    current = set(ids)
+    stale_ids = [cid for cid in existing if cid not in current]
+    return changed_idx, stale_ids
+
+
+# === build pipeline ===
+class StageStats:
+    def __init__(self, name):
+        self.name = name
+        self.docs = 0
+        self.busy = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, docs, seconds):
+        with self._lock:
+            self.docs += docs
+            self.busy += seconds
+
+    def format(self):
+        rate = self.docs / self.busy if self.busy else 0.0
+        return f"{self.name:<6} {self.docs:>8} docs  {self.busy:8.2f}s busy  {rate:10.1f} docs/sec"
+
+
+def _configure_torch_threads(workers):
+    try:
+        import torch
+    except ImportError:
         return
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // max(1, workers)))
+
+
+def _batched(iterable, size):
+    it = iter(iterable)
+    while True:
+        batch = list(islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+
+def run_pipeline(write, records, cache, label="Processed"):
+    """
+    Streams (doc, meta, id) records through three overlapping stages:
+      load   - this thread pulls and renders the next batch
+      embed  - EMBED_WORKERS threads embed batches via the cache
+      write  - one thread writes batches (with precomputed embeddings) in order
+    Returns {stage: StageStats}.
+    """
+    stats = {name: StageStats(name) for name in ("load", "embed", "write")}
+    _configure_torch_threads(EMBED_WORKERS)
+
+    def embed(batch):
+        t0 = time.perf_counter()
+        docs = [d for d, _, _ in batch]
+        vectors = cache.embed(docs, embedding_fn)
+        stats["embed"].add(len(batch), time.perf_counter() - t0)
+        return batch, vectors
+
+    written = [0]
+
+    def store(batch, vectors):
+        t0 = time.perf_counter()
+        write(
+            documents=[d for d, _, _ in batch],
+            embeddings=vectors,
+            metadatas=[m for _, m, _ in batch],
+            ids=[i for _, _, i in batch],
+        )
+        stats["write"].add(len(batch), time.perf_counter() - t0)
+        before, written[0] = written[0], written[0] + len(batch)
+        if written[0] // PROGRESS_EVERY != before // PROGRESS_EVERY:
+            print(f"{label} {written[0]} chunks")
+
+    max_in_flight = max(1, EMBED_WORKERS * PIPELINE_DEPTH)
+    embedding, writing = deque(), deque()
+
+    def hand_off_oldest():
+        # keep write order == load order; surface writer errors early
+        writing.append(writer.submit(store, *embedding.popleft().result()))
+        while writing and writing[0].done():
+            writing.popleft().result()
+
+    wall = time.perf_counter()
+    with ThreadPoolExecutor(EMBED_WORKERS, thread_name_prefix="embed") as embedders, \
+            ThreadPoolExecutor(1, thread_name_prefix="chroma-write") as writer:
+        batches = _batched(records, EMBED_BATCH_SIZE)
+        while True:
+            t0 = time.perf_counter()
+            batch = next(batches, None)
+            if batch is None:
+                break
+            stats["load"].add(len(batch), time.perf_counter() - t0)
 
-    client = chromadb.PersistentClient(path=CHROMA_DIR)
+            embedding.append(embedders.submit(embed, batch))
+            while len(embedding) >= max_in_flight:
+                hand_off_oldest()
 
+        while embedding:
+            hand_off_oldest()
+        for f in writing:
+            f.result()
+    wall = time.perf_counter() - wall
+
+    print(f"{label} {written[0]} chunks")
+    for s in stats.values():
+        print(s.format())
+    if wall:
+        print(f"overall {written[0]:>8} docs  {wall:8.2f}s wall  {written[0] / wall:10.1f} docs/sec")
+    return stats
+
+
+def indexed_embedding_key(client):
+    """embedding_cache_key() the collection was built with; None if it is missing or predates the field."""
+    try:
+        collection = client.get_collection(COLLECTION_NAME, embedding_function=embedding_fn)
+    except Exception:
+        return None
+    return (collection.metadata or {}).get(EMBEDDING_KEY_FIELD)
+
+
+def build_incremental(client, docs, metas, ids, cache):
+    collection = client.get_or_create_collection(
+        name=COLLECTION_NAME,
+        embedding_function=embedding_fn
+    )
+
+    existing = fetch_existing_hashes(collection)
+    changed_idx, stale_ids = diff_chunks(docs, metas, ids, existing)
+    print(
+        f"Incremental: {len(existing)} in collection, {len(changed_idx)} new/changed, "
+        f"{len(ids) - len(changed_idx)} unchanged, {len(stale_ids)} to delete"
+    )
+
+    for start in range(0, len(stale_ids), BATCH_SIZE):
+        collection.delete(ids=stale_ids[start:start + BATCH_SIZE])
+
+    run_pipeline(
+        collection.upsert,
+        ((docs[i], metas[i], ids[i]) for i in changed_idx),
+        cache,
+        label="Upserted",
+    )
+    return collection
+
+
+def build_full(client, records, cache):
     # Recreate collection cleanly
     try:
         client.delete_collection(COLLECTION_NAME)
@@ -113,28 +281,94 @@ def main():
         
     collection = client.create_collection(
         name=COLLECTION_NAME, 
-        embedding_function=embedding_fn
+        embedding_function=embedding_fn,
+        metadata={EMBEDDING_KEY_FIELD: embedding_cache_key()},
     )
 
-    # Adding documents in batches
-    for start in range(0, total, BATCH_SIZE):
-        end = min(start + BATCH_SIZE, total)
-        
-        # FIX: Chroma handles the embedding internally. 
-        # Just pass documents, and the collection will use embedding_fn automatically
-        collection.add(
-            documents=docs[start:end],
-            metadatas=metas[start:end],
-            ids=ids[start:end]
-        )
-        
-        if end % PROGRESS_EVERY == 0 or end == total:
-            print(f"Processed {end}/{total} chunks")
+    # Adding documents in batches; chunks stream straight from disk
+    run_pipeline(collection.add, records, cache)
+    return collection
 
-    print("DONE. Total vectors:", collection.count())
-    print("Chroma directory:", CHROMA_DIR)
 
-if __name__ == "__main__":
-    main()
+def _prepend(first, rest):
+    yield first
+    yield from rest
+
+
+def _collect(records, funds, lexical):
+    # side indexes built from the same stream the embedder consumes
+    for doc, meta, chunk_id in records:
+        if meta.get("fund_key"):
+            funds[meta["fund_key"]] = meta["fund_name"]
+        lexical.add(chunk_id, doc)
+        yield doc, meta, chunk_id
+
+
+# === main build with batching ===
+def main(incremental=None, chunks_dir=None, chroma_dir=None):
+    if incremental is None:
+        incremental = INCREMENTAL_BUILD
+    # CHUNKS_DIR / CHROMA_DIR unless given (e.g. by bench_ingest.py)
+    chunks_dir = Path(chunks_dir or CHUNKS_DIR)
+    chroma_dir = Path(chroma_dir or CHROMA_DIR)
 
+    os.makedirs(chroma_dir, exist_ok=True)
+    if incremental:
+        # the diff needs every ID/hash up front
+        print("Loading chunks...")
+        docs, metas, ids = load_chunks(chunks_dir)
+        # no chunks left still has to delete every stale ID and empty the side indexes
+        print(f"Loaded {len(docs)} chunks")
+    else:
+        records = iter_records(chunks_dir)
+        first = next(records, None)
+        if first is None:
+            print("No chunks found. Exiting.")
+            return
+        records = _prepend(first, records)
 
+    client = chromadb.PersistentClient(path=str(chroma_dir))
+    cache = EmbeddingCache(embedding_cache_key())
+
+    indexed_key = indexed_embedding_key(client) if incremental else None
+    if incremental and indexed_key != embedding_cache_key():
+        # unchanged chunks keep their stored vectors, which must come from
+        # the same backend / model the queries are embedded with
+        print(f"Collection vectors are not from {embedding_cache_key()} (recorded: {indexed_key}); rebuilding in full")
+        incremental = False
+        records = zip(docs, metas, ids)
+
+    funds = {}
+    lexical = LexicalIndexBuilder()
+    try:
+        if incremental:
+            # unchanged chunks still belong in the side indexes, so they are
+            # rebuilt from every loaded chunk (cheap next to embedding)
+            for _ in _collect(zip(docs, metas, ids), funds, lexical):
+                pass
+            collection = build_incremental(client, docs, metas, ids, cache)
+        else:
+            collection = build_full(client, _collect(records, funds, lexical), cache)
+    finally:
+        cache.save()
+        print(cache.format_stats())
+
+    # fund catalog for the query-time entity matcher
+    save_fund_index(chroma_dir, funds)
+    print(f"Fund index: {len(funds)} funds")
+    # BM25 index for hybrid retrieval (memory-mapped by the apps)
+    lexical.save(lexical_index_dir(chroma_dir))
+    print(f"Lexical index: {len(lexical)} docs, {len(lexical.vocab)} terms")
+    # columnar tables for the structured TABLE path
+    print(f"Tables: {save_tables(chroma_dir, iter_table_records(chunks_dir))}")
+
+    print("DONE. Total vectors:", collection.count())
+    print("Chroma directory:", chroma_dir)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the global Chroma index from chunk stores")
+    parser.add_argument(
+        "--incremental", action=argparse.BooleanOptionalAction, default=INCREMENTAL_BUILD,
+        help="upsert only new/changed chunks and delete vanished ones (default from INCREMENTAL_BUILD)",
+    )
+    main(incremental=parser.parse_args().incremental)
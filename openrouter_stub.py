@@ -0,0 +1,178 @@
+# openrouter_stub.py
+"""
+Local stand-in for OpenRouter's POST /api/v1/chat/completions.
+
+Answers are deterministic (derived from the prompt), with configurable
+artificial latency and injected failures, so llm_client and the apps can be
+exercised offline:
+
+    python openrouter_stub.py --port 8089 --latency 0.5
+    OPENROUTER_BASE_URL=http://127.0.0.1:8089/api/v1 OPENROUTER_API_KEY=stub streamlit run ...
+
+Router+planner prompts get a valid JSON decision ("simple" unless the query
+contains "compare" / " and ", in which case it's split into subqueries).
+"""
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubConfig:
+    def __init__(self, latency=0.0, jitter=0.0, fail_rate=0.0, fail_status=503, seed=0, token_delay=0.0):
+        self.latency = latency          # seconds added to every response (before the first token)
+        self.jitter = jitter            # +/- uniform seconds on top of latency
+        self.token_delay = token_delay  # seconds between streamed tokens
+        self.fail_rate = fail_rate      # fraction of requests answered with fail_status
+        self.fail_status = fail_status
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def next_delay_and_failure(self):
+        with self.lock:
+            self.requests += 1
+            delay = self.latency + (self.rng.uniform(-self.jitter, self.jitter) if self.jitter else 0.0)
+            fail = self.fail_rate > 0 and self.rng.random() < self.fail_rate
+        return max(0.0, delay), fail
+
+
+def _router_answer(prompt):
+    query = prompt.split("User query:", 1)[-1].strip()
+    lowered = query.lower()
+    if "compare" in lowered and " and " in lowered:
+        head, tail = query.split(" and ", 1)
+        return json.dumps({"decision": "complex", "subqueries": [head.strip(), tail.strip()]})
+    return json.dumps({"decision": "simple", "subqueries": []})
+
+
+def stub_completion(prompt):
+    if prompt.startswith("You are a router and planner."):
+        return _router_answer(prompt)
+    digest = hashlib.sha1(prompt.encode("utf-8")).hexdigest()[:12]
+    return f"STUB ANSWER {digest}: the context covers {prompt.count(chr(10))} lines."
+
+
+def _usage(prompt, text):
+    # ~4 chars per token, good enough for a stub
+    p, c = max(1, len(prompt) // 4), max(1, len(text) // 4)
+    return {"prompt_tokens": p, "completion_tokens": c, "total_tokens": p + c}
+
+
+def make_handler(config):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # headers and body go out as separate writes; without TCP_NODELAY,
+        # Nagle + delayed ACK add ~40 ms to every response and skew benchmarks
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def _send_json(self, status, body):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _send_stream(self, text, model, usage):
+            # SSE, one event per word; connection closes at the end of the stream
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+
+            def event(body):
+                self.wfile.write(f"data: {json.dumps(body)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+
+            self.wfile.write(b": OPENROUTER PROCESSING\n\n")
+            words = text.split(" ")
+            for i, word in enumerate(words):
+                if i and config.token_delay:
+                    time.sleep(config.token_delay)
+                delta = word if i == 0 else " " + word
+                event({"object": "chat.completion.chunk", "model": model,
+                       "choices": [{"index": 0, "delta": {"content": delta}, "finish_reason": None}]})
+            event({"object": "chat.completion.chunk", "model": model,
+                   "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": usage})
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            try:
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                prompt = payload["messages"][-1]["content"]
+            except Exception as e:
+                self._send_json(400, {"error": {"message": f"bad request: {e}"}})
+                return
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": "not found"}})
+                return
+
+            delay, fail = config.next_delay_and_failure()
+            time.sleep(delay)
+            if fail:
+                self._send_json(config.fail_status, {"error": {"message": "stub injected failure"}})
+                return
+
+            text = stub_completion(prompt)
+            if payload.get("stream"):
+                self._send_stream(text, payload.get("model", "stub"), _usage(prompt, text))
+                return
+            self._send_json(200, {
+                "id": "stub-" + hashlib.sha1(prompt.encode("utf-8")).hexdigest()[:16],
+                "object": "chat.completion",
+                "model": payload.get("model", "stub"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text},
+                             "finish_reason": "stop"}],
+                "usage": _usage(prompt, text),
+            })
+
+    return Handler
+
+
+def start_stub_server(host="127.0.0.1", port=0, **config_kwargs):
+    """
+    Starts the stub in a daemon thread. Returns (server, base_url); call
+    server.shutdown() when done. port=0 picks a free port.
+    """
+    config = StubConfig(**config_kwargs)
+    server = ThreadingHTTPServer((host, port), make_handler(config))
+    server.daemon_threads = True
+    server.stub_config = config
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/api/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local OpenRouter chat-completions stub")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per response")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--token-delay", type=float, default=0.0, help="seconds between streamed tokens")
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--fail-status", type=int, default=503)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    config = StubConfig(args.latency, args.jitter, args.fail_rate, args.fail_status, args.seed, args.token_delay)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(config))
+    print(f"OpenRouter stub on http://{args.host}:{args.port}/api/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+# query_api.py
+"""
+Headless query service: the query paths in query_pipeline.py behind an async
+HTTP API, with the embedding model, collections, side indexes, router and
+answer cache loaded once per process (rag_resources.py) and shared by every
+request. Both Streamlit apps are thin clients of it (query_client.py).
+
+  POST /query                 {"query", "mode": "multi" | "single",
+                               "upload_id"?, "stream"?}
+                              multi   process_query_and_log, behind the answer cache
+                              single  process_single_step (also returns the chunks)
+                              stream  NDJSON events: {"type": "token", "text"} ...
+                                      then {"type": "result", ...} or {"type": "error"}
+  POST /uploads?filename=&mode=   raw .xlsx body -> background indexing job
+  GET  /uploads/{job_id}?mode=    job status / progress
+  GET  /health, GET /metrics      liveness, stage latency (Prometheus text)
+
+Queries run on the asyncio pipeline (async_pipeline.py): LLM calls are
+awaited on one httpx pool (LLM_MAX_CONCURRENCY per process), the blocking
+lookups use a thread pool of QUERY_WORKERS, and at most QUERY_MAX_CONCURRENCY
+queries run at once (503 once a request has queued QUERY_QUEUE_TIMEOUT). A
+client that disconnects cancels its query. Queries hold
+no per-process state beyond caches, so scale out with more processes or
+containers sharing CHROMA_DIR / UPLOADS_DIR behind a load balancer. An
+upload's progress is only known to the process indexing it; once finished,
+any process serves it from disk.
+
+    uvicorn query_api:app --host 0.0.0.0 --port 8000 --workers 2
+"""
+import os
+import re
+import json
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from dataclasses import asdict
+from pathlib import Path
+from typing import Literal, Optional
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+
+from chunk_store import chunk_to_brief_markdown
+from async_pipeline import process_query_and_log, process_single_step, query_slot, QueryBusy, QUERY_MAX_CONCURRENCY
+from llm_client import close_async_llm_client
+from rag_resources import (
+    get_embedding_fn, get_collection, get_answer_cache, collection_scope, get_router, get_entity_matcher,
+    get_lexical_index, get_table_store, get_upload_indexer,
+)
+from tracing import STAGE_METRICS
+
+BASE_DIR = Path(__file__).resolve().parent
+
+CHROMA_DIR = Path(os.getenv("CHROMA_DIR", BASE_DIR / "chromadb_vectors" / "global"))
+GLOBAL_COLLECTION = "global_chunks"
+UPLOADS_DIR = Path(os.getenv("UPLOADS_DIR", BASE_DIR / "chromadb_vectors" / "uploaded"))
+
+# threads for the blocking steps (Chroma, BM25, tables, index loads, logs)
+# of all queries in flight; LLM waits hold no thread
+QUERY_WORKERS = int(os.getenv("QUERY_WORKERS", "16"))
+# how often a non-streamed query checks whether its client is still there
+DISCONNECT_POLL_SECONDS = float(os.getenv("DISCONNECT_POLL_SECONDS", "0.5"))
+# Answer cache in front of process_query_and_log (see answer_cache.py for TTL/size/similarity)
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE", "1") == "1"
+
+# each mode indexes uploads with the document text of its global index
+UPLOAD_RENDER = {"multi": None, "single": chunk_to_brief_markdown}
+
+# upload_indexer.content_id
+JOB_ID = re.compile(r"^[0-9a-f]{16}$")
+
+
+class QueryRequest(BaseModel):
+    query: str
+    mode: Literal["multi", "single"] = "multi"
+    upload_id: Optional[str] = None     # query this upload's index instead of the global one
+    stream: bool = False
+
+
+# =========================
+# QUERY PATHS
+# =========================
+def upload_indexer(mode):
+    return get_upload_indexer(str(UPLOADS_DIR / mode), UPLOAD_RENDER[mode])
+
+
+def get_job(mode, job_id):
+    return upload_indexer(mode).get(job_id) if JOB_ID.match(job_id) else None
+
+
+def job_status(job) -> dict:
+    return {**asdict(job), "chroma_dir": str(job.chroma_dir), "fraction": job.fraction(), "description": job.describe()}
+
+
+def load_index(mode, upload_id=None) -> dict:
+    """Cached collection + side indexes of the global index or a finished upload (blocking)."""
+    if not upload_id:
+        chroma_dir, collection_name, label = CHROMA_DIR, GLOBAL_COLLECTION, "Global"
+    else:
+        job = get_job(mode, upload_id)
+        if job is None or job.status != "done":
+            raise HTTPException(409, f"Upload {upload_id} is not indexed (status: {job.status if job else 'unknown'})")
+        chroma_dir, collection_name, label = job.chroma_dir, job.collection_name, f"Uploaded: {job.filename}"
+    return {
+        "label": label,
+        "scope": collection_scope(chroma_dir, collection_name),
+        "collection": get_collection(chroma_dir, collection_name),
+        "matcher": get_entity_matcher(chroma_dir, collection_name),
+        "lexical": get_lexical_index(chroma_dir),
+        "tables": get_table_store(chroma_dir),
+    }
+
+
+def is_error_answer(answer) -> bool:
+    return not answer or answer.startswith(("ERROR", "Error")) or "ERROR_CALLING_LLM" in answer
+
+
+async def run_multi(req, stream_to=None) -> dict:
+    index = await asyncio.to_thread(load_index, "multi", req.upload_id)
+    query = req.query.strip()
+    answer_cache = get_answer_cache()
+    # semantic lookups embed the query: off the loop
+    cached = await asyncio.to_thread(answer_cache.get, query, index["scope"]) if ANSWER_CACHE_ENABLED else None
+    if cached:
+        answer, log_path = cached["answer"], cached["log_path"]
+    else:
+        answer, log_path = await process_query_and_log(
+            query, index["collection"], stream_to=stream_to, router=get_router(),
+            matcher=index["matcher"], lexical=index["lexical"], tables=index["tables"],
+        )
+        if ANSWER_CACHE_ENABLED and not is_error_answer(answer):
+            await asyncio.to_thread(answer_cache.put, query, index["scope"], answer, str(log_path))
+    return {
+        "answer": answer,
+        "log_path": str(log_path) if log_path else None,
+        "label": index["label"],
+        "cache": {
+            "hit": bool(cached),
+            "match": cached["match"] if cached else None,
+            "similarity": cached["similarity"] if cached else None,
+            "hit_rate": answer_cache.stats()["hit_rate"],
+        },
+    }
+
+
+async def run_single(req, stream_to=None) -> dict:
+    index = await asyncio.to_thread(load_index, "single", req.upload_id)
+    answer, docs, metas = await process_single_step(
+        req.query.strip(), index["collection"], stream_to=stream_to,
+        matcher=index["matcher"], lexical=index["lexical"],
+    )
+    return {"answer": answer, "label": index["label"], "documents": docs, "metadatas": metas}
+
+
+RUNNERS = {"multi": run_multi, "single": run_single}
+
+
+# =========================
+# APP
+# =========================
+@asynccontextmanager
+async def lifespan(app):
+    # asyncio.to_thread runs on the default executor
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=QUERY_WORKERS, thread_name_prefix="query")
+    )
+
+    # warm the model and the global index before taking traffic
+    def warm():
+        get_embedding_fn()
+        get_router()
+        if (CHROMA_DIR / "chroma.sqlite3").exists():
+            get_collection(CHROMA_DIR, GLOBAL_COLLECTION)
+    await asyncio.to_thread(warm)
+    yield
+    await close_async_llm_client()
+
+
+app = FastAPI(title="Financial RAG query API", lifespan=lifespan)
+
+
+async def stream_events(run, req):
+    """Runs run(req, stream_to) as a task, yielding its answer tokens, then the result, as NDJSON."""
+    queue = asyncio.Queue()
+
+    async def stream_to(tokens):
+        async for text in tokens:
+            queue.put_nowait({"type": "token", "text": text})
+
+    async def job():
+        try:
+            async with query_slot():
+                queue.put_nowait({"type": "result", **await run(req, stream_to)})
+        except QueryBusy as e:
+            queue.put_nowait({"type": "error", "status": 503, "detail": str(e)})
+        except HTTPException as e:
+            queue.put_nowait({"type": "error", "status": e.status_code, "detail": e.detail})
+        except Exception as e:
+            queue.put_nowait({"type": "error", "status": 500, "detail": f"{type(e).__name__}: {e}"})
+        finally:
+            queue.put_nowait(None)
+
+    task = asyncio.create_task(job())
+    try:
+        while (event := await queue.get()) is not None:
+            yield json.dumps(event, ensure_ascii=False, default=str) + "\n"
+    finally:
+        # the response was torn down early: the client went away
+        task.cancel()
+
+
+async def run_until_disconnect(request, run, req):
+    """Awaits run(req), cancelling it if the client disconnects first."""
+    async def job():
+        async with query_slot():
+            return await run(req)
+
+    task = asyncio.create_task(job())
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_SECONDS)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                task.cancel()
+                raise HTTPException(499, "Client disconnected")
+    except QueryBusy as e:
+        raise HTTPException(503, str(e))
+    finally:
+        task.cancel()
+
+
+@app.post("/query")
+async def query(req: QueryRequest, request: Request):
+    if not req.query.strip():
+        raise HTTPException(422, "Empty query")
+    run = RUNNERS[req.mode]
+    if req.stream:
+        return StreamingResponse(stream_events(run, req), media_type="application/x-ndjson")
+    return await run_until_disconnect(request, run, req)
+
+
+@app.post("/uploads")
+async def submit_upload(request: Request, filename: str, mode: Literal["multi", "single"] = "multi"):
+    if not filename.lower().endswith(".xlsx"):
+        raise HTTPException(422, "Only .xlsx uploads are supported")
+    data = await request.body()
+    if not data:
+        raise HTTPException(422, "Empty upload")
+    # same content (sha256) returns the existing job / finished index
+    job = await asyncio.to_thread(lambda: upload_indexer(mode).submit(filename, data))
+    return job_status(job)
+
+
+@app.get("/uploads/{job_id}")
+async def upload_job(job_id: str, mode: Literal["multi", "single"] = "multi"):
+    job = get_job(mode, job_id)
+    if job is None:
+        raise HTTPException(404, f"Unknown upload {job_id}")
+    return job_status(job)
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok", "workers": QUERY_WORKERS, "max_queries": QUERY_MAX_CONCURRENCY}
+
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(STAGE_METRICS.prometheus_text(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,122 @@
+# query_client.py
+"""
+HTTP client for query_api.py, used by both Streamlit apps so they hold no
+model, index or pipeline state themselves.
+
+QUERY_API_URL points at a running service (e.g. http://query-api:8000 in
+docker-compose). Without it, connect() starts the service in-process on a
+loopback port, so a single container / `streamlit run` still works as before.
+"""
+import os
+import json
+import socket
+import threading
+import time
+
+import requests
+
+QUERY_API_URL = os.getenv("QUERY_API_URL", "")
+# queries can take several LLM calls; the server enforces per-call timeouts
+QUERY_API_TIMEOUT = float(os.getenv("QUERY_API_TIMEOUT", "300"))
+EMBEDDED_API_START_TIMEOUT = float(os.getenv("EMBEDDED_API_START_TIMEOUT", "600"))
+
+
+class QueryAPIError(Exception):
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class QueryClient:
+    def __init__(self, base_url, timeout=None):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = QUERY_API_TIMEOUT if timeout is None else timeout
+        self.session = requests.Session()
+
+    def _request(self, method, path, **kwargs):
+        """session.request, with the service being unreachable raised as QueryAPIError."""
+        try:
+            resp = self.session.request(method, f"{self.base_url}{path}", **kwargs)
+        except requests.RequestException as e:
+            raise QueryAPIError(f"query service unreachable: {type(e).__name__}: {e}")
+        return self._check(resp)
+
+    def _check(self, resp):
+        if resp.status_code >= 400:
+            try:
+                detail = resp.json().get("detail")
+            except ValueError:
+                detail = resp.text
+            raise QueryAPIError(f"{resp.status_code}: {detail}", status=resp.status_code)
+        return resp
+
+    def query(self, query, mode="multi", upload_id=None, stream_to=None) -> dict:
+        """
+        Runs one query and returns the service's result dict ("answer", ...).
+        stream_to, if given, receives a generator of answer tokens as they
+        arrive (e.g. st.write_stream), like process_query_and_log's.
+        """
+        body = {"query": query, "mode": mode, "upload_id": upload_id, "stream": stream_to is not None}
+        resp = self._request("POST", "/query", json=body, timeout=self.timeout, stream=stream_to is not None)
+        if stream_to is None:
+            return resp.json()
+
+        final = {}
+
+        def tokens():
+            with resp:
+                try:
+                    for line in resp.iter_lines(decode_unicode=True):
+                        if not line:
+                            continue
+                        event = json.loads(line)
+                        if event["type"] == "token":
+                            yield event["text"]
+                        else:
+                            final.update(event)
+                except requests.RequestException as e:
+                    final.update(detail=f"stream interrupted: {type(e).__name__}: {e}")
+
+        events = tokens()
+        stream_to(events)
+        for _ in events:   # whatever the renderer left unread
+            pass
+        if final.get("type") != "result":
+            raise QueryAPIError(final.get("detail", "stream ended without a result"), status=final.get("status"))
+        return final
+
+    def submit_upload(self, filename, data: bytes, mode="multi") -> dict:
+        return self._request("POST", "/uploads", params={"filename": filename, "mode": mode}, data=data,
+                             headers={"Content-Type": "application/octet-stream"}, timeout=self.timeout).json()
+
+    def upload_job(self, job_id, mode="multi") -> dict:
+        return self._request("GET", f"/uploads/{job_id}", params={"mode": mode}, timeout=30).json()
+
+    def health(self) -> dict:
+        return self._request("GET", "/health", timeout=5).json()
+
+
+def start_embedded_api(host="127.0.0.1"):
+    """Serves query_api on a free loopback port in a daemon thread; returns its base URL once it is up."""
+    import uvicorn
+    from query_api import app
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, 0))
+    server = uvicorn.Server(uvicorn.Config(app, log_level="warning"))
+    thread = threading.Thread(target=server.run, kwargs={"sockets": [sock]}, name="query-api", daemon=True)
+    thread.start()
+
+    # startup warms the model and index, which can take a while on first run
+    deadline = time.monotonic() + EMBEDDED_API_START_TIMEOUT
+    while not server.started:
+        if not thread.is_alive() or time.monotonic() > deadline:
+            raise QueryAPIError("embedded query API did not start")
+        time.sleep(0.05)
+    return f"http://{host}:{sock.getsockname()[1]}"
+
+
+def connect() -> QueryClient:
+    """Client for QUERY_API_URL, or for an in-process service when it is unset."""
+    return QueryClient(QUERY_API_URL or start_embedded_api())
@@ -0,0 +1,440 @@
+# query_pipeline.py
+"""
+The query paths behind both apps, importable without Streamlit (query_api.py
+serves them over HTTP; benchmarks and headless runs call them directly).
+
+process_query_and_log, the multi-step orchestrator (new_streamlit_wth_node.py):
+
+  router+planner  ->  SIMPLE: one retrieval + answer
+                  ->  COMPLEX: batched retrieval, sub-answers in parallel,
+                      final synthesis (no retrieval)
+                  ->  TABLE: filter / aggregate over the columnar tables
+
+Every LLM prompt and response goes untruncated into one .txt log per query
+under LOGS_DIR, followed by the stage trace as JSON (see tracing.py).
+
+process_single_step (streamlit_app.py): where filter -> search -> pack -> one
+LLM answer, returning the retrieved chunks alongside it.
+"""
+import os
+import json
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+import chromadb
+
+from context_budget import (
+    assemble_context, format_context_stats, CONTEXT_TOKEN_BUDGET, CONTEXT_TOKEN_BUDGET_PER_SUB,
+)
+from embedding_backends import get_embedding_function
+from entity_filter import EntityMatcher, METADATA_FILTERS
+from lexical_index import LexicalIndex
+from llm_client import get_llm_client, LLMError
+from retrieval import search, retrieve_hits, retrieve_hits_many, RETRIEVAL_MODE
+from router import Router
+from table_engine import TableQuery, TableStore, TABLE_ENGINE
+from tracing import span, start_trace, bind
+
+BASE_DIR = Path(__file__).resolve().parent
+
+# ===========================
+# CONFIG
+# ===========================
+OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
+MODEL_NAME = os.getenv("MODEL_NAME", "xiaomi/mimo-v2-flash:free")
+
+# Plain LLM router+planner (no cache, no local routing) when no router is passed
+LLM_ONLY_ROUTER = Router(mode="llm", use_cache=False)
+
+# Retrieval sizes
+# (hybrid RETRIEVAL_MODE keeps recall at much lower values)
+TOP_K_SIMPLE = int(os.getenv("TOP_K_SIMPLE", "50"))      # for SIMPLE path retrieval
+TOP_K_PER_SUB = int(os.getenv("TOP_K_PER_SUB", "50"))    # per-subquery retrieval
+# what is actually sent to the LLM is capped by a token budget, not TOP_K:
+# candidates are deduped, ranked by distance and packed (see context_budget.py)
+
+# single-step path (hybrid retrieval keeps recall at a much lower TOP_K)
+TOP_K_SINGLE_STEP = int(os.getenv("TOP_K", "50"))
+
+# Subqueries (max 4) are retrieved + answered concurrently
+SUBQUERY_WORKERS = int(os.getenv("SUBQUERY_WORKERS", "4"))
+
+# Logging directory (single .txt per query)
+LOGS_BASE_DIR = Path(os.getenv("LOGS_DIR", BASE_DIR / "logs"))
+LOGS_BASE_DIR.mkdir(parents=True, exist_ok=True)
+
+# ===========================
+# UTILITIES
+# ===========================
+def now_ts():
+    return datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+def short_slug(text: str, max_len: int = 40):
+    s = " ".join(text.split())
+    s = s[:max_len]
+    s = "".join(c if c.isalnum() else "_" for c in s).strip("_")
+    return s if s else "q"
+
+def make_log_paths(query: str):
+    qid = f"{now_ts()}_{hashlib.sha1(query.encode('utf-8')).hexdigest()[:8]}"
+    slug = short_slug(query, max_len=30)
+    txt_name = f"{qid}_{slug}.txt"
+    return qid, LOGS_BASE_DIR / txt_name
+
+def safe_write_text(path: Path, text: str):
+    path.write_text(text, encoding="utf-8")
+
+# ===========================
+# LLM CALL (OpenRouter)
+# ===========================
+def call_llm_openrouter(prompt: str, timeout: int = 40, call_type: str = "llm") -> str:
+    if not OPENROUTER_API_KEY:
+        return "ERROR: OPENROUTER_API_KEY not set in environment."
+    # pooled session + retry/backoff live in llm_client; the orchestrator still
+    # works on text, so a call that fails after all retries becomes an error string
+    with span(f"llm.{call_type}", prompt_chars=len(prompt)) as s:
+        try:
+            result = get_llm_client().chat(prompt, model=MODEL_NAME, timeout=timeout)
+        except LLMError as e:
+            s.update(failed=True, attempts=e.attempts)
+            return f"ERROR_CALLING_LLM: {str(e)} (after {e.attempts} attempts)"
+        s.update(completion_chars=len(result.text), prompt_tokens=result.prompt_tokens,
+                 completion_tokens=result.completion_tokens, attempts=result.attempts)
+        return result.text
+
+def stream_llm_openrouter(prompt: str, render, timeout: int = 40, call_type: str = "answer") -> str:
+    """
+    Streams the completion through render (e.g. st.write_stream) as tokens
+    arrive and returns the full text, so the log still gets the whole response.
+    """
+    parts = []
+
+    def tokens():
+        if not OPENROUTER_API_KEY:
+            parts.append("ERROR: OPENROUTER_API_KEY not set in environment.")
+            yield parts[-1]
+            return
+        try:
+            for delta in get_llm_client().stream_chat(prompt, model=MODEL_NAME, timeout=timeout):
+                if not parts:
+                    s["ttft_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+                parts.append(delta)
+                yield delta
+        except LLMError as e:
+            s.update(failed=True, attempts=e.attempts)
+            parts.append(("\n\n" if parts else "") + f"ERROR_CALLING_LLM: {str(e)} (after {e.attempts} attempts)")
+            yield parts[-1]
+
+    # the span covers rendering too: that is the wait the user sees
+    with span(f"llm.{call_type}", prompt_chars=len(prompt), streamed=True) as s:
+        t0 = time.perf_counter()
+        render(tokens())
+        s["completion_chars"] = len("".join(parts))
+    return "".join(parts)
+
+
+def call_final_llm(prompt: str, stream_to=None, call_type: str = "answer") -> str:
+    # user-facing answers stream when a renderer is given; everything else blocks
+    if stream_to is None:
+        return call_llm_openrouter(prompt, call_type=call_type)
+    return stream_llm_openrouter(prompt, stream_to, call_type=call_type)
+
+# ===========================
+# LOG BUILDING (NO TRUNCATION)
+# ===========================
+def build_full_text_log(qid: str, query: str, decision: str, llm_calls: list, router_source: str = "llm") -> str:
+    lines = []
+    lines.append("=" * 100)
+    lines.append("QUERY")
+    lines.append("=" * 100)
+    lines.append(query)
+    lines.append("")
+    lines.append(f"Time (UTC): {datetime.now(timezone.utc).isoformat()}")
+    lines.append(f"QID: {qid}")
+    lines.append(f"Decision (router): {decision}")
+    lines.append(f"Router source: {router_source}")
+    lines.append("=" * 100)
+    lines.append("LLM CALLS (in order)")
+    lines.append("=" * 100)
+    for idx, call in enumerate(llm_calls, start=1):
+        lines.append(f"LLM CALL {idx}: {call.get('type','unknown')}")
+        lines.append("-" * 80)
+        if call.get("where"):
+            lines.append(f"RETRIEVAL FILTER: {json.dumps(call['where'], ensure_ascii=False)}")
+        if call.get("context"):
+            lines.append(f"CONTEXT BUDGET: {format_context_stats(call['context'])}")
+        if call.get("table"):
+            lines.append(f"TABLE QUERY: {json.dumps(call['table']['query'], ensure_ascii=False)}")
+            lines.append(f"TABLE RESULT: {call['table']['result']}")
+        lines.append("PROMPT:")
+        lines.append(call.get("prompt",""))
+        lines.append("")
+        lines.append("RESPONSE:")
+        lines.append(call.get("response",""))
+        lines.append("")
+        lines.append("=" * 100)
+    lines.append("END OF LOG")
+    lines.append("=" * 100)
+    return "\n".join(lines)
+
+def write_query_log(path: Path, full_text: str, trace):
+    """Writes the text log, then appends the trace as JSON (so it includes the write itself)."""
+    with span("log.write", chars=len(full_text)):
+        safe_write_text(path, full_text)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write("\n" + "=" * 100 + "\nTRACE (JSON)\n" + "=" * 100 + "\n" + trace.to_json() + "\n")
+
+# ===========================
+# PROMPTS (shared with async_pipeline.py)
+# ===========================
+def table_answer_prompt(query: str, table_markdown: str) -> str:
+    return (
+        "Answer the user's question using ONLY the exact figures in the table below. "
+        "Be concise; do not estimate or add numbers that are not in the table.\n\n"
+        "TABLE:\n" + table_markdown + "\n\n"
+        "QUESTION:\n" + query + "\n"
+    )
+
+def simple_answer_prompt(query: str, context: str) -> str:
+    return (
+        "Answer the user's question using the context below. Be concise but complete.\n\n"
+        "CONTEXT:\n" + context + "\n\n"
+        "QUESTION:\n" + query + "\n"
+    )
+
+def subquery_prompt(sq: str, context: str) -> str:
+    return (
+        f"Answer this sub-question using the context below. Keep the answer focused and explicit.\n\n"
+        "CONTEXT:\n" + context + "\n\n"
+        f"SUB-QUESTION:\n{sq}\n"
+    )
+
+def synthesis_prompt(query: str, sub_answers: list) -> str:
+    # Final synthesis: NO retrieval, only combine sub-answers
+    synth_parts = [
+        "You are given answers to sub-questions. Combine them into ONE coherent final answer.",
+        "Be explicit about assumptions.",
+        "",
+        "Original question:",
+        query,
+        "",
+        "Sub-answers:"
+    ]
+    for idx, s in enumerate(sub_answers, start=1):
+        synth_parts.append(f"Sub-question {idx}: {s['subquery']}")
+        synth_parts.append("Answer:")
+        synth_parts.append(s["answer"])
+        synth_parts.append("")
+    return "\n".join(synth_parts)
+
+def single_step_prompt(query: str, context: str) -> str:
+    return f"""
+Using the financial context below, provide a detailed answer based on question.
+
+Context:
+{context}
+
+Question:
+{query}
+"""
+
+def pack_subquery_context(hits: list) -> tuple:
+    with span("context.pack", chunks=len(hits)) as s:
+        context, context_stats = assemble_context(hits, CONTEXT_TOKEN_BUDGET_PER_SUB)
+        s["packed"] = context_stats["packed"]
+    return context, context_stats
+
+# ===========================
+# BLOCKING STEPS (async_pipeline.py runs these in threads)
+# ===========================
+def run_table_query(tables, table_query):
+    """TableResult for the router's table query, or None when no table fits."""
+    with span("table.run") as s:
+        result = tables.run(TableQuery.from_dict(table_query)) if tables is not None else None
+        s["rows"] = len(result.frame) if result is not None else 0
+    return result
+
+def retrieve_simple(query: str, collection, matcher=None, lexical=None) -> tuple:
+    """SIMPLE-path retrieval + packing. Returns (where, context, context_stats)."""
+    where = matcher.where_for(query) if matcher else None
+    with span("retrieval", queries=1, filtered=where is not None) as s:
+        hits = retrieve_hits(collection, query, TOP_K_SIMPLE, where=where, lexical=lexical)
+        s["chunks"] = len(hits)
+    with span("context.pack", chunks=len(hits)) as s:
+        context, context_stats = assemble_context(hits, CONTEXT_TOKEN_BUDGET)
+        s["packed"] = context_stats["packed"]
+    return where, context, context_stats
+
+def retrieve_subqueries(subqueries: list, collection, matcher=None, lexical=None) -> tuple:
+    """
+    One batched search for all subqueries; chunks shared between subqueries
+    are only sent with the subquery that ranked them best.
+    Returns (wheres, hits_per_sub).
+    """
+    wheres = [matcher.where_for(sq) if matcher else None for sq in subqueries]
+    with span("retrieval", queries=len(subqueries), filtered=any(w is not None for w in wheres)) as s:
+        hits_per_sub = retrieve_hits_many(collection, subqueries, TOP_K_PER_SUB, where=wheres, lexical=lexical)
+        s["chunks"] = sum(len(h) for h in hits_per_sub)
+    return wheres, hits_per_sub
+
+def retrieve_single_step(query: str, collection, matcher=None, lexical=None, top_k=None) -> tuple:
+    """Single-step search + packing. Returns (documents, metadatas, context, context_stats)."""
+    where = matcher.where_for(query) if matcher else None
+    with span("retrieval", queries=1, filtered=where is not None) as s:
+        results = search(collection, [query], top_k or TOP_K_SINGLE_STEP, where,
+                         include=["documents", "metadatas", "distances"], lexical=lexical)
+        s["chunks"] = len(results["ids"][0])
+    docs = results["documents"][0]
+    metas = results["metadatas"][0]
+    hits = list(zip(docs, results["distances"][0]))
+
+    with span("context.pack", chunks=len(hits)) as s:
+        context, context_stats = assemble_context(hits, separator="\n\n---\n\n")
+        s["packed"] = context_stats["packed"]
+    return docs, metas, context, context_stats
+
+# ===========================
+# SUBQUERY ANSWER (run in parallel by the orchestrator)
+# ===========================
+def answer_subquery(sq: str, hits: list) -> tuple:
+    context, context_stats = pack_subquery_context(hits)
+    sq_prompt = subquery_prompt(sq, context)
+    # per-call timeout still applies inside each worker thread
+    sq_response = call_llm_openrouter(sq_prompt, call_type="subquery_answer")
+    return sq_prompt, sq_response, context_stats
+
+# ===========================
+# CORE ORCHESTRATOR (single router+planner call)
+# ===========================
+def process_query_and_log(query: str, collection, stream_to=None, router=None, matcher=None, lexical=None,
+                          tables=None) -> tuple:
+    """
+    Runs router -> retrieval -> answer(s) and writes the full text log, with
+    the per-stage trace (tracing.py) appended as JSON.
+    stream_to, if given, receives a generator of answer tokens for the
+    user-facing call (SIMPLE answer or final synthesis), e.g. st.write_stream.
+    router defaults to LLM-only routing with no cache.
+    matcher (EntityMatcher), if given, restricts retrieval to the funds/dates
+    each (sub)query names; lexical (LexicalIndex) adds BM25 hits via RRF.
+    tables (TableStore), if given, answers TABLE-routed queries from the
+    columnar tables instead of retrieved chunks.
+    Returns (final_answer, log_path).
+    """
+    qid, txt_path = make_log_paths(query)
+    with start_trace(qid) as trace:
+        llm_calls = []
+
+        # Router+planner: decide and produce minimal subqueries (<=4).
+        # Cached / locally-routed queries skip the LLM router call entirely.
+        with span("router") as s:
+            route = (router or LLM_ONLY_ROUTER).route(
+                query, lambda p: call_llm_openrouter(p, call_type="router_planner"),
+            )
+            s.update(decision=route.decision, source=route.source, subqueries=len(route.subqueries))
+        if route.prompt is not None:
+            llm_calls.append({"type": "router_planner", "prompt": route.prompt, "response": route.response})
+        decision, subqueries = route.decision, route.subqueries
+        trace.attrs.update(decision=decision, router_source=route.source)
+
+        # TABLE path: exact filter / aggregate over the columnar tables; only the
+        # small result table goes to the LLM. Falls back to SIMPLE when no table fits.
+        table_info = None
+        if decision == "table":
+            result = run_table_query(tables, route.table_query)
+            if result is not None:
+                table_prompt = table_answer_prompt(query, result.to_markdown())
+                table_response = call_final_llm(table_prompt, stream_to, call_type="table_answer")
+                llm_calls.append({
+                    "type": "table_answer", "prompt": table_prompt, "response": table_response,
+                    "table": {"query": route.table_query, "result": result.describe()},
+                })
+                write_query_log(txt_path, build_full_text_log(qid, query, decision, llm_calls, route.source), trace)
+                return table_response, txt_path
+            table_info = {"query": route.table_query, "result": "no matching table; answered from retrieval"}
+
+        # SIMPLE path
+        if decision in ("simple", "table"):
+            where, context, context_stats = retrieve_simple(query, collection, matcher, lexical)
+            answer_prompt = simple_answer_prompt(query, context)
+            answer_response = call_final_llm(answer_prompt, stream_to, call_type="simple_answer")
+            llm_calls.append({
+                "type": "simple_answer", "prompt": answer_prompt, "response": answer_response,
+                "context": context_stats, "where": where, "table": table_info,
+            })
+
+            # Save full text log
+            write_query_log(txt_path, build_full_text_log(qid, query, decision, llm_calls, route.source), trace)
+            return answer_response, txt_path
+
+        # COMPLEX path (subqueries guaranteed non-empty and <=4)
+        wheres, hits_per_sub = retrieve_subqueries(subqueries, collection, matcher, lexical)
+
+        # answers for each subquery run concurrently; results come back in
+        # subquery order so llm_calls stays deterministic
+        with ThreadPoolExecutor(max_workers=max(1, min(SUBQUERY_WORKERS, len(subqueries)))) as pool:
+            results = list(pool.map(bind(answer_subquery), subqueries, hits_per_sub))
+
+        sub_answers = []
+        for i, (sq, where, (sq_prompt, sq_response, context_stats)) in enumerate(zip(subqueries, wheres, results), start=1):
+            llm_calls.append({
+                "type": f"subquery_answer_{i}", "prompt": sq_prompt, "response": sq_response,
+                "context": context_stats, "where": where,
+            })
+            sub_answers.append({"subquery": sq, "answer": sq_response})
+
+        # Final synthesis: NO retrieval, only combine sub-answers
+        synth_prompt = synthesis_prompt(query, sub_answers)
+        synth_response = call_final_llm(synth_prompt, stream_to, call_type="final_synthesis")
+        llm_calls.append({"type": "final_synthesis", "prompt": synth_prompt, "response": synth_response})
+
+        # Save full text log
+        write_query_log(txt_path, build_full_text_log(qid, query, decision, llm_calls, route.source), trace)
+        return synth_response, txt_path
+
+# ===========================
+# SINGLE-STEP PATH (no router)
+# ===========================
+def save_last_prompt(prompt: str, context_stats=None):
+    """Overwrites LOGS_DIR/last_llm_prompt.txt with the latest single-step prompt (debugging aid)."""
+    if context_stats:
+        prompt = f"CONTEXT BUDGET: {format_context_stats(context_stats)}\n" + prompt
+    try:
+        safe_write_text(LOGS_BASE_DIR / "last_llm_prompt.txt", prompt)
+    except OSError as e:
+        print(f"Error writing last prompt: {e}")
+
+def process_single_step(query: str, collection, stream_to=None, matcher=None, lexical=None, top_k=None) -> tuple:
+    """
+    One search (vector, fused with BM25 hits when lexical is given; restricted
+    to the funds / dates the query names when matcher is given) and one LLM
+    answer over the packed context. stream_to works as in process_query_and_log.
+    Returns (answer, documents, metadatas) of the retrieved chunks.
+    """
+    with start_trace():
+        docs, metas, context, context_stats = retrieve_single_step(query, collection, matcher, lexical, top_k)
+        prompt = single_step_prompt(query, context)
+        save_last_prompt(prompt, context_stats)
+        answer = call_final_llm(prompt, stream_to, call_type="answer")
+    return answer, docs, metas
+
+# ===========================
+# HEADLESS RESOURCES
+# ===========================
+def open_index(chroma_dir, collection_name, embed_fn=None) -> dict:
+    """
+    The collection and side indexes process_query_and_log takes, loaded
+    uncached (rag_resources.py is the process-wide cached equivalent).
+    Returns {"collection", "matcher", "lexical", "tables"}.
+    """
+    embed_fn = embed_fn or get_embedding_function()
+    client = chromadb.PersistentClient(path=str(chroma_dir))
+    collection = client.get_collection(collection_name, embedding_function=embed_fn)
+    return {
+        "collection": collection,
+        "matcher": EntityMatcher.for_collection(chroma_dir, collection) if METADATA_FILTERS else None,
+        "lexical": LexicalIndex.load(chroma_dir) if RETRIEVAL_MODE == "hybrid" else None,
+        "tables": TableStore.load(chroma_dir) if TABLE_ENGINE else None,
+    }
@@ -0,0 +1,155 @@
+# rag_resources.py
+"""
+Process-wide resources for the query service (query_api.py): the embedding
+model, Chroma clients and collections are built once per process and shared
+by every request.
+
+Collections are keyed on an index version derived from the files on disk, so a
+rebuilt or updated index (offline_build, upload indexing) is picked up on the
+next query without restarting the server.
+"""
+import os
+import threading
+from functools import lru_cache, wraps
+from pathlib import Path
+
+import chromadb
+
+from answer_cache import AnswerCache
+from embedding_backends import get_embedding_function
+from entity_filter import EntityMatcher, METADATA_FILTERS
+from lexical_index import LexicalIndex
+from retrieval import RETRIEVAL_MODE
+from router import Router
+from table_engine import TableStore, TABLE_ENGINE
+from upload_indexer import UploadIndexer
+
+BASE_DIR = Path(__file__).resolve().parent
+LOGS_DIR = Path(os.getenv("LOGS_DIR", BASE_DIR / "logs"))
+
+# old index versions kept around while sessions finish with them
+MAX_CACHED_COLLECTIONS = int(os.getenv("MAX_CACHED_COLLECTIONS", "8"))
+
+
+def index_version(chroma_dir) -> str:
+    """
+    Cheap fingerprint of a persistent Chroma directory: the sqlite file's
+    mtime/size plus the segment folders present. Changes whenever the index is
+    written or rebuilt.
+    """
+    root = Path(chroma_dir)
+    parts = []
+    db = root / "chroma.sqlite3"
+    if db.exists():
+        st_ = db.stat()
+        parts.append(f"{st_.st_mtime_ns}:{st_.st_size}")
+    if root.is_dir():
+        parts.extend(sorted(p.name for p in root.iterdir() if p.is_dir()))
+    return "|".join(parts)
+
+
+def cache_resource(max_entries=None):
+    """
+    Memoizes a loader per argument tuple (LRU, max_entries). Loads are
+    serialized, so concurrent first requests build a resource only once.
+    """
+    def wrap(fn):
+        cached = lru_cache(maxsize=max_entries)(fn)
+        lock = threading.Lock()
+
+        @wraps(fn)
+        def get(*args):
+            with lock:
+                return cached(*args)
+
+        get.cache_clear = cached.cache_clear
+        return get
+    return wrap
+
+
+def _drop_shared_systems():
+    # Chroma shares one System per path inside the process; forget it so the
+    # next client re-reads the rebuilt index from disk.
+    try:
+        from chromadb.api.client import SharedSystemClient
+        SharedSystemClient.clear_system_cache()
+    except Exception:
+        pass
+
+
+@cache_resource()
+def get_embedding_fn():
+    return get_embedding_function()
+
+
+@cache_resource(MAX_CACHED_COLLECTIONS)
+def _load_collection(chroma_dir: str, name: str, version: str):
+    _drop_shared_systems()
+    client = chromadb.PersistentClient(path=chroma_dir)
+    return client.get_collection(name, embedding_function=get_embedding_fn())
+
+
+def get_collection(chroma_dir, name):
+    """Cached collection for (dir, name), reloaded when the on-disk index changes."""
+    return _load_collection(str(chroma_dir), name, index_version(chroma_dir))
+
+
+@cache_resource(MAX_CACHED_COLLECTIONS)
+def _load_entity_matcher(chroma_dir: str, name: str, version: str):
+    return EntityMatcher.for_collection(chroma_dir, _load_collection(chroma_dir, name, version))
+
+
+def get_entity_matcher(chroma_dir, name):
+    """Fund/date matcher for `where` filters, or None with METADATA_FILTERS=0."""
+    if not METADATA_FILTERS:
+        return None
+    return _load_entity_matcher(str(chroma_dir), name, index_version(chroma_dir))
+
+
+@cache_resource(MAX_CACHED_COLLECTIONS)
+def _load_lexical_index(chroma_dir: str, version: str):
+    return LexicalIndex.load(chroma_dir)
+
+
+def get_lexical_index(chroma_dir):
+    """Memory-mapped BM25 index for hybrid retrieval; None in vector mode or if not built."""
+    if RETRIEVAL_MODE != "hybrid":
+        return None
+    return _load_lexical_index(str(chroma_dir), index_version(chroma_dir))
+
+
+@cache_resource(MAX_CACHED_COLLECTIONS)
+def _load_table_store(chroma_dir: str, version: str):
+    return TableStore.load(chroma_dir)
+
+
+def get_table_store(chroma_dir):
+    """Columnar tables for the structured TABLE path; None when disabled or not built."""
+    if not TABLE_ENGINE:
+        return None
+    return _load_table_store(str(chroma_dir), index_version(chroma_dir))
+
+
+def collection_scope(chroma_dir, name) -> str:
+    """Answer-cache scope: a rebuilt index gets a fresh scope."""
+    return f"{Path(chroma_dir).resolve()}::{name}::{index_version(chroma_dir)}"
+
+
+@cache_resource()
+def get_answer_cache():
+    return AnswerCache(embed_fn=get_embedding_fn())
+
+
+@cache_resource()
+def get_upload_indexer(root: str, render=None):
+    """
+    Process-wide background indexer for uploads under root (jobs are shared
+    by all requests). render overrides chunk_to_markdown.
+    """
+    return UploadIndexer(root, embed_fn=get_embedding_fn(), render=render)
+
+
+@cache_resource()
+def get_router():
+    # ROUTER_MODE / ROUTER_CACHE select LLM-only vs. local pre-routing (see router.py)
+    return Router(logs_dir=LOGS_DIR, embed_fn=get_embedding_fn(), allow_table=TABLE_ENGINE)
@@ -0,0 +1,183 @@
+# retrieval.py
+"""
+Retrieval layer shared by the query paths.
+
+retrieve_many() embeds every query in one batch and searches them in a single
+collection.query(query_texts=[...]) call, then fans the hits back out per
+query. Documents retrieved by several queries are kept only for the query that
+ranked them best, so shared context isn't sent to the LLM more than once.
+retrieve_hits*() return (document, distance) pairs for context_budget.
+
+An optional Chroma `where` filter (per query, see entity_filter.py) restricts
+the search to matching rows; queries the filter leaves (nearly) empty are
+re-run unfiltered, so a wrong entity match costs one extra search, not recall.
+
+With a LexicalIndex (BM25, see lexical_index.py) the vector and lexical
+rankings are merged by reciprocal rank fusion; fused hits carry -score as
+their "distance" so lower is still better downstream.
+"""
+import os
+import json
+
+from tracing import span
+
+DEDUPE_SHARED_CONTEXT = os.getenv("DEDUPE_SHARED_CONTEXT", "1") == "1"
+# filtered searches returning fewer hits than this fall back to no filter
+METADATA_FILTER_MIN_HITS = int(os.getenv("METADATA_FILTER_MIN_HITS", "1"))
+# vector | hybrid (vector + BM25, needs the lexical index built by offline_build)
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+
+def _dedupe_across_queries(ids, distances):
+    """
+    Returns, per query, the positions of hits to keep. A hit shared by several
+    queries stays with the query where its distance is smallest (earliest
+    query on ties).
+    """
+    best = {}
+    for qi, (q_ids, q_dist) in enumerate(zip(ids, distances)):
+        for pos, (cid, d) in enumerate(zip(q_ids, q_dist)):
+            if cid not in best or d < best[cid][0]:
+                best[cid] = (d, qi)
+
+    keep = []
+    for qi, q_ids in enumerate(ids):
+        seen = set()
+        positions = []
+        for pos, cid in enumerate(q_ids):
+            if best[cid][1] == qi and cid not in seen:
+                seen.add(cid)
+                positions.append(pos)
+        keep.append(positions)
+    return keep
+
+
+def _query(collection, query_texts, n_results, include, where=None):
+    with span("chroma.query", queries=len(query_texts), n_results=n_results, filtered=where is not None) as s:
+        if where is None:
+            res = collection.query(query_texts=query_texts, n_results=n_results, include=include)
+        else:
+            res = collection.query(query_texts=query_texts, n_results=n_results, where=where, include=include)
+        s["chunks"] = sum(len(q_ids) for q_ids in res["ids"])
+    return res
+
+
+def filtered_query(collection, query_texts, n_results, where=None, include=("documents", "distances")):
+    """
+    collection.query with an optional `where`. Queries with fewer than
+    METADATA_FILTER_MIN_HITS filtered hits are re-run without it (one batch).
+    Returns the usual query result dict (ids + include keys, one list per query).
+    """
+    include = list(include)
+    if where is None:
+        return _query(collection, list(query_texts), n_results, include)
+
+    res = _query(collection, list(query_texts), n_results, include, where)
+    short = [i for i, q_ids in enumerate(res["ids"]) if len(q_ids) < METADATA_FILTER_MIN_HITS]
+    if short:
+        retry = _query(collection, [query_texts[i] for i in short], n_results, include)
+        for key in ["ids"] + include:
+            for j, i in enumerate(short):
+                res[key][i] = retry[key][j]
+    return res
+
+
+def rrf_fuse(rankings, k=None):
+    """Reciprocal rank fusion of ranked ID lists: [(id, score)] best first."""
+    k = RRF_K if k is None else k
+    scores = {}
+    for ranking in rankings:
+        for rank, cid in enumerate(ranking):
+            scores[cid] = scores.get(cid, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda x: -x[1])
+
+
+def _get_rows(collection, ids, where, keys):
+    """{id: {key: value}} for the ids that pass `where`; the rest are dropped."""
+    with span("chroma.get", ids=len(ids)) as s:
+        if where:
+            res = collection.get(ids=ids, where=where, include=keys)
+        else:
+            res = collection.get(ids=ids, include=keys)
+        s["chunks"] = len(res["ids"])
+    return {cid: {k: res[k][i] for k in keys} for i, cid in enumerate(res["ids"])}
+
+
+def search(collection, query_texts, n_results, where=None, include=("documents", "distances"), lexical=None):
+    """
+    filtered_query, plus RRF fusion with lexical (BM25) hits when a
+    LexicalIndex is given. Lexical-only hits are fetched by ID and dropped
+    unless they pass `where` (BM25 knows nothing of the filter); fused results
+    report -rrf_score as their distance.
+    """
+    include = list(include)
+    if lexical is not None and "distances" not in include:
+        include.append("distances")
+    res = filtered_query(collection, query_texts, n_results, where, include)
+    if lexical is None:
+        return res
+
+    keys = [k for k in include if k != "distances"]
+    for qi, q in enumerate(query_texts):
+        known = {cid: {k: res[k][qi][pos] for k in keys} for pos, cid in enumerate(res["ids"][qi])}
+        with span("bm25.search") as s:
+            lex_ids = [cid for cid, _ in lexical.search(q, n_results)]
+            s["chunks"] = len(lex_ids)
+        fused = rrf_fuse([res["ids"][qi], lex_ids])[:n_results]
+        missing = [cid for cid, _ in fused if cid not in known]
+        if missing:
+            known.update(_get_rows(collection, missing, where, keys))
+        fused = [(cid, score) for cid, score in fused if cid in known]
+        res["ids"][qi] = [cid for cid, _ in fused]
+        res["distances"][qi] = [-score for _, score in fused]
+        for k in keys:
+            res[k][qi] = [known[cid][k] for cid, _ in fused]
+    return res
+
+
+def retrieve_hits_many(collection, queries, n_results, dedupe=None, where=None, lexical=None):
+    """
+    Batched search for all queries (one call per distinct `where`). where is
+    None, one filter for every query, or a list with one filter per query.
+    lexical (LexicalIndex), if given, is fused in by RRF.
+    Returns a list (one per query) of (document, distance) hits, best first.
+    On any retrieval error every query gets [].
+    """
+    if dedupe is None:
+        dedupe = DEDUPE_SHARED_CONTEXT
+    if not queries:
+        return []
+    queries = list(queries)
+    wheres = where if isinstance(where, list) else [where] * len(queries)
+
+    groups = {}
+    for qi, w in enumerate(wheres):
+        groups.setdefault(json.dumps(w, sort_keys=True), []).append(qi)
+
+    ids, docs, distances = [None] * len(queries), [None] * len(queries), [None] * len(queries)
+    try:
+        for members in groups.values():
+            res = search(collection, [queries[qi] for qi in members], n_results, wheres[members[0]], lexical=lexical)
+            for j, qi in enumerate(members):
+                ids[qi], docs[qi], distances[qi] = res["ids"][j], res["documents"][j], res["distances"][j]
+    except Exception:
+        return [[] for _ in queries]
+
+    if not dedupe or len(queries) == 1:
+        return [list(zip(d, dist)) for d, dist in zip(docs, distances)]
+
+    keep = _dedupe_across_queries(ids, distances)
+    return [
+        [(docs[qi][pos], distances[qi][pos]) for pos in positions]
+        for qi, positions in enumerate(keep)
+    ]
+
+
+def retrieve_hits(collection, query, n_results, where=None, lexical=None):
+    return retrieve_hits_many(collection, [query], n_results, where=where, lexical=lexical)[0]
+
+
+def retrieve_many(collection, queries, n_results, dedupe=None, where=None, lexical=None):
+    """Like retrieve_hits_many, documents only."""
+    return [[doc for doc, _ in hits] for hits in retrieve_hits_many(collection, queries, n_results, dedupe, where, lexical)]
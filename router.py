@@ -0,0 +1,380 @@
+# router.py
+"""
+Router + planner for process_query_and_log.
+
+ROUTER_MODE:
+  llm     (default) every uncached query goes to the LLM router+planner prompt
+  hybrid  opt-in: obviously SIMPLE queries are routed locally first, the LLM
+          handles the rest:
+            - heuristic: short, single-part questions (no compare / vs / both / ...;
+              "NAV and AUM of X" is one lookup, so a bare "and" doesn't count)
+            - knn: nearest past LLM-routed queries (from LOGS_DIR) all SIMPLE
+
+Local routing only ever answers SIMPLE; COMPLEX needs the LLM's subqueries.
+With allow_table=True the LLM may also answer TABLE plus a table_query spec
+for table_engine; queries that look like table lookups skip local routing.
+With ROUTER_CACHE=1, routing results are cached on normalised query text and
+seeded from earlier per-query logs, so repeats skip the router call entirely.
+"""
+import os
+import re
+import json
+import asyncio
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import numpy as np
+
+from answer_cache import normalize_query
+
+ROUTER_MODE = os.getenv("ROUTER_MODE", "llm")
+ROUTER_CACHE = os.getenv("ROUTER_CACHE", "1") == "1"
+ROUTER_CACHE_MAX_ENTRIES = int(os.getenv("ROUTER_CACHE_MAX_ENTRIES", "4096"))
+ROUTER_MAX_LOG_EXAMPLES = int(os.getenv("ROUTER_MAX_LOG_EXAMPLES", "2000"))
+ROUTER_HEURISTIC_MAX_WORDS = int(os.getenv("ROUTER_HEURISTIC_MAX_WORDS", "20"))
+ROUTER_KNN_K = int(os.getenv("ROUTER_KNN_K", "5"))
+ROUTER_KNN_THRESHOLD = float(os.getenv("ROUTER_KNN_THRESHOLD", "0.9"))
+
+MAX_SUBQUERIES = 4
+
+# markers of table lookups (history, rankings, exact figures); with table
+# routing on, these always go to the LLM so it can choose TABLE
+TABLE_INTENT = re.compile(
+    r"\b(top|bottom|highest|lowest|largest|smallest|max|maximum|min|minimum|average|history|"
+    r"historical|trend|over the (last|past)|last \d+|past \d+|since|allocations?|holdings?|"
+    r"nav|returns?|aum)\b",
+    re.IGNORECASE,
+)
+
+# markers of multi-part questions; any of these sends the query to the LLM
+MULTI_PART = re.compile(
+    r"\b(compare|comparison|compared|versus|vs|difference|differences|between|both|each|"
+    r"respectively|or|then|also)\b|[,;&]|\?.*\?",
+    re.IGNORECASE,
+)
+
+
+# ===========================
+# PROMPT + ROBUST JSON PARSING
+# ===========================
+def build_router_prompt(query: str, allow_table: bool = False) -> str:
+    if not allow_table:
+        return (
+            "You are a router and planner.\n\n"
+            "Task:\n"
+            "1) Decide whether the user's query is SIMPLE or COMPLEX.\n"
+            "   - SIMPLE: can be answered with a single retrieval + answer.\n"
+            "   - COMPLEX: needs multiple independent sub-questions.\n"
+            "2) If COMPLEX, produce the MINIMUM number of independent sub-questions required (no more than 4). "
+            "Do NOT pad; prefer fewer sub-questions. Each sub-question must be necessary and self-contained.\n\n"
+            "Return STRICT JSON only with these keys: {\"decision\": \"simple\" | \"complex\", \"subqueries\": [ ... ]}\n"
+            "- If decision is \"simple\", set \"subqueries\": []\n"
+            "- If decision is \"complex\", include only the needed subqueries (1..4)\n\n"
+            "User query:\n"
+            f"{query}\n"
+        )
+    return (
+        "You are a router and planner.\n\n"
+        "Task:\n"
+        "1) Decide whether the user's query is SIMPLE, COMPLEX or TABLE.\n"
+        "   - TABLE: a numeric lookup or comparison that one data table per fund answers exactly "
+        "(e.g. NAV over time, top allocations / holdings, returns by period, highest / lowest value).\n"
+        "   - SIMPLE: can be answered with a single retrieval + answer.\n"
+        "   - COMPLEX: needs multiple independent sub-questions.\n"
+        "2) If COMPLEX, produce the MINIMUM number of independent sub-questions required (no more than 4). "
+        "Do NOT pad; prefer fewer sub-questions. Each sub-question must be necessary and self-contained.\n"
+        "3) If TABLE, describe the lookup in \"table_query\":\n"
+        "   {\"funds\": [full fund names], \"metric\": column asked for (e.g. \"NAV\", \"% to Net Assets\"), "
+        "\"topic\": words describing the table (e.g. \"portfolio\", \"performance\"), "
+        "\"last_n_years\": int or null, \"date_from\": \"YYYY-MM-DD\" or null, \"date_to\": \"YYYY-MM-DD\" or null, "
+        "\"aggregate\": \"none\" | \"min\" | \"max\" | \"mean\" | \"sum\" | \"change\", "
+        "\"sort\": \"asc\" | \"desc\" | null, \"limit\": int or null}\n\n"
+        "Return STRICT JSON only with these keys: "
+        "{\"decision\": \"simple\" | \"complex\" | \"table\", \"subqueries\": [ ... ], \"table_query\": {...} | null}\n"
+        "- If decision is \"simple\", set \"subqueries\": [] and \"table_query\": null\n"
+        "- If decision is \"complex\", include only the needed subqueries (1..4)\n"
+        "- If decision is \"table\", set \"subqueries\": [] and fill \"table_query\"\n\n"
+        "User query:\n"
+        f"{query}\n"
+    )
+
+
+def extract_json_from_text(text: str):
+    """
+    Attempts to extract a JSON object from the LLM text.
+    Strategy (in order):
+    1) Trim and try json.loads(text) directly.
+    2) Strip common fenced codeblocks (```json ... ``` or ``` ... ```) and try again.
+    3) Find the first '{' and last '}' and try to parse that substring.
+    If none succeed, raise ValueError.
+    """
+    if not isinstance(text, str):
+        raise ValueError("router response not a string")
+
+    txt = text.strip()
+
+    # direct try
+    try:
+        return json.loads(txt)
+    except Exception:
+        pass
+
+    # strip common fences like ```json ... ``` or ``` ... ```
+    fence_pattern = re.compile(r"^```(?:json)?\s*(.*)\s*```$", re.DOTALL | re.IGNORECASE)
+    m = fence_pattern.search(txt)
+    if m:
+        inner = m.group(1).strip()
+        try:
+            return json.loads(inner)
+        except Exception:
+            pass
+
+    # fallback: extract first {...} block (best-effort)
+    first = txt.find("{")
+    last = txt.rfind("}")
+    if first != -1 and last != -1 and last > first:
+        candidate = txt[first:last + 1]
+        try:
+            return json.loads(candidate)
+        except Exception:
+            pass
+
+    raise ValueError("No valid JSON found in router response")
+
+
+def parse_router_response(router_response: str) -> tuple:
+    """
+    Returns (decision, subqueries, table_query). Strict fail-safe: anything
+    that isn't a valid "complex" with 1..4 usable subqueries, or a "table"
+    with a table_query object, is treated as SIMPLE.
+    """
+    try:
+        parsed = extract_json_from_text(router_response)
+        raw_decision = parsed.get("decision", "simple")
+        if not isinstance(raw_decision, str):
+            raise ValueError("decision not a string")
+        raw_decision = raw_decision.strip().lower()
+
+        if raw_decision == "table":
+            table_query = parsed.get("table_query")
+            if isinstance(table_query, dict) and table_query:
+                return "table", [], table_query
+            return "simple", [], None
+        if raw_decision != "complex":
+            return "simple", [], None
+
+        raw_subs = parsed.get("subqueries", [])
+        if not isinstance(raw_subs, list):
+            return "simple", [], None
+        # sanitize and cap
+        subqueries = [s.strip() for s in raw_subs if isinstance(s, str) and s.strip()][:MAX_SUBQUERIES]
+        if not subqueries:
+            # missing or invalid → downgrade to SIMPLE
+            return "simple", [], None
+        return "complex", subqueries, None
+    except Exception:
+        return "simple", [], None
+
+
+# ===========================
+# TRAINING EXAMPLES FROM PER-QUERY LOGS
+# ===========================
+def parse_log_file(path):
+    """
+    Reads one build_full_text_log() file. Returns (query, decision, subqueries,
+    table_query) for logs routed by the LLM, else None.
+    """
+    try:
+        lines = Path(path).read_text(encoding="utf-8").splitlines()
+    except Exception:
+        return None
+
+    try:
+        end = next(i for i, l in enumerate(lines) if l.startswith("Time (UTC): "))
+    except StopIteration:
+        return None
+    query = "\n".join(lines[3:end]).strip()
+
+    decision, source = None, "llm"
+    for l in lines[end:end + 6]:
+        if l.startswith("Decision (router): "):
+            decision = l.split(": ", 1)[1].strip().lower()
+        elif l.startswith("Router source: "):
+            source = l.split(": ", 1)[1].strip()
+    if not query or decision not in ("simple", "complex", "table") or source != "llm":
+        return None
+
+    try:
+        start = next(i for i, l in enumerate(lines) if l.endswith(": router_planner"))
+        resp = lines.index("RESPONSE:", start) + 1
+        stop = next(i for i in range(resp, len(lines)) if lines[i].startswith("=" * 20))
+    except (StopIteration, ValueError):
+        return None
+    response = "\n".join(lines[resp:stop]).strip()
+    if response.startswith("ERROR"):
+        # router call failed and fell back to SIMPLE; not a real label
+        return None
+    return (query,) + parse_router_response(response)
+
+
+def load_routing_examples(logs_dir, limit=ROUTER_MAX_LOG_EXAMPLES):
+    """Most recent LLM-routed queries first (log names start with a UTC timestamp)."""
+    logs_dir = Path(logs_dir)
+    if not logs_dir.is_dir():
+        return []
+    examples = []
+    for fp in sorted(logs_dir.glob("*.txt"), reverse=True):
+        ex = parse_log_file(fp)
+        if ex:
+            examples.append(ex)
+            if len(examples) >= limit:
+                break
+    return examples
+
+
+# ===========================
+# ROUTER
+# ===========================
+@dataclass
+class RouteDecision:
+    decision: str
+    subqueries: list = field(default_factory=list)
+    source: str = "llm"            # llm | cache | heuristic | knn
+    prompt: str = None             # set only when the LLM was called
+    response: str = None
+    table_query: dict = None       # set for decision == "table"
+
+
+class Router:
+    def __init__(self, mode=None, use_cache=None, logs_dir=None, embed_fn=None, allow_table=False):
+        self.mode = mode or ROUTER_MODE
+        self.use_cache = ROUTER_CACHE if use_cache is None else use_cache
+        self.embed_fn = embed_fn
+        self.allow_table = allow_table
+
+        self._cache = OrderedDict()   # normalized query -> (decision, subqueries, table_query)
+        self._lock = threading.Lock()
+        # kNN examples: a ring buffer of the last ROUTER_MAX_LOG_EXAMPLES routed queries
+        self._vectors = None
+        self._labels = []
+        self._next = 0
+        self.stats = {"llm": 0, "cache": 0, "heuristic": 0, "knn": 0}
+
+        examples = load_routing_examples(logs_dir) if logs_dir else []
+        if not allow_table:
+            examples = [ex for ex in examples if ex[1] != "table"]
+        for query, decision, subqueries, table_query in reversed(examples):
+            self._remember(query, decision, subqueries, table_query)
+        if self.embed_fn is not None and self.mode == "hybrid" and examples:
+            # oldest first, so the oldest are overwritten first
+            self._add_examples([ex[0] for ex in reversed(examples)], [ex[1] for ex in reversed(examples)])
+
+    # -------- cache
+    def _remember(self, query, decision, subqueries, table_query=None):
+        if not self.use_cache:
+            return
+        key = normalize_query(query)
+        with self._lock:
+            self._cache[key] = (decision, list(subqueries), table_query)
+            self._cache.move_to_end(key)
+            while len(self._cache) > ROUTER_CACHE_MAX_ENTRIES:
+                self._cache.popitem(last=False)
+
+    def _cached(self, query):
+        if not self.use_cache:
+            return None
+        key = normalize_query(query)
+        with self._lock:
+            hit = self._cache.get(key)
+            if hit:
+                self._cache.move_to_end(key)
+            return hit
+
+    # -------- local routing
+    def _add_examples(self, queries, labels):
+        vecs = np.asarray(self.embed_fn([normalize_query(q) for q in queries]), dtype=np.float32)
+        vecs /= np.clip(np.linalg.norm(vecs, axis=1, keepdims=True), 1e-12, None)
+        cap = ROUTER_MAX_LOG_EXAMPLES
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((cap, vecs.shape[1]), dtype=np.float32)
+            for vec, label in zip(vecs[-cap:], labels[-cap:]):
+                i = self._next % cap
+                self._vectors[i] = vec
+                if i < len(self._labels):
+                    self._labels[i] = label
+                else:
+                    self._labels.append(label)
+                self._next += 1
+
+    @staticmethod
+    def heuristic_simple(query: str) -> bool:
+        return len(query.split()) <= ROUTER_HEURISTIC_MAX_WORDS and not MULTI_PART.search(query)
+
+    def knn_simple(self, query: str) -> bool:
+        if self.embed_fn is None or not self._labels:
+            return False
+        v = np.asarray(self.embed_fn([normalize_query(query)])[0], dtype=np.float32)
+        v /= max(float(np.linalg.norm(v)), 1e-12)
+        with self._lock:
+            # the buffer is written in place, so score it under the lock
+            labels = list(self._labels)
+            sims = self._vectors[:len(labels)] @ v
+        top = np.argsort(-sims)[:ROUTER_KNN_K]
+        close = [labels[i] for i in top if sims[i] >= ROUTER_KNN_THRESHOLD]
+        # need agreement from enough close neighbours, and all of them SIMPLE
+        return len(close) >= min(3, ROUTER_KNN_K) and all(d == "simple" for d in close)
+
+    def local_route(self, query: str):
+        if self.allow_table and TABLE_INTENT.search(query):
+            return None
+        if self.heuristic_simple(query):
+            return RouteDecision("simple", [], "heuristic")
+        if self.knn_simple(query):
+            return RouteDecision("simple", [], "knn")
+        return None
+
+    # -------- entry points
+    def route_without_llm(self, query: str):
+        """Cached or locally-routed decision, or None when the LLM has to decide."""
+        hit = self._cached(query)
+        if hit:
+            self.stats["cache"] += 1
+            return RouteDecision(hit[0], list(hit[1]), "cache", table_query=hit[2])
+
+        if self.mode == "hybrid":
+            local = self.local_route(query)
+            if local:
+                self.stats[local.source] += 1
+                self._remember(query, local.decision, local.subqueries)
+                return local
+        return None
+
+    def _from_llm(self, query, prompt, response) -> RouteDecision:
+        decision, subqueries, table_query = parse_router_response(response)
+        if decision == "table" and not self.allow_table:
+            decision = "simple"
+        self.stats["llm"] += 1
+        if not response.startswith("ERROR"):
+            self._remember(query, decision, subqueries, table_query)
+            if self.embed_fn is not None and self.mode == "hybrid":
+                self._add_examples([query], [decision])
+        return RouteDecision(decision, subqueries, "llm", prompt, response, table_query)
+
+    def route(self, query: str, call_llm) -> RouteDecision:
+        decision = self.route_without_llm(query)
+        if decision:
+            return decision
+        prompt = build_router_prompt(query, self.allow_table)
+        return self._from_llm(query, prompt, call_llm(prompt))
+
+    async def aroute(self, query: str, call_llm) -> RouteDecision:
+        """route() for the async pipeline: call_llm is a coroutine function; embedding work runs in a thread."""
+        decision = await asyncio.to_thread(self.route_without_llm, query)
+        if decision:
+            return decision
+        prompt = build_router_prompt(query, self.allow_table)
+        response = await call_llm(prompt)
+        return await asyncio.to_thread(self._from_llm, query, prompt, response)
@@ -1,65 +1,12 @@
 import os
-import json
-import tempfile
-import requests
-import chromadb
-from pathlib import Path
 import streamlit as st
-from chromadb.utils import embedding_functions
 
-# === portable paths & config ===
-import os
-from pathlib import Path
-
-BASE_DIR = Path(__file__).resolve().parent
-
-DATA_DIR    = Path(os.getenv("DATA_DIR", BASE_DIR / "Data"))
-CHUNKS_DIR  = Path(os.getenv("CHUNKS_DIR", BASE_DIR / "chunks" / "previous_chunks"))
-CHROMA_DIR  = Path(os.getenv("CHROMA_DIR", BASE_DIR / "chromadb_vectors" / "global"))
-UPLOADS_CHUNKS = Path(os.getenv("CHUNKS_DIR", BASE_DIR / "chunks" / "uploaded_chunks"))
-LOGS_DIR    = Path(os.getenv("LOGS_DIR", BASE_DIR / "logs"))
-UPLOADED_VECTOR_DB  =Path(os.getenv("CHROMA_DIR", BASE_DIR / "chromadb_vectors" / "uploaded"))
+# search -> pack -> answer run in the query service (query_api.py,
+# query_pipeline.process_single_step); this app only renders
+from query_client import connect, QueryAPIError
 
-for d in (DATA_DIR, CHUNKS_DIR, CHROMA_DIR, UPLOADS_DIR, LOGS_DIR):
-    d.mkdir(parents=True, exist_ok=True)
-
-OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
-
-
-# ===============================
-# CONFIG & PATHS
-# ===============================
-GLOBAL_CHROMA_DIR = CHROMA_DIR 
-GLOBAL_COLLECTION = "global_chunks"
-UPLOADED_CHUNKS_ROOT = UPLOADS_CHUNKS
-UPLOADED_CHROMA_ROOT = UPLOADED_VECTOR_DB
-
-TOP_K = 50
-OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
-MODEL_NAME = "xiaomi/mimo-v2-flash:free"
-
-
-# =======================================================================================================================================
-# DEBUG CONFIG (REMOVE AFTER DEBUGGING)
-# =====================================================================================================================================
-DEBUG_MODE = True
-# Replace with your actual directory path
-DEBUG_DIR = LOGS_DIR 
-
-def save_prompt_to_file(prompt_content):
-    """Saves the current prompt to a text file in the specified directory."""
-    if not DEBUG_MODE:
-        return
-    
-    # Ensure directory exists
-    log_path = Path(DEBUG_DIR)
-    log_path.mkdir(parents=True, exist_ok=True)
-    
-    # Save as a fixed filename or use timestamps for history
-    file_path = log_path / "last_llm_prompt.txt"
-    file_path.write_text(prompt_content, encoding="utf-8")
-
-#========================================================================================================================================
+STREAM_ANSWERS = os.getenv("STREAM_ANSWERS", "1") == "1"
+UPLOAD_POLL_SECONDS = float(os.getenv("UPLOAD_POLL_SECONDS", "1"))
 
 
 # ===============================
@@ -80,74 +27,10 @@ st.markdown("""
     """, unsafe_allow_html=True)
 
 
-embedding_fn = embedding_functions.SentenceTransformerEmbeddingFunction(model_name="all-MiniLM-L12-v2")
-
-def chunk_to_markdown(chunk: dict) -> str:
-    lines = []
-    title_parts = []
-    if chunk.get("global_header"): title_parts.append(chunk["global_header"][-1])
-    if chunk.get("subheaders"):
-        sh = chunk["subheaders"]
-        title_parts.append(sh[0] if isinstance(sh, list) else sh)
-    if title_parts:
-        t = " | ".join(title_parts)
-        lines.append(f"### {t if len(t) <= 120 else t[:117] + '...'}")
-    for k, v in list(chunk.get("data", {}).items())[:12]:
-        lines.append(f"- **{k}**: {v}")
-    return "\n".join(lines)
-
-def index_uploaded_chunks(chunks_dir, chroma_dir, collection_name):
-    docs, metas, ids = [], [], []
-    for fp in Path(chunks_dir).rglob("*.json"):
-        try:
-            with open(fp, "r", encoding="utf-8") as f:
-                c = json.load(f)
-            md = chunk_to_markdown(c)
-            if not md: continue
-            docs.append(md)
-            ids.append(f"{c.get('source_file')}__{c.get('sheet_name')}__row_{c.get('excel_row_number')}")
-            metas.append({"source_file": str(c.get("source_file")), "sheet_name": str(c.get("sheet_name")), "excel_row_number": str(c.get("excel_row_number"))})
-        except: continue
-    if not docs: return None
-    os.makedirs(chroma_dir, exist_ok=True)
-    client = chromadb.PersistentClient(path=chroma_dir)
-    try: client.delete_collection(collection_name)
-    except: pass
-    collection = client.create_collection(name=collection_name, embedding_function=embedding_fn)
-    collection.add(documents=docs, metadatas=metas, ids=ids)
-    return collection
-
-# ===============================
-# LLM CALL (ADJUSTED PROMPT FOR 2026)
-# ===============================
-def call_llm(query, retrieved_docs):
-    # Send slightly more context for a "bigger" answer
-    context = "\n\n---\n\n".join(retrieved_docs[:12])
-    
-    # Prompt adjusted to ask for a descriptive paragraph + key stats
-    prompt = f"""
-Using the financial context below, provide a detailed answer based on question.
-
-Context:
-{context}
-
-Question:
-{query}
-"""
-    # --- DEBUG CALL ---===================================================================================================
-    save_prompt_to_file(prompt)
-    # ------------------================================================================================================
-    
-    try:
-        r = requests.post(
-            url="https://openrouter.ai/api/v1/chat/completions",
-            headers={"Authorization": f"Bearer {OPENROUTER_API_KEY}", "Content-Type": "application/json"},
-            json={"model": MODEL_NAME, "messages": [{"role": "user", "content": prompt}]},
-            timeout=30
-        )
-        r.raise_for_status()
-        return r.json()["choices"][0]["message"]["content"]
-    except Exception as e: return f"Error calling LLM: {str(e)}"
+@st.cache_resource(show_spinner="Connecting to the query service...")
+def get_client():
+    # QUERY_API_URL, or the service started in this process (see query_client.py)
+    return connect()
 
 # ===============================
 # STREAMLIT UI
@@ -159,45 +42,85 @@ with st.sidebar:
     st.header("Upload Data")
     uploaded_file = st.file_uploader("Upload Excel", type=["xlsx"])
 
-uploaded_collection = None
+client = get_client()
+
+# Uploads are indexed in the background by the query service. The bytes are
+# sent once per file (the service also dedupes by content hash), so a file is
+# only chunked / embedded once; queries use the global index until it is ready.
+upload_id = None
 if uploaded_file:
-    file_stem = Path(uploaded_file.name).stem
-    up_chunks_dir = os.path.join(UPLOADED_CHUNKS_ROOT, file_stem)
-    up_chroma_dir = os.path.join(UPLOADED_CHROMA_ROOT, file_stem)
-    os.makedirs(up_chunks_dir, exist_ok=True)
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as tmp:
-        tmp.write(uploaded_file.getbuffer())
-        tmp_path = tmp.name
-    with st.spinner("Processing file..."):
-        import chunker
-        old_out = chunker.OUTPUT_CHUNKS_DIR
-        chunker.OUTPUT_CHUNKS_DIR = up_chunks_dir
-        chunker.process_excel_file(tmp_path)
-        chunker.OUTPUT_CHUNKS_DIR = old_out
-        uploaded_collection = index_uploaded_chunks(up_chunks_dir, up_chroma_dir, f"uploaded_{file_stem}")
-    st.sidebar.success("Index Ready")
+    key = (uploaded_file.name, uploaded_file.size)
+    if st.session_state.get("upload_key") != key:
+        try:
+            job = client.submit_upload(uploaded_file.name, uploaded_file.getvalue(), mode="single")
+            st.session_state["upload_key"], st.session_state["upload_id"] = key, job["job_id"]
+        except QueryAPIError as e:
+            st.sidebar.error(f"Upload failed: {e}")
+    if st.session_state.get("upload_key") == key:
+        upload_id = st.session_state["upload_id"]
+
+
+def show_upload_result(job):
+    if job["status"] == "done":
+        st.success("Index Ready")
+    else:
+        st.error(f"Indexing failed: {job['error']}")
+
+
+@st.fragment(run_every=UPLOAD_POLL_SECONDS)
+def upload_status(job_id):
+    try:
+        job = client.upload_job(job_id, mode="single")
+    except QueryAPIError as e:
+        st.error(f"Upload status unavailable: {e}")
+        return
+    if job["status"] in ("queued", "running"):
+        st.progress(job["fraction"], text=f"Indexing {job['filename']}: {job['description']}")
+        return
+    # settled: refresh the rest of the page, which shows the result without polling
+    st.session_state["upload_ready"] = (job_id, job["status"])
+    st.session_state["upload_job"] = job
+    st.rerun()
+
+
+if upload_id:
+    with st.sidebar:
+        if st.session_state.get("upload_ready", (None,))[0] == upload_id:
+            show_upload_result(st.session_state["upload_job"])
+        else:
+            upload_status(upload_id)
 
 query = st.text_input("Ask a question about the financial data:")
 
 if st.button("Search") and query:
     # 1. Searching Loader Symbol
     with st.spinner("Analyzing data and generating answer..."):
-        if uploaded_collection:
-            collection = uploaded_collection
-            label = f"Uploaded: {uploaded_file.name}"
-        else:
-            client = chromadb.PersistentClient(path=GLOBAL_CHROMA_DIR)
-            collection = client.get_collection(GLOBAL_COLLECTION)
-            label = "Global"
-
-        results = collection.query(query_texts=[query], n_results=TOP_K, include=["documents", "metadatas"])
-        docs = results["documents"][0]
-        metas = results["metadatas"][0]
-        answer = call_llm(query, docs)
-
-    # 2. Small Answer Display
-    st.markdown(f"##### 🧠 Answer ({label})")
-    st.markdown(f'<div class="answer-font">{answer}</div>', unsafe_allow_html=True)
+        upload_done = upload_id is not None and st.session_state.get("upload_ready") == (upload_id, "done")
+
+        # 2. Small Answer Display (filled in as tokens stream in)
+        st.markdown(f"##### 🧠 Answer ({f'Uploaded: {uploaded_file.name}' if upload_done else 'Global'})")
+        answer_box = st.empty()
+
+        def show_answer(text):
+            answer_box.markdown(f'<div class="answer-font">{text}</div>', unsafe_allow_html=True)
+
+        def stream_to(tokens):
+            text = ""
+            for delta in tokens:
+                text += delta
+                show_answer(text)
+
+        # only rows of the funds / dates the question names (falls back to all);
+        # vector search, fused with BM25 hits in hybrid RETRIEVAL_MODE
+        try:
+            result = client.query(query, mode="single", upload_id=upload_id if upload_done else None,
+                                  stream_to=stream_to if STREAM_ANSWERS else None)
+        except QueryAPIError as e:
+            st.error(f"Error while processing query: {e}")
+            st.stop()
+        answer, docs, metas = result["answer"], result["documents"], result["metadatas"]
+
+    show_answer(answer)
 
     # 3. Small Scrollable Chunks
     st.divider()
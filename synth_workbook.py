@@ -0,0 +1,166 @@
+# synth_workbook.py
+"""
+Synthetic factsheet-style workbooks in the layout chunker.py expects, for
+ingestion benchmarks (bench_ingest.py) and local testing:
+
+  row 1-2   global header (fund name, "Monthly Factsheet as on <date>")
+  tables    separated by blank rows, each with 1-2 subheader rows above a
+            two-row column header, e.g.
+
+              Portfolio as on March 31, 2025
+              Equity & Equity Related
+              ISIN | Name of Instrument | Industry | Quantity | Market Value | % to Net Assets
+                   |                    |          | (Units)  | (Rs. Lakhs)  | (%)
+              INE0001A01011 | ...        (data rows)
+
+  fund rows long scheme names inside the performance tables, which the
+            chunker must skip ("Motilal Oswal Midcap Fund Direct Plan")
+
+One sheet per fund; tables are added round-robin (NAV history, portfolio,
+performance) until the workbook holds the requested number of data rows.
+
+    python synth_workbook.py --rows 10000 --out Data/synthetic_10k.xlsx
+"""
+import random
+import argparse
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from openpyxl import Workbook
+
+FUND_NAMES = [
+    "Midcap", "Flexi Cap", "Large and Midcap", "Small Cap", "Focused", "ELSS Tax Saver",
+    "Balanced Advantage", "Multi Asset", "Nifty 50 Index", "Nifty Midcap 150 Index",
+    "Ultra Short Term", "Liquid", "Business Cycle", "Manufacturing", "Quant", "Large Cap",
+]
+INDUSTRIES = [
+    "Banks", "IT - Software", "Pharmaceuticals", "Automobiles", "Capital Markets", "Retailing",
+    "Electrical Equipment", "Finance", "Power", "Telecom - Services", "Chemicals", "Realty",
+]
+PERIODS = ["1 Year", "3 Years", "5 Years", "10 Years", "Inception"]
+AS_OF = datetime(2025, 3, 31)
+
+NAV_TABLE_ROWS = 60
+PORTFOLIO_TABLE_ROWS = 40
+
+
+def fund_name(i: int) -> str:
+    base = FUND_NAMES[i % len(FUND_NAMES)]
+    # suffix letters (no digits) keep names unique and the fund rows "fund-like"
+    suffix = "" if i < len(FUND_NAMES) else " Series " + chr(ord("A") + (i // len(FUND_NAMES) - 1) % 26)
+    return f"Motilal Oswal {base}{suffix} Fund"
+
+
+# =========================
+# TABLES (lists of rows; [] is a blank row)
+# =========================
+def nav_table(rng, n, start_nav):
+    rows = [
+        ["NAV History"],
+        ["NAV Date", "NAV", "NAV"],
+        [None, "Regular Plan", "Direct Plan"],
+    ]
+    nav = start_nav
+    for k in range(n):
+        nav *= 1 + rng.gauss(0.0008, 0.01)
+        rows.append([AS_OF - timedelta(days=n - 1 - k), round(nav, 4), round(nav * 1.012, 4)])
+    return rows
+
+
+def portfolio_table(rng, n, offset):
+    rows = [
+        [f"Portfolio as on {AS_OF:%B} {AS_OF.day}, {AS_OF.year}"],
+        ["Equity & Equity Related"],
+        ["ISIN", "Name of Instrument", "Industry", "Quantity", "Market Value", "% to Net Assets"],
+        [None, None, None, "(Units)", "(Rs. Lakhs)", "(%)"],
+    ]
+    weights = [rng.random() for _ in range(n)]
+    total = sum(weights)
+    for k in range(n):
+        code = offset + k
+        rows.append([
+            f"INE{code % 10000:04d}A01{code % 1000:03d}",
+            f"Company {code} Ltd",
+            rng.choice(INDUSTRIES),
+            rng.randint(1_000, 5_000_000),
+            round(rng.uniform(100, 250_000), 2),
+            round(weights[k] / total * 95, 2),
+        ])
+    return rows
+
+
+def performance_table(rng, name):
+    rows = [
+        ["Scheme Performance"],
+        ["Period", "Scheme Returns", "Benchmark Returns", "Value of Rs 10000 Invested"],
+        [None, "(%)", "(%)", "(Rs.)"],
+    ]
+    for plan in ("Regular Plan", "Direct Plan"):
+        # fund row: long text, no digits -> skipped by the chunker
+        rows.append([f"{name} {plan}"])
+        for period in PERIODS:
+            ret = round(rng.gauss(14, 8), 2)
+            rows.append([period, ret, round(ret - rng.uniform(-3, 3), 2), round(10_000 * (1 + ret / 100), 2)])
+    return rows
+
+
+def sheet_rows(rng, i, n_rows):
+    """Rows of one fund sheet holding about n_rows data rows. Returns (rows, data_rows)."""
+    name = fund_name(i)
+    rows = [[name], [f"Monthly Factsheet as on {AS_OF:%d %B %Y}"], []]
+    data, kind = 0, 0
+    while data < n_rows:
+        left = n_rows - data
+        if kind % 3 == 0:
+            n = min(NAV_TABLE_ROWS, left)
+            table = nav_table(rng, n, rng.uniform(10, 100))
+        elif kind % 3 == 1:
+            n = min(PORTFOLIO_TABLE_ROWS, left)
+            table = portfolio_table(rng, n, offset=i * 100_000 + data)
+        else:
+            n = 2 * len(PERIODS)
+            table = performance_table(rng, name)
+        rows.extend(table)
+        rows.append([])
+        data += n
+        kind += 1
+    return rows, data
+
+
+def generate_workbook(path, n_rows, n_funds=8, seed=0):
+    """
+    Writes a synthetic factsheet workbook with about n_rows data rows spread
+    over n_funds sheets. Returns the number of data rows written.
+    """
+    rng = random.Random(seed)
+    wb = Workbook(write_only=True)
+    total = 0
+    per_fund = max(1, -(-n_rows // n_funds))
+    for i in range(n_funds):
+        target = min(per_fund, n_rows - total)
+        if target <= 0:
+            break
+        ws = wb.create_sheet(title=FUND_NAMES[i % len(FUND_NAMES)][:24] + (f" {i}" if i >= len(FUND_NAMES) else ""))
+        rows, written = sheet_rows(rng, i, target)
+        for r in rows:
+            ws.append(r)
+        total += written
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    wb.save(path)
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic factsheet-style .xlsx")
+    parser.add_argument("--rows", type=int, default=1000, help="approximate number of data rows")
+    parser.add_argument("--funds", type=int, default=8, help="sheets (one fund each)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="synthetic_factsheet.xlsx")
+    args = parser.parse_args()
+    n = generate_workbook(args.out, args.rows, args.funds, args.seed)
+    print(f"Wrote {args.out}: {n} data rows over {args.funds} sheets")
+
+
+if __name__ == "__main__":
+    main()
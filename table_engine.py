@@ -0,0 +1,312 @@
+# table_engine.py
+"""
+Structured path for table lookups ("NAV over 5 years", "top allocations"):
+instead of retrieving text chunks and letting the LLM read numbers back, the
+router's table_query is run as a filter / sort / aggregate over the columnar
+tables the chunker emits, and only the small result table goes to the LLM.
+
+Tables ({source_file}.tables.jsonl in the chunks dir) are gathered by
+offline_build into {chroma_dir}/TABLES_NAME and loaded here as pandas frames.
+
+table_query (produced by the router, see router.py):
+  funds         fund names the question is about ([] = any: every table that
+                fits the metric / topic as well as the best one, e.g. to
+                compare or aggregate across funds)
+  metric        the number asked for, e.g. "NAV", "% to Net Assets"
+  topic         words describing the table, e.g. "portfolio", "performance"
+  last_n_years  keep rows from the last N years of the table's date column
+  date_from / date_to   explicit ISO bounds
+  aggregate     none | min | max | mean | sum | change
+  sort          asc | desc | null   (on the metric)
+  limit         max rows per fund (capped at TABLE_MAX_ROWS)
+"""
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import pandas as pd
+
+from chunk_fields import FUND_COLUMN, DATE_COLUMN, SECTION_COLUMN, fund_key
+from chunk_store import StoreWriter, read_store
+from entity_filter import EntityMatcher
+
+TABLE_ENGINE = os.getenv("TABLE_ENGINE", "1") == "1"
+TABLES_NAME = "tables.jsonl"
+TABLE_MAX_ROWS = int(os.getenv("TABLE_MAX_ROWS", "20"))
+TABLE_MAX_TABLES = 4          # one best table per fund, like MAX_SUBQUERIES
+# tables a query without funds may span
+TABLE_MAX_TABLES_ANY_FUND = int(os.getenv("TABLE_MAX_TABLES_ANY_FUND", "12"))
+
+AGGREGATES = {"none", "min", "max", "mean", "sum", "change"}
+
+
+def _tokens(text) -> set:
+    return set(fund_key(str(text)).split()) if text else set()
+
+
+def _overlap(query_tokens: set, text) -> float:
+    if not query_tokens:
+        return 0.0
+    return len(query_tokens & _tokens(text)) / len(query_tokens)
+
+
+# =========================
+# QUERY SPEC
+# =========================
+@dataclass
+class TableQuery:
+    funds: list = field(default_factory=list)
+    metric: str = ""
+    topic: str = ""
+    last_n_years: int = None
+    date_from: str = None
+    date_to: str = None
+    aggregate: str = "none"
+    sort: str = None
+    limit: int = None
+
+    @classmethod
+    def from_dict(cls, spec: dict):
+        """Lenient parse of the router's table_query; None if it is unusable."""
+        if not isinstance(spec, dict):
+            return None
+
+        def text(k):
+            v = spec.get(k)
+            return v.strip() if isinstance(v, str) else ""
+
+        def integer(k):
+            v = spec.get(k)
+            try:
+                return int(v) if v is not None and int(v) > 0 else None
+            except (TypeError, ValueError):
+                return None
+
+        funds = spec.get("funds") or []
+        if isinstance(funds, str):
+            funds = [funds]
+        q = cls(
+            funds=[f.strip() for f in funds if isinstance(f, str) and f.strip()][:TABLE_MAX_TABLES],
+            metric=text("metric"),
+            topic=text("topic"),
+            last_n_years=integer("last_n_years"),
+            date_from=text("date_from") or None,
+            date_to=text("date_to") or None,
+            aggregate=text("aggregate").lower() if text("aggregate").lower() in AGGREGATES else "none",
+            sort=text("sort").lower() if text("sort").lower() in ("asc", "desc") else None,
+            limit=integer("limit"),
+        )
+        return q if q.metric or q.topic else None
+
+
+@dataclass
+class TableResult:
+    frame: pd.DataFrame
+    sources: list            # table_ids used
+
+    def to_markdown(self) -> str:
+        return frame_to_markdown(self.frame)
+
+    def describe(self) -> str:
+        return f"{len(self.frame)} rows from {', '.join(self.sources)}"
+
+
+def frame_to_markdown(df: pd.DataFrame) -> str:
+    # pandas' to_markdown needs tabulate; this is all the prompt needs
+    def cell(v):
+        if v is None or (isinstance(v, float) and pd.isna(v)):
+            return ""
+        if isinstance(v, float):
+            return f"{v:,.4f}".rstrip("0").rstrip(".")
+        return str(v).replace("|", "/")
+
+    lines = ["| " + " | ".join(cell(c) for c in df.columns) + " |",
+             "|" + "---|" * len(df.columns)]
+    for row in df.itertuples(index=False):
+        lines.append("| " + " | ".join(cell(v) for v in row) + " |")
+    return "\n".join(lines)
+
+
+# =========================
+# CATALOG
+# =========================
+def save_tables(chroma_dir, records) -> int:
+    with StoreWriter(Path(chroma_dir) / TABLES_NAME) as out:
+        for record in records:
+            out.write(record)
+    return out.written
+
+
+class TableStore:
+    def __init__(self, records):
+        self.tables = []
+        for r in records:
+            if not r.get("columns") or not r.get("rows"):
+                continue
+            fields = r.get("fields") or {}
+            self.tables.append({
+                "id": r["table_id"],
+                "fund_key": fields.get("fund_key"),
+                "fund_name": fields.get("fund_name"),
+                "context": " ".join(
+                    [r.get("sheet_name") or ""] + list(r.get("global_header") or []) + list(r.get("subheaders") or [])
+                ),
+                "columns": r["columns"],
+                "rows": r["rows"],
+                "_frame": None,
+                "_row_funds": None,
+            })
+        self.matcher = EntityMatcher({t["fund_key"]: t["fund_name"] for t in self.tables if t["fund_key"]})
+
+    @classmethod
+    def load(cls, chroma_dir):
+        path = Path(chroma_dir) / TABLES_NAME
+        if not path.exists():
+            return None
+        return cls(read_store(path))
+
+    def __len__(self):
+        return len(self.tables)
+
+    @staticmethod
+    def frame(table) -> pd.DataFrame:
+        if table["_frame"] is None:
+            table["_frame"] = pd.DataFrame(table["rows"], columns=table["columns"])
+        return table["_frame"]
+
+    def row_funds(self, table) -> set:
+        """fund keys named in a row-level table's fund column (empty if it has none)."""
+        if table["_row_funds"] is None:
+            fund_cols = [c for c in table["columns"] if FUND_COLUMN.search(str(c))]
+            table["_row_funds"] = (
+                {fund_key(str(v)) for v in self.frame(table)[fund_cols[0]].dropna()} if fund_cols else set()
+            )
+        return table["_row_funds"]
+
+    # -------- table selection
+    def _score(self, table, q: TableQuery, metric_tokens, topic_tokens):
+        df = self.frame(table)
+        numeric = [c for c in df.columns if pd.api.types.is_numeric_dtype(df[c])]
+        if not numeric:
+            return 0.0, None
+        metric_col = max(numeric, key=lambda c: _overlap(metric_tokens, c))
+        metric_score = _overlap(metric_tokens, metric_col)
+        topic_score = _overlap(topic_tokens, table["context"] + " " + " ".join(df.columns))
+        if metric_score == 0 and topic_score == 0:
+            return 0.0, None
+        if metric_score == 0:
+            metric_col = numeric[0]
+        return 2 * metric_score + topic_score, metric_col
+
+    def select(self, q: TableQuery):
+        """
+        [(table, metric_col, fund_keys)] — best table per requested fund, or
+        with no funds every table tied with the best match.
+        """
+        metric_tokens, topic_tokens = _tokens(q.metric), _tokens(q.topic)
+        if not q.funds:
+            scored = [(t, *self._score(t, q, metric_tokens, topic_tokens)) for t in self.tables]
+            top = max((score for _, score, _ in scored), default=0)
+            return [(t, metric_col, None) for t, score, metric_col in scored
+                    if top and score >= top][:TABLE_MAX_TABLES_ANY_FUND]
+        # names the catalog doesn't know: the single best table
+        groups = [[k] for k in self.matcher.match_funds(" ".join(q.funds))] or [None]
+
+        picks = []
+        for keys in groups:
+            best = None
+            for t in self.tables:
+                # another fund's table only if one of its rows is this fund
+                if keys and t["fund_key"] not in keys and not (self.row_funds(t) & set(keys)):
+                    continue
+                score, metric_col = self._score(t, q, metric_tokens, topic_tokens)
+                if score and (best is None or score > best[0]):
+                    best = (score, t, metric_col)
+            if best:
+                picks.append((best[1], best[2], keys))
+        return picks[:TABLE_MAX_TABLES]
+
+    # -------- execution
+    @staticmethod
+    def _date_column(df):
+        for c in df.columns:
+            if DATE_COLUMN.search(str(c)):
+                parsed = pd.to_datetime(df[c], errors="coerce")
+                if parsed.notna().any():
+                    return c, parsed
+        return None, None
+
+    def _run_one(self, table, metric_col, keys, q: TableQuery) -> pd.DataFrame:
+        df = self.frame(table).copy()
+
+        fund_cols = [c for c in df.columns if FUND_COLUMN.search(str(c))]
+        if keys and fund_cols and table["fund_key"] not in keys:
+            df = df[df[fund_cols[0]].map(lambda v: fund_key(str(v)) in keys)]
+
+        date_col, dates = self._date_column(df)
+        if date_col is not None:
+            df = df.assign(**{date_col: dates}).dropna(subset=[date_col]).sort_values(date_col)
+            if q.last_n_years and len(df):
+                df = df[df[date_col] >= df[date_col].max() - pd.DateOffset(years=q.last_n_years)]
+            if q.date_from:
+                df = df[df[date_col] >= pd.to_datetime(q.date_from, errors="coerce")]
+            if q.date_to:
+                df = df[df[date_col] <= pd.to_datetime(q.date_to, errors="coerce")]
+
+        label_cols = [c for c in df.columns if c not in (metric_col, date_col, SECTION_COLUMN)
+                      and not pd.api.types.is_numeric_dtype(df[c])][:1]
+        if SECTION_COLUMN in df.columns:
+            # which plan / sub-section a row belongs to ("1 Year" of Regular vs Direct)
+            label_cols.insert(0, SECTION_COLUMN)
+        cols = label_cols + ([date_col] if date_col is not None else []) + [metric_col]
+        df = df[cols].dropna(subset=[metric_col])
+
+        if q.aggregate in ("min", "max"):
+            df = df.loc[[df[metric_col].idxmin() if q.aggregate == "min" else df[metric_col].idxmax()]] if len(df) else df
+        elif q.aggregate in ("mean", "sum"):
+            df = pd.DataFrame([{metric_col: getattr(df[metric_col], q.aggregate)(), "rows": len(df)}])
+        elif q.aggregate == "change" and len(df):
+            first, last = df.iloc[0], df.iloc[-1]
+            change = last[metric_col] - first[metric_col]
+
+            def point(row):
+                if date_col is not None:
+                    return row[date_col].date()
+                if label_cols:
+                    return " / ".join(str(row[c]) for c in label_cols)
+                return "first row" if row is first else "last row"
+
+            df = pd.DataFrame([{
+                "from": point(first),
+                "to": point(last),
+                f"{metric_col} (start)": first[metric_col],
+                f"{metric_col} (end)": last[metric_col],
+                "change": change,
+                "change %": change / first[metric_col] * 100 if first[metric_col] else None,
+            }])
+        elif q.sort:
+            df = df.sort_values(metric_col, ascending=q.sort == "asc")
+
+        if date_col is not None and date_col in df.columns:
+            df[date_col] = df[date_col].dt.date
+        limit = min(q.limit or TABLE_MAX_ROWS, TABLE_MAX_ROWS)
+        if len(df) > limit:
+            # keep an evenly spaced sample of long histories, the head otherwise
+            df = df.iloc[[round(i * (len(df) - 1) / (limit - 1)) for i in range(limit)]] \
+                if date_col is not None and not q.sort and limit > 1 else df.head(limit)
+
+        fund = table["fund_name"] or (self.matcher.funds.get(keys[0]) if keys else None)
+        if fund:
+            df.insert(0, "fund", fund)
+        return df.reset_index(drop=True)
+
+    def run(self, q: TableQuery):
+        """TableResult, or None when no table fits the query."""
+        if q is None:
+            return None
+        picks = self.select(q)
+        frames = [self._run_one(t, col, keys, q) for t, col, keys in picks]
+        frames = [f for f in frames if len(f)]
+        if not frames:
+            return None
+        return TableResult(pd.concat(frames, ignore_index=True), [t["id"] for t, _, _ in picks])
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+import answer_cache
+from answer_cache import AnswerCache, normalize_query
+
+VECTORS = {
+    "nav of midcap fund": [1.0, 0.0, 0.0],
+    "what is the nav of midcap fund": [0.99, 0.14, 0.0],
+    "aum of flexi cap fund": [0.0, 0.0, 1.0],
+}
+
+
+def embed_fn(texts):
+    return [np.array(VECTORS[t]) for t in texts]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(answer_cache.time, "time", lambda: now[0])
+    return now
+
+
+def test_normalize_query_ignores_case_spacing_and_trailing_punctuation():
+    assert normalize_query("  NAV of   Midcap Fund?? ") == "nav of midcap fund"
+
+
+def test_exact_hit_is_scoped():
+    cache = AnswerCache(ttl=0, similarity_threshold=0)
+    cache.put("NAV of Midcap Fund", "global:v1", "10.5")
+    assert cache.get("nav of midcap fund?", "global:v1")["match"] == "exact"
+    assert cache.get("nav of midcap fund", "global:v2") is None
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = AnswerCache(ttl=60, similarity_threshold=0)
+    cache.put("NAV of Midcap Fund", "s", "10.5")
+    clock[0] += 59
+    assert cache.get("NAV of Midcap Fund", "s")["answer"] == "10.5"
+    clock[0] += 2
+    assert cache.get("NAV of Midcap Fund", "s") is None
+    assert cache.stats()["expired"] == 1 and cache.stats()["entries"] == 0
+
+
+def test_similar_query_hits_above_the_threshold_only():
+    cache = AnswerCache(ttl=0, similarity_threshold=0.95, embed_fn=embed_fn)
+    cache.put("NAV of Midcap Fund", "s", "10.5")
+    hit = cache.get("What is the NAV of Midcap Fund", "s")
+    assert hit["match"] == "similar" and hit["similarity"] >= 0.95
+    assert cache.get("AUM of Flexi Cap Fund", "s") is None
+    assert cache.get("What is the NAV of Midcap Fund", "other scope") is None
+
+
+def test_lru_eviction_and_hit_rate():
+    cache = AnswerCache(ttl=0, max_entries=2, similarity_threshold=0)
+    for q in ("a", "b"):
+        cache.put(q, "s", q.upper())
+    cache.get("a", "s")          # a is now the most recently used
+    cache.put("c", "s", "C")     # evicts b
+    assert cache.get("b", "s") is None
+    assert cache.get("a", "s")["answer"] == "A"
+    stats = cache.stats()
+    assert stats["evicted"] == 1 and stats["hit_rate"] == pytest.approx(2 / 3)
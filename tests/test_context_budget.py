@@ -0,0 +1,47 @@
+from context_budget import assemble_context, dedupe_hits, estimate_tokens
+
+
+def row(source, fund, period="1 Year", value="12.5%"):
+    return (f"Context: {source} | Section: {fund}\n"
+            f"### Performance | Regular Plan\n"
+            f"- **Period**: {period}\n"
+            f"- **Return**: {value}")
+
+
+def test_same_row_from_another_monthly_file_is_a_duplicate():
+    hits = [(row("jan.xlsx", "Midcap Fund"), 0.2), (row("feb.xlsx", "Midcap Fund"), 0.1)]
+    kept = dedupe_hits(hits)
+    assert kept == [hits[0]]
+
+
+def test_identical_rows_of_two_funds_are_both_kept():
+    hits = [(row("jan.xlsx", "Midcap Fund"), 0.1), (row("jan.xlsx", "Flexi Cap Fund"), 0.2)]
+    assert dedupe_hits(hits) == hits
+
+
+def test_rows_differing_in_a_value_are_both_kept():
+    hits = [(row("jan.xlsx", "Midcap Fund", value="12.5%"), 0.1),
+            (row("feb.xlsx", "Midcap Fund", value="13.1%"), 0.2)]
+    assert dedupe_hits(hits) == hits
+
+
+def test_near_identical_headers_are_deduped_below_the_threshold():
+    a = row("jan.xlsx", "Midcap Fund")
+    b = a.replace("### Performance | Regular Plan", "### Performance | Regular Plan (%)")
+    assert len(dedupe_hits([(a, 0.1), (b, 0.2)], near_dup_jaccard=0.5)) == 1
+    assert len(dedupe_hits([(a, 0.1), (b, 0.2)], near_dup_jaccard=1)) == 2
+
+
+def test_cross_fund_comparison_keeps_both_funds_in_context():
+    hits = [(row("jan.xlsx", "Midcap Fund"), 0.1), (row("jan.xlsx", "Flexi Cap Fund"), 0.2)]
+    context, stats = assemble_context(hits, token_budget=1000)
+    assert "Midcap Fund" in context and "Flexi Cap Fund" in context
+    assert stats["duplicates"] == 0
+
+
+def test_packing_respects_the_token_budget():
+    hits = [(row(f"m{i}.xlsx", f"Fund {i}", value=f"{i}%"), i) for i in range(20)]
+    budget = 120
+    context, stats = assemble_context(hits, token_budget=budget)
+    assert estimate_tokens(context) <= budget
+    assert 0 < stats["packed"] < 20
@@ -0,0 +1,52 @@
+import numpy as np
+
+from embedding_cache import EmbeddingCache
+
+
+def fake_embed(calls):
+    def embed(texts):
+        calls.extend(texts)
+        return [np.full(4, len(t), dtype=np.float32) for t in texts]
+    return embed
+
+
+def test_misses_are_embedded_once_and_persisted(tmp_path):
+    calls = []
+    cache = EmbeddingCache("model", cache_dir=tmp_path)
+    vectors = cache.embed(["a", "bb", "a"], fake_embed(calls))
+    assert calls == ["a", "bb"]
+    assert vectors[:, 0].tolist() == [1, 2, 1]
+    cache.save()
+
+    calls.clear()
+    reloaded = EmbeddingCache("model", cache_dir=tmp_path)
+    reloaded.embed(["bb"], fake_embed(calls))
+    assert calls == [] and reloaded.hits == 1
+
+
+def test_concurrent_writers_keep_each_others_entries(tmp_path):
+    # two processes loaded the (empty) cache, then both save
+    first, second = EmbeddingCache("model", cache_dir=tmp_path), EmbeddingCache("model", cache_dir=tmp_path)
+    first.embed(["from first"], fake_embed([]))
+    second.embed(["from second"], fake_embed([]))
+    first.save()
+    second.save()
+
+    calls = []
+    EmbeddingCache("model", cache_dir=tmp_path).embed(["from first", "from second"], fake_embed(calls))
+    assert calls == []
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["model.npz", "model.npz.lock"]
+
+
+def test_save_evicts_least_recently_used(tmp_path):
+    cache = EmbeddingCache("model", cache_dir=tmp_path, max_entries=2)
+    embed = fake_embed([])
+    cache.embed(["old"], embed)
+    cache.embed(["newer"], embed)
+    cache.embed(["newest"], embed)
+    cache.save()
+    assert cache.stats()["entries"] == 2 and cache.evicted == 1
+
+    calls = []
+    EmbeddingCache("model", cache_dir=tmp_path).embed(["newer", "newest"], fake_embed(calls))
+    assert calls == []
@@ -0,0 +1,45 @@
+from chunk_fields import fund_key
+from entity_filter import EntityMatcher
+
+NAMES = [
+    "Motilal Oswal Midcap Fund",
+    "Motilal Oswal Large and Midcap Fund",
+    "Motilal Oswal Flexi Cap Fund",
+    "Motilal Oswal Ultra Short Term Fund",
+]
+FUNDS = {fund_key(n): n for n in NAMES}
+MIDCAP, LARGE_MIDCAP, FLEXI, ULTRA = (fund_key(n) for n in NAMES)
+
+
+def test_match_funds_prefers_the_most_specific_name():
+    m = EntityMatcher(FUNDS)
+    assert m.match_funds("NAV of Motilal Oswal Midcap Fund") == [MIDCAP]
+    assert m.match_funds("NAV of the large and midcap fund") == [LARGE_MIDCAP]
+    # shared words ("motilal", "oswal") alone name no fund
+    assert m.match_funds("Motilal Oswal funds") == []
+
+
+def test_where_for_one_fund_is_an_equality():
+    assert EntityMatcher(FUNDS).where_for("top holdings of the flexi cap fund") == {"fund_key": FLEXI}
+
+
+def test_where_for_several_funds_uses_in():
+    where = EntityMatcher(FUNDS).where_for("compare flexi cap and ultra short term")
+    assert where == {"fund_key": {"$in": sorted([FLEXI, ULTRA])}}
+
+
+def test_where_for_adds_the_month_range():
+    where = EntityMatcher(FUNDS).where_for("flexi cap NAV in March 2024")
+    assert where == {"$and": [
+        {"fund_key": FLEXI},
+        {"as_of": {"$gte": 20240301}},
+        {"as_of": {"$lte": 20240331}},
+    ]}
+
+
+def test_no_entities_no_filter():
+    m = EntityMatcher(FUNDS)
+    assert m.where_for("what is an expense ratio") is None
+    # a bare year (or a word that merely contains a month) is not a date filter
+    assert m.match_date_range("market 2024") is None
+    assert m.match_date_range("decline 2023") is None
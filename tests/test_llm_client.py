@@ -0,0 +1,85 @@
+import pytest
+
+from llm_client import LLMClient, LLMError
+from openrouter_stub import start_stub_server, stub_completion
+
+
+@pytest.fixture
+def stub():
+    server, url = start_stub_server()
+    yield server, url
+    server.shutdown()
+
+
+def client(url, **kwargs):
+    # backoff_base=0: retries without sleeping
+    return LLMClient(base_url=url, api_key="stub", backoff_base=0, **kwargs)
+
+
+def test_chat_returns_the_completion_and_records_usage(stub):
+    _, url = stub
+    c = client(url)
+    result = c.chat("hello")
+    assert result.text == stub_completion("hello")
+    assert result.attempts == 1 and result.completion_tokens > 0
+    assert c.metrics()["calls"] == 1 and c.metrics()["errors"] == 0
+
+
+def test_retryable_status_is_retried_until_out_of_attempts(stub):
+    server, url = stub
+    server.stub_config.fail_rate, server.stub_config.fail_status = 1.0, 503
+    c = client(url, max_retries=2)
+    with pytest.raises(LLMError) as e:
+        c.chat("hello")
+    assert e.value.status == 503 and e.value.attempts == 3
+    assert server.stub_config.requests == 3
+    assert c.metrics()["retries"] == 2 and c.metrics()["errors"] == 1
+
+
+def test_flaky_upstream_succeeds_after_retries(stub):
+    server, url = stub
+    server.stub_config.fail_rate = 0.5
+    c = client(url, max_retries=20)
+    results = [c.chat(f"q{i}") for i in range(10)]
+    assert sum(r.attempts for r in results) == server.stub_config.requests > 10
+
+
+def test_client_errors_are_not_retried(stub):
+    server, url = stub
+    server.stub_config.fail_rate, server.stub_config.fail_status = 1.0, 400
+    with pytest.raises(LLMError) as e:
+        client(url, max_retries=3).chat("hello")
+    assert e.value.status == 400 and e.value.attempts == 1
+
+
+def test_connection_errors_are_retried_then_wrapped():
+    with pytest.raises(LLMError) as e:
+        client("http://127.0.0.1:9/api/v1", max_retries=1).chat("hello")
+    assert e.value.status is None and e.value.attempts == 2
+
+
+def test_invalid_url_fails_at_once_as_llm_error():
+    with pytest.raises(LLMError) as e:
+        client("http://[bad/api/v1", max_retries=3).chat("hello")
+    assert e.value.attempts == 1
+
+
+def test_backoff_is_full_jitter_capped_and_honours_retry_after():
+    c = LLMClient(backoff_base=0.5, backoff_max=4)
+    assert all(0 <= c._backoff(attempt) <= min(4, 0.5 * 2 ** attempt) for attempt in range(8) for _ in range(20))
+    assert c._backoff(0, retry_after=2.5) == 2.5
+    assert c._backoff(0, retry_after=60) == 4
+
+
+def test_stream_matches_chat_and_releases_its_slot(stub):
+    _, url = stub
+    c = client(url, max_concurrency=1)
+    assert "".join(c.stream_chat("hello")) == stub_completion("hello")
+    recent = c.metrics()["recent"][-1]
+    assert recent["ttft"] is not None
+    # abandoning a stream early gives the slot back too
+    tokens = c.stream_chat("hello again")
+    next(tokens)
+    tokens.close()
+    assert c._slots.acquire(timeout=1)
+    c.release_slot()
@@ -0,0 +1,67 @@
+from lexical_index import LexicalIndex, LexicalIndexBuilder
+from retrieval import rrf_fuse, search
+
+
+def _matches(meta, where):
+    return all(meta.get(k) == v for k, v in where.items())
+
+
+class FakeCollection:
+    """collection.query / collection.get over a dict, `where` as {field: value}."""
+
+    def __init__(self, rows):
+        self.rows = rows    # id -> (document, metadata, distance to every query)
+
+    def query(self, query_texts, n_results, include, where=None):
+        ids = [cid for cid, (_, meta, _) in self.rows.items() if where is None or _matches(meta, where)]
+        ids = sorted(ids, key=lambda cid: self.rows[cid][2])[:n_results]
+        return {
+            "ids": [list(ids) for _ in query_texts],
+            "documents": [[self.rows[cid][0] for cid in ids] for _ in query_texts],
+            "distances": [[self.rows[cid][2] for cid in ids] for _ in query_texts],
+        }
+
+    def get(self, ids, include, where=None):
+        ids = [cid for cid in ids if where is None or _matches(self.rows[cid][1], where)]
+        return {"ids": ids, "documents": [self.rows[cid][0] for cid in ids]}
+
+
+ROWS = {
+    "a1": ("Midcap Fund NAV 10.5", {"fund_key": "midcap"}, 0.2),
+    "a2": ("Midcap Fund AUM 900", {"fund_key": "midcap"}, 0.4),
+    "b1": ("Flexi Cap Fund NAV per unit 22.1", {"fund_key": "flexi"}, 0.1),
+    "b2": ("Flexi Cap Fund NAV per unit 23.0", {"fund_key": "flexi"}, 0.3),
+}
+
+
+def _lexical(tmp_path):
+    builder = LexicalIndexBuilder()
+    for cid, (doc, _, _) in ROWS.items():
+        builder.add(cid, doc)
+    builder.save(tmp_path / "bm25")
+    return LexicalIndex(tmp_path / "bm25")
+
+
+def test_rrf_fuse_rewards_agreement():
+    fused = rrf_fuse([["a", "b", "c"], ["b", "c", "d"]], k=60)
+    assert [cid for cid, _ in fused][:2] == ["b", "c"]
+    assert {cid for cid, _ in fused} == {"a", "b", "c", "d"}
+
+
+def test_search_fuses_lexical_hits(tmp_path):
+    res = search(FakeCollection(ROWS), ["NAV per unit"], 4, lexical=_lexical(tmp_path))
+    assert set(res["ids"][0]) == set(ROWS)
+    assert all(d < 0 for d in res["distances"][0])
+
+
+def test_search_drops_lexical_hits_outside_the_filter(tmp_path):
+    # BM25 favours the Flexi Cap rows; the fund filter must still hold
+    res = search(FakeCollection(ROWS), ["Flexi Cap NAV per unit"], 4, where={"fund_key": "midcap"},
+                 lexical=_lexical(tmp_path))
+    assert set(res["ids"][0]) == {"a1", "a2"}
+    assert res["documents"][0] == [ROWS[cid][0] for cid in res["ids"][0]]
+
+
+def test_search_falls_back_when_the_filter_matches_nothing():
+    res = search(FakeCollection(ROWS), ["NAV"], 2, where={"fund_key": "unknown"})
+    assert res["ids"][0] == ["b1", "a1"]
@@ -0,0 +1,67 @@
+import chunker
+from chunk_fields import SECTION_COLUMN, fund_key
+from table_engine import TableQuery, TableStore
+
+MIDCAP, FLEXI = "Motilal Oswal Midcap Fund", "Motilal Oswal Flexi Cap Fund"
+
+
+def fund_table(table_id, fund, columns, rows, sheet="Performance"):
+    return {"table_id": table_id, "fields": {"fund_key": fund_key(fund), "fund_name": fund},
+            "sheet_name": sheet, "columns": columns, "rows": rows}
+
+
+def performance_record(fund):
+    table = [(r, row) for r, row in enumerate([
+        ["Period", "Scheme Return (%)", "Benchmark (%)"],
+        ["Regular Plan - Growth Option"],
+        ["1 Year", 12.5, 10.1],
+        ["3 Years", 20.2, 15.0],
+        ["Direct Plan - Growth Option"],
+        ["1 Year", 13.9, 10.1],
+    ], start=5)]
+    columns, subheaders, data_rows, sections = chunker.split_table(table)
+    record = chunker.table_to_record(columns, subheaders, data_rows, "factsheet", "Performance", [fund], sections)
+    record["table_id"] = f"{fund} performance"
+    return record
+
+
+def test_chunker_keeps_plan_labels_as_a_column():
+    record = performance_record(MIDCAP)
+    assert record["columns"][0] == SECTION_COLUMN
+    assert [row[:2] for row in record["rows"]] == [
+        ["Regular Plan - Growth Option", "1 Year"],
+        ["Regular Plan - Growth Option", "3 Years"],
+        ["Direct Plan - Growth Option", "1 Year"],
+    ]
+
+
+def test_result_rows_carry_their_plan():
+    store = TableStore([performance_record(MIDCAP)])
+    result = store.run(TableQuery.from_dict({"funds": [MIDCAP], "metric": "Scheme Return", "topic": "performance"}))
+    assert list(result.frame.columns[:3]) == ["fund", SECTION_COLUMN, "Period"]
+    assert result.frame[SECTION_COLUMN].tolist()[-1] == "Direct Plan - Growth Option"
+
+
+def test_each_fund_gets_a_table_that_contains_it():
+    store = TableStore([
+        fund_table("midcap nav", MIDCAP, ["Date", "NAV"], [["2024-01-31", 10.0], ["2024-02-29", 11.0]], "NAV"),
+        # row-level table that only has Flexi Cap rows but matches the query better
+        {"table_id": "nav per unit", "fields": {}, "sheet_name": "NAV per unit performance",
+         "columns": ["Scheme Name", "Date", "NAV per unit"], "rows": [[FLEXI, "2024-01-31", 5.0]]},
+        fund_table("flexi misc", FLEXI, ["Date", "Units"], [["2024-01-31", 1.0]], "misc"),
+    ])
+    q = TableQuery.from_dict({"funds": [MIDCAP, FLEXI], "metric": "NAV per unit", "topic": "nav performance"})
+    picks = {keys[0]: t["id"] for t, _, keys in store.select(q)}
+    assert picks == {fund_key(MIDCAP): "midcap nav", fund_key(FLEXI): "nav per unit"}
+    assert set(store.run(q).frame["fund"]) == {MIDCAP, FLEXI}
+
+
+def test_query_without_funds_spans_every_matching_table():
+    store = TableStore([
+        performance_record(MIDCAP),
+        performance_record(FLEXI),
+        fund_table("midcap portfolio", MIDCAP, ["Company", "% to Net Assets"], [["HDFC Bank", 4.2]], "Portfolio"),
+    ])
+    q = TableQuery.from_dict({"funds": [], "metric": "Scheme Return", "topic": "performance", "aggregate": "max"})
+    assert sorted(t["id"] for t, _, _ in store.select(q)) == [f"{FLEXI} performance", f"{MIDCAP} performance"]
+    assert sorted(store.run(q).frame["fund"]) == [FLEXI, MIDCAP]
@@ -0,0 +1,263 @@
+# tracing.py
+"""
+Per-query stage tracing and process-wide latency metrics.
+
+A Trace collects spans (stage, start offset, duration, attributes such as
+prompt / completion sizes and chunk counts) for one query; the orchestrator
+appends it to the query's log as JSON. Stages used by the query path:
+
+  router                  routing decision (cache / local / LLM)
+  chroma.query            each collection.query (filtered, and its fallback)
+  chroma.get, bm25.search hybrid retrieval lookups
+  retrieval               one retrieve_hits* call, end to end
+  context.pack            assemble_context
+  table.run               TableStore.run
+  llm.<call type>         each LLM call (router_planner, simple_answer, ...)
+  log.write               writing the per-query log
+  query                   the whole query
+
+Every finished span is also folded into STAGE_METRICS, which keeps the last
+METRICS_WINDOW durations per stage and renders p50 / p95 (plus counts, sums
+and size counters) in the Prometheus text format:
+
+  - METRICS_FILE (default logs/metrics.prom), rewritten after each query, for
+    node_exporter's textfile collector or a quick `cat`
+  - GET /metrics on the query API (query_api.py)
+
+The active trace travels in a contextvar, so helpers deep in the pipeline
+(retrieval, the LLM wrappers) add spans without a trace argument; wrap work
+handed to a thread pool with bind() so its spans land in the same trace.
+"""
+import os
+import json
+import time
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent
+
+TRACING = os.getenv("TRACING", "1") == "1"
+METRICS_WINDOW = int(os.getenv("METRICS_WINDOW", "1024"))
+# "" disables the textfile
+METRICS_FILE = os.getenv("METRICS_FILE", str(Path(os.getenv("LOGS_DIR", BASE_DIR / "logs")) / "metrics.prom"))
+
+QUANTILES = (0.5, 0.95)
+# numeric span attributes that are also summed per stage
+COUNTED_ATTRS = ("prompt_chars", "completion_chars", "prompt_tokens", "completion_tokens", "chunks")
+
+_current = contextvars.ContextVar("rag_trace", default=None)
+
+
+# =========================
+# AGGREGATED METRICS
+# =========================
+def quantile(sorted_values, q):
+    """Nearest-rank quantile of an ascending list."""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, max(0, round(q * len(sorted_values)) - 1))]
+
+
+class StageMetrics:
+    def __init__(self, window=None):
+        self.window = window or METRICS_WINDOW
+        self._lock = threading.Lock()
+        self._recent = {}        # stage -> deque of seconds
+        self._count = {}
+        self._sum = {}
+        self._errors = {}
+        self._counters = {}      # (stage, attr) -> total
+
+    def reset(self):
+        with self._lock:
+            for d in (self._recent, self._count, self._sum, self._errors, self._counters):
+                d.clear()
+
+    def observe(self, stage, seconds, attrs=None):
+        with self._lock:
+            if stage not in self._recent:
+                self._recent[stage] = deque(maxlen=self.window)
+                self._count[stage] = 0
+                self._sum[stage] = 0.0
+                self._errors[stage] = 0
+            self._recent[stage].append(seconds)
+            self._count[stage] += 1
+            self._sum[stage] += seconds
+            for k, v in (attrs or {}).items():
+                if k == "error":
+                    self._errors[stage] += 1
+                elif k in COUNTED_ATTRS and isinstance(v, (int, float)):
+                    self._counters[(stage, k)] = self._counters.get((stage, k), 0) + v
+
+    def snapshot(self) -> dict:
+        """stage -> {count, sum, errors, max, p50, p95} (seconds)."""
+        with self._lock:
+            recent = {s: sorted(d) for s, d in self._recent.items()}
+            out = {s: {"count": self._count[s], "sum": self._sum[s], "errors": self._errors[s]} for s in recent}
+        for s, values in recent.items():
+            out[s]["max"] = values[-1] if values else 0.0
+            for q in QUANTILES:
+                out[s][f"p{round(q * 100)}"] = quantile(values, q)
+        return out
+
+    def prometheus_text(self) -> str:
+        snap = self.snapshot()
+        with self._lock:
+            counters = dict(self._counters)
+
+        lines = [
+            "# HELP rag_stage_duration_seconds Query pipeline stage latency "
+            f"(quantiles over the last {self.window} observations).",
+            "# TYPE rag_stage_duration_seconds summary",
+        ]
+        for stage in sorted(snap):
+            s = snap[stage]
+            for q in QUANTILES:
+                lines.append(f'rag_stage_duration_seconds{{stage="{stage}",quantile="{q}"}} '
+                             f'{s[f"p{round(q * 100)}"]:.6f}')
+            lines.append(f'rag_stage_duration_seconds_sum{{stage="{stage}"}} {s["sum"]:.6f}')
+            lines.append(f'rag_stage_duration_seconds_count{{stage="{stage}"}} {s["count"]}')
+
+        lines += ["# HELP rag_stage_errors_total Stage executions that raised.",
+                  "# TYPE rag_stage_errors_total counter"]
+        lines += [f'rag_stage_errors_total{{stage="{stage}"}} {snap[stage]["errors"]}' for stage in sorted(snap)]
+
+        for attr in COUNTED_ATTRS:
+            rows = sorted((stage, v) for (stage, a), v in counters.items() if a == attr)
+            if rows:
+                lines += [f"# HELP rag_{attr}_total Sum of {attr} per stage.",
+                          f"# TYPE rag_{attr}_total counter"]
+                lines += [f'rag_{attr}_total{{stage="{stage}"}} {v:g}' for stage, v in rows]
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path=None):
+        path = METRICS_FILE if path is None else path
+        if not path:
+            return
+        path = Path(path)
+        tmp = path.with_name(path.name + ".tmp")
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp.write_text(self.prometheus_text(), encoding="utf-8")
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"Error writing metrics file {path}: {e}")
+
+
+STAGE_METRICS = StageMetrics()
+
+
+# =========================
+# PER-QUERY TRACE
+# =========================
+class Trace:
+    def __init__(self, qid=None, metrics=None):
+        self.qid = qid
+        self.metrics = STAGE_METRICS if metrics is None else metrics
+        self.started = datetime.now(timezone.utc)
+        self.attrs = {}
+        self.spans = []
+        self._t0 = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._t0
+
+    def record(self, stage, start, seconds, attrs):
+        with self._lock:
+            self.spans.append({
+                "stage": stage,
+                "start_ms": round((start - self._t0) * 1000, 1),
+                "ms": round(seconds * 1000, 1),
+                "thread": threading.current_thread().name,
+                **attrs,
+            })
+
+    def stage_totals(self) -> dict:
+        totals = {}
+        with self._lock:
+            spans = list(self.spans)
+        for s in spans:
+            t = totals.setdefault(s["stage"], {"count": 0, "ms": 0.0})
+            t["count"] += 1
+            t["ms"] = round(t["ms"] + s["ms"], 1)
+        return totals
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s["start_ms"])
+        return {
+            "qid": self.qid,
+            "started": self.started.isoformat(),
+            "total_ms": round(self.elapsed() * 1000, 1),
+            **self.attrs,
+            "stages": self.stage_totals(),
+            "spans": spans,
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2, ensure_ascii=False, default=str)
+
+    def summary(self) -> str:
+        """One line: total and per-stage milliseconds."""
+        parts = [f"{stage} {t['ms']:.0f}ms" + (f" x{t['count']}" if t["count"] > 1 else "")
+                 for stage, t in self.stage_totals().items()]
+        return f"{self.elapsed() * 1000:.0f}ms total: " + ", ".join(parts)
+
+
+def current_trace():
+    return _current.get()
+
+
+@contextmanager
+def span(stage, **attrs):
+    """
+    Times the block as one `stage` span of the active trace (if any) and in
+    STAGE_METRICS. Yields the attribute dict, so the block can add results
+    (sizes, counts) before the span closes.
+    """
+    if not TRACING:
+        yield attrs
+        return
+    start = time.perf_counter()
+    try:
+        yield attrs
+    except BaseException as e:
+        attrs["error"] = type(e).__name__
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        trace = _current.get()
+        if trace is not None:
+            trace.record(stage, start, seconds, attrs)
+            trace.metrics.observe(stage, seconds, attrs)
+        else:
+            STAGE_METRICS.observe(stage, seconds, attrs)
+
+
+@contextmanager
+def start_trace(qid=None, metrics=None, write_textfile=True):
+    """
+    Makes a new Trace active for the block; records the `query` stage and
+    refreshes METRICS_FILE (unless write_textfile=False, e.g. on an event loop).
+    """
+    trace = Trace(qid, metrics)
+    token = _current.set(trace)
+    try:
+        with span("query"):
+            yield trace
+    finally:
+        _current.reset(token)
+        if TRACING and write_textfile:
+            trace.metrics.write_textfile()
+
+
+def bind(fn):
+    """fn running in a copy of the caller's context (active trace included), for thread pools."""
+    ctx = contextvars.copy_context()
+    return lambda *args, **kwargs: ctx.copy().run(fn, *args, **kwargs)
+
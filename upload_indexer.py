@@ -0,0 +1,277 @@
+# upload_indexer.py
+"""
+Background indexing of uploaded workbooks.
+
+UploadIndexer.submit() saves the upload and queues a job; worker threads run
+
+  chunk   chunker.process_excel_file, in a worker process (openpyxl parsing is
+          CPU-bound and would otherwise hold the GIL against the UI); workers
+          are spawned, not forked, and only import chunker (no model, torch
+          or server threads)
+  embed   render + embed chunk batches through the shared EmbeddingCache
+  index   write batches to a per-upload Chroma collection, then the side
+          indexes (fund catalog, BM25, tables) the query path uses
+
+and report per-stage progress on the UploadJob, which the UI polls.
+
+Jobs are keyed by the sha256 of the file's bytes: submitting the same content
+again returns the existing job (or, after a restart, the finished index on
+disk recorded in {root}/{job_id}/job.json) instead of re-indexing it.
+
+Layout per upload:  {root}/{job_id}/excel/<file>.xlsx
+                    {root}/{job_id}/chunks/
+                    {root}/{job_id}/chroma/
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+
+import chromadb
+
+import chunker
+from chunk_fields import extract_fields, fields_to_metadata
+from chunk_store import iter_chunks, iter_table_records, chunk_id, chunk_to_markdown
+from embedding_backends import embedding_cache_key
+from embedding_cache import EmbeddingCache
+from entity_filter import save_fund_index
+from lexical_index import LexicalIndexBuilder, lexical_index_dir
+from table_engine import save_tables
+
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "1"))
+UPLOAD_BATCH_SIZE = int(os.getenv("UPLOAD_BATCH_SIZE", "256"))
+# 0 runs the chunk stage in the worker thread (e.g. where processes can't fork)
+UPLOAD_CHUNK_IN_PROCESS = os.getenv("UPLOAD_CHUNK_IN_PROCESS", "1") == "1"
+JOB_FILE = "job.json"
+MAX_JOB_LOG_LINES = 200
+
+STAGES = ("chunk", "embed", "index")
+
+
+@dataclass
+class UploadJob:
+    job_id: str
+    filename: str
+    upload_dir: str
+    collection_name: str
+    status: str = "queued"             # queued | running | done | failed
+    stage: str = None
+    progress: dict = field(default_factory=lambda: {s: [0, 0] for s in STAGES})   # stage -> [done, total]
+    chunks: int = 0
+    error: str = None
+    created: float = field(default_factory=time.time)
+    started: float = None
+    finished: float = None
+    log: list = field(default_factory=list)
+
+    @property
+    def excel_path(self):
+        return Path(self.upload_dir) / "excel" / self.filename
+
+    @property
+    def chunks_dir(self):
+        return Path(self.upload_dir) / "chunks"
+
+    @property
+    def chroma_dir(self):
+        return Path(self.upload_dir) / "chroma"
+
+    @property
+    def active(self):
+        return self.status in ("queued", "running")
+
+    def fraction(self) -> float:
+        """Overall progress in [0, 1], stages weighted equally."""
+        parts = [d / t if t else (1.0 if self.status == "done" else 0.0) for d, t in self.progress.values()]
+        return sum(parts) / len(parts)
+
+    def describe(self) -> str:
+        if self.status != "running":
+            return self.status if not self.error else f"{self.status}: {self.error}"
+        done, total = self.progress[self.stage]
+        return f"{self.stage} {done}/{total}" if total else self.stage
+
+
+def content_id(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:16]
+
+
+class UploadIndexer:
+    def __init__(self, root, embed_fn, workers=None, render=None):
+        self.root = Path(root)
+        self.embed_fn = embed_fn
+        self.render = render or chunk_to_markdown
+        self._jobs = {}
+        self._lock = threading.Lock()
+        # one embedding cache for every job of this process (loading it is a full read of the .npz)
+        self._cache = None
+        self._pool = ThreadPoolExecutor(max_workers=workers or UPLOAD_WORKERS, thread_name_prefix="upload-index")
+        # forking this threaded process (torch / OpenMP state, the model, HTTP
+        # clients) can deadlock the child and copies the model into it
+        self._chunk_pool = ProcessPoolExecutor(
+            max_workers=workers or UPLOAD_WORKERS, mp_context=multiprocessing.get_context("spawn"),
+        ) if UPLOAD_CHUNK_IN_PROCESS else None
+
+    # =========================
+    # QUEUE
+    # =========================
+    def submit(self, filename: str, data: bytes, root=None) -> UploadJob:
+        """Queues an upload (deduplicated by content) and returns its job."""
+        job_id = content_id(data)
+        upload_dir = Path(root or self.root) / job_id
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and job.status != "failed":
+                return job
+
+            job = self._load_finished(upload_dir) or UploadJob(
+                job_id=job_id,
+                filename=Path(filename).name,
+                upload_dir=str(upload_dir),
+                collection_name=f"upload_{job_id}",
+            )
+            self._jobs[job_id] = job
+            if job.status == "done":
+                return job
+
+        job.excel_path.parent.mkdir(parents=True, exist_ok=True)
+        job.excel_path.write_bytes(data)
+        self._log(job, f"queued {job.filename} ({len(data)} bytes)")
+        self._pool.submit(self._run, job)
+        return job
+
+    def get(self, job_id):
+        """The job, or a finished index on disk (e.g. indexed by another process sharing root)."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                job = self._load_finished(self.root / job_id)
+                if job is not None:
+                    self._jobs[job_id] = job
+            return job
+
+    def jobs(self):
+        with self._lock:
+            return sorted(self._jobs.values(), key=lambda j: j.created, reverse=True)
+
+    @staticmethod
+    def _load_finished(upload_dir):
+        try:
+            with open(Path(upload_dir) / JOB_FILE, encoding="utf-8") as f:
+                job = UploadJob(**json.load(f))
+        except (FileNotFoundError, TypeError, ValueError):
+            return None
+        return job if job.status == "done" and job.chroma_dir.is_dir() else None
+
+    # =========================
+    # WORKER
+    # =========================
+    def _log(self, job, msg):
+        line = f"[{time.strftime('%H:%M:%S')}] {msg}"
+        job.log.append(line)
+        del job.log[:-MAX_JOB_LOG_LINES]
+
+    def _set_stage(self, job, stage, total=0):
+        job.stage = stage
+        job.progress[stage] = [0, total]
+
+    def _advance(self, job, stage, n):
+        job.progress[stage][0] += n
+
+    def _run(self, job):
+        job.status, job.started = "running", time.time()
+        try:
+            # -------- chunk
+            self._set_stage(job, "chunk", 1)
+            t0 = time.perf_counter()
+            if self._chunk_pool is not None:
+                _, n, err, _ = self._chunk_pool.submit(
+                    chunker._chunk_file_job, str(job.excel_path), str(job.chunks_dir)
+                ).result()
+                if err:
+                    raise RuntimeError(err)
+            else:
+                n = chunker.process_excel_file(str(job.excel_path), out_dir=str(job.chunks_dir))
+            job.chunks = n
+            self._advance(job, "chunk", 1)
+            self._log(job, f"chunked {n} rows in {time.perf_counter() - t0:.1f}s")
+            if not n:
+                raise RuntimeError("no data rows found in workbook")
+
+            # -------- embed + index, batch by batch
+            records = []
+            for fp, c in iter_chunks(job.chunks_dir):
+                doc = self.render(c)
+                if doc:
+                    meta = {
+                        "source_file": str(c.get("source_file")),
+                        "sheet_name": str(c.get("sheet_name")),
+                        "excel_row_number": str(c.get("excel_row_number")),
+                        **fields_to_metadata(c.get("fields") or extract_fields(c)),
+                    }
+                    records.append((doc, meta, chunk_id(c)))
+            self._set_stage(job, "embed", len(records))
+            job.progress["index"] = [0, len(records)]
+
+            job.chroma_dir.mkdir(parents=True, exist_ok=True)
+            client = chromadb.PersistentClient(path=str(job.chroma_dir))
+            try:
+                client.delete_collection(job.collection_name)
+            except Exception:
+                pass
+            collection = client.create_collection(name=job.collection_name, embedding_function=self.embed_fn)
+
+            cache = self.embedding_cache()
+            funds, lexical = {}, LexicalIndexBuilder()
+            t0 = time.perf_counter()
+            for start in range(0, len(records), UPLOAD_BATCH_SIZE):
+                batch = records[start:start + UPLOAD_BATCH_SIZE]
+                docs = [d for d, _, _ in batch]
+                job.stage = "embed"
+                vectors = cache.embed(docs, self.embed_fn)
+                self._advance(job, "embed", len(batch))
+
+                job.stage = "index"
+                collection.add(
+                    documents=docs, embeddings=vectors,
+                    metadatas=[m for _, m, _ in batch], ids=[i for _, _, i in batch],
+                )
+                for doc, meta, cid in batch:
+                    lexical.add(cid, doc)
+                    if meta.get("fund_key"):
+                        funds[meta["fund_key"]] = meta["fund_name"]
+                self._advance(job, "index", len(batch))
+            cache.save()
+            self._log(job, f"embedded + indexed {len(records)} chunks in {time.perf_counter() - t0:.1f}s")
+            self._log(job, cache.format_stats())
+
+            save_fund_index(job.chroma_dir, funds)
+            lexical.save(lexical_index_dir(job.chroma_dir))
+            save_tables(job.chroma_dir, iter_table_records(job.chunks_dir))
+
+            job.status, job.stage = "done", None
+        except Exception as e:
+            job.status, job.error = "failed", f"{type(e).__name__}: {e}"
+            self._log(job, f"FAILED: {job.error}")
+        finally:
+            job.finished = time.time()
+            if job.status == "done":
+                self._log(job, f"done in {job.finished - job.started:.1f}s")
+                with open(Path(job.upload_dir) / JOB_FILE, "w", encoding="utf-8") as f:
+                    json.dump(asdict(job), f, indent=2, ensure_ascii=False)
+
+    def embedding_cache(self):
+        with self._lock:
+            if self._cache is None:
+                self._cache = EmbeddingCache(embedding_cache_key())
+            return self._cache
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
+        if self._chunk_pool is not None:
+            self._chunk_pool.shutdown(wait=wait)